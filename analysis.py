@@ -0,0 +1,166 @@
+#
+#    Ceibal Chess - A chess activity for Sugar.
+#    Copyright (C) 2008, 2009 Alejandro Segovia <asegovi@gmail.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+'''Engine analysis of a position, as it is being searched.
+
+Engines report each principal variation they find as an AnalysisLine,
+parsed from their thinking output by parse_uci_info or
+parse_xboard_thinking. Reports can come hundreds of times a second. An
+Analysis keeps only the latest line of every variation, and has them
+shown at most once per INTERVAL.
+'''
+import re
+import time
+import threading
+from collections import namedtuple
+
+#Seconds between two updates of the analysis shown
+INTERVAL = 0.25
+
+#One principal variation: its number (1 for the best), the depth searched,
+#the score in centipawns for the side to move, the moves to mate (negative
+#when mated) or None, the nodes searched so far and per second, and the
+#moves as the engine wrote them.
+AnalysisLine = namedtuple('AnalysisLine',
+		'multipv depth score mate nodes nps pv')
+
+#Words of a UCI info line followed by one value that are not used here
+UCI_SKIPPED = set(['seldepth', 'time', 'currmove', 'currmovenumber',
+		'hashfull', 'tbhits', 'sbhits', 'cpuload', 'refutation'])
+
+def parse_uci_info(line):
+	'''Return the AnalysisLine of a UCI "info" line, or None if it has no
+	principal variation.'''
+	words = line.split()
+	values = {'multipv': 1, 'depth': 0, 'score': 0, 'mate': None,
+			'nodes': 0, 'nps': 0, 'pv': None}
+	i = 1
+	while i < len(words):
+		word = words[i]
+		if word == 'pv':
+			values['pv'] = words[i + 1:]
+			break
+		elif word == 'string':
+			break
+		elif word == 'score':
+			#score cp <x> or mate <y>, maybe followed by a bound
+			if words[i + 1] == 'mate':
+				values['mate'] = int(words[i + 2])
+			else:
+				values['score'] = int(words[i + 2])
+			i += 3
+		elif word in ('multipv', 'depth', 'nodes', 'nps'):
+			values[word] = int(words[i + 1])
+			i += 2
+		elif word in UCI_SKIPPED:
+			i += 2
+		else:
+			i += 1
+	if not values['pv']:
+		return None
+	return AnalysisLine(**values)
+
+#ply, score, time, nodes and moves; GNU Chess puts a dot after the ply
+XBOARD_THINKING = re.compile(r'^\s*(\d+)\.?\s+(-?\d+)\s+(\d+)\s+(\d+)\s+(.*\S)')
+
+def parse_xboard_thinking(line, ticks=100):
+	'''Return the AnalysisLine of an xboard thinking output line, or None
+	if line is not one. ticks is the number of time units per second:
+	the protocol has centiseconds.'''
+	match = XBOARD_THINKING.match(line)
+	if not match:
+		return None
+	depth, score, elapsed, nodes = [int(x) for x in match.groups()[:4]]
+	nps = elapsed and nodes * ticks / elapsed or 0
+	return AnalysisLine(1, depth, score, None, nodes, nps,
+			match.group(5).split())
+
+class Analysis(object):
+	'''The latest AnalysisLine of every principal variation of one
+	position, handed over to the thread showing them at a capped rate.
+
+	Engines call update, from any thread. post is then called, with the
+	analysis, when there is something new to show, but no more than once
+	per interval and not before take is called for the previous post:
+	however chatty the engine, there is never more than one update
+	waiting to be shown.
+	'''
+	def __init__(self, post, sign=1, interval=INTERVAL):
+		'''Create a new instance of Analysis. sign turns scores for the
+		side to move into scores for white: 1 if white moves, else -1.'''
+		self.post = post
+		self.sign = sign
+		self.interval = interval
+		self.lines = {}
+		self.lock = threading.Lock()
+		#whether there are lines not taken yet, whether a post is waiting
+		#for take, and when it was made
+		self.dirty = False
+		self.posted = False
+		self.posted_at = 0
+		self.closed = False
+
+	def update(self, line):
+		'''Store the AnalysisLine line, replacing the previous line of its
+		variation.'''
+		self.lock.acquire()
+		try:
+			self.lines[line.multipv] = line
+			self.dirty = True
+			post = self._should_post()
+		finally:
+			self.lock.release()
+		if post:
+			self.post(self)
+
+	def flush(self):
+		'''Post the lines held back by the interval, once it is over. To be
+		called regularly, for instance every frame.'''
+		self.lock.acquire()
+		try:
+			post = self._should_post()
+		finally:
+			self.lock.release()
+		if post:
+			self.post(self)
+
+	def _should_post(self):
+		now = time.time()
+		if self.closed or not self.dirty or self.posted or \
+			now - self.posted_at < self.interval:
+			return False
+		self.posted = True
+		self.posted_at = now
+		return True
+
+	def take(self):
+		'''Return the latest line of every variation, best first, with
+		scores for white.'''
+		self.lock.acquire()
+		try:
+			self.dirty = self.posted = False
+			lines = [self.lines[x] for x in sorted(self.lines)]
+		finally:
+			self.lock.release()
+		sign = self.sign
+		return [x._replace(score=x.score * sign,
+				mate=x.mate and x.mate * sign) for x in lines]
+
+	def close(self):
+		'''Stop posting: the position is no longer shown.'''
+		self.closed = True
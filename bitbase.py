@@ -0,0 +1,433 @@
+#
+#    Ceibal Chess - A chess activity for Sugar.
+#    Copyright (C) 2008, 2009 Alejandro Segovia <asegovi@gmail.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+'''Endgame bitbases: whether the side with the extra pieces wins a king
+versus king ending, for every placement of the pieces.
+
+A bitbase holds one bit per position, set if the strong side wins with
+best play and clear if the position is a draw (or cannot happen). The
+strong side is always stored as white: positions where it is black are
+flipped top to bottom. Bit number
+
+	(((side * 64 + strong king) * 64 + weak king) * 64 + piece) ...
+
+where side is 0 when the strong side is to move and 1 otherwise, and
+squares are cell numbers (row * 8 + column, see board.SQUARE_BIT), gives
+the result of a position. Files are raw bit arrays, lowest bit first,
+named after the ending (e.g. KQK.bin), and are read through mmap.
+
+Bitbases are built offline by retrograde analysis:
+
+	python -m bitbase [--jobs N] [--dir DIR] [ENDING ...]
+
+First every position is classified on its own on a process pool: illegal,
+drawn because the weak king can capture or is stalemated, won because it
+is checkmated, or else undecided with the number of moves the weak king
+has. Then won positions are unmoved backwards: a position where the
+strong side can move into a win is won, and a position where the weak
+side is to move is won once all of its moves have been shown to lose.
+KPK positions where the pawn crowns are looked up in KQK and KRK, which
+must be built first.
+'''
+import os
+import sys
+import mmap
+import time
+from optparse import OptionParser
+from multiprocessing import Pool, cpu_count
+
+from board import PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, KIND_MASK, \
+		WHITE_COLOR, SQUARE_BIT
+from bitboard import KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, \
+		rook_attacks, bishop_attacks, iter_bits
+
+import logging
+log = logging.getLogger()
+
+#Kinds of the strong side's pieces besides its king, by ending, in
+#increasing kind order.
+ENDINGS = {
+	'KPK': (PAWN,),
+	'KBNK': (KNIGHT, BISHOP),
+	'KRK': (ROOK,),
+	'KQK': (QUEEN,),
+}
+#Build order: KPK needs KQK and KRK for crownings
+BUILD_ORDER = ['KQK', 'KRK', 'KPK', 'KBNK']
+#Endings by the kinds of the strong side's pieces
+ENDINGS_BY_KINDS = dict([(kinds, name) for name, kinds in ENDINGS.items()])
+
+#Results of a probe, for the side to move
+WIN = 1
+DRAW = 0
+LOSS = -1
+
+#Generation states
+UNKNOWN = 0
+WON = 1
+DRAWN = 2
+ILLEGAL = 3
+
+WHITE_PAWN_ATTACKS = PAWN_ATTACKS[WHITE_COLOR]
+
+def index(side, strong_king, weak_king, pieces):
+	'''Return the bit number of a position, see the module documentation.
+	pieces holds the squares of the strong side's other pieces.'''
+	i = (side * 64 + strong_king) * 64 + weak_king
+	for sq in pieces:
+		i = i * 64 + sq
+	return i
+
+def size(name):
+	'''Number of positions in the bitbase of the named ending.'''
+	return 2 * 64 ** (2 + len(ENDINGS[name]))
+
+def _attacked(target, king, kinds, pieces, occ):
+	'''Tell whether the strong side attacks the cell target, given the
+	occupancy occ. A piece standing on target is being captured and does
+	not count.'''
+	if KING_ATTACKS[king] >> target & 1:
+		return True
+	for kind, sq in zip(kinds, pieces):
+		if sq == target:
+			continue
+		if kind == KNIGHT:
+			attacks = KNIGHT_ATTACKS[sq]
+		elif kind == PAWN:
+			attacks = WHITE_PAWN_ATTACKS[sq]
+		elif kind == ROOK:
+			attacks = rook_attacks(sq, occ)
+		elif kind == BISHOP:
+			attacks = bishop_attacks(sq, occ)
+		else:
+			attacks = rook_attacks(sq, occ) | bishop_attacks(sq, occ)
+		if attacks >> target & 1:
+			return True
+	return False
+
+def _weak_moves(king, weak, kinds, pieces, occ):
+	'''Return (moves, capture) for the weak king on weak: the number of its
+	legal moves that capture nothing, and whether it can capture.'''
+	occ &= ~(1 << weak)
+	moves = 0
+	capture = False
+	for to in iter_bits(KING_ATTACKS[weak] & ~KING_ATTACKS[king]):
+		if _attacked(to, king, kinds, pieces, occ | 1 << to):
+			continue
+		if to in pieces:
+			capture = True
+		else:
+			moves += 1
+	return moves, capture
+
+def _legal(king, weak, pieces):
+	'''Tell whether the pieces may stand on these cells at all.'''
+	if weak == king or KING_ATTACKS[king] >> weak & 1:
+		return False
+	if weak in pieces or king in pieces:
+		return False
+	if len(pieces) > 1 and pieces[0] == pieces[1]:
+		return False
+	return True
+
+def _occupancy(king, weak, pieces):
+	occ = 1 << king | 1 << weak
+	for sq in pieces:
+		occ |= 1 << sq
+	return occ
+
+#Per process state of the generation workers: crowning bitbases for KPK
+_crownings = {}
+
+def _classify(task):
+	'''Worker: classify the positions with the given side to move and
+	strong king, on their own. Return (states, counts) strings, one byte
+	per position.'''
+	name, side, king, directory = task
+	kinds = ENDINGS[name]
+	count = 64 ** (1 + len(kinds))
+	states = bytearray(count)
+	counts = bytearray(count)
+	if PAWN in kinds and not _crownings:
+		for crowned in 'KQK', 'KRK':
+			_crownings[crowned] = Bitbase(os.path.join(directory,
+					crowned + '.bin'), crowned)
+
+	i = 0
+	for weak in range(64):
+		for pieces in _placements(len(kinds)):
+			states[i], counts[i] = _classify_one(kinds, side, king, weak,
+					pieces)
+			i += 1
+	return str(states), str(counts)
+
+def _placements(n):
+	'''All ways of placing n pieces, in index order.'''
+	if n == 1:
+		return [(sq,) for sq in range(64)]
+	return [(a, b) for a in range(64) for b in range(64)]
+
+def _classify_one(kinds, side, king, weak, pieces):
+	if not _legal(king, weak, pieces):
+		return ILLEGAL, 0
+	for kind, sq in zip(kinds, pieces):
+		#pawns never stand on the first or last rank
+		if kind == PAWN and not 8 <= sq < 56:
+			return ILLEGAL, 0
+	occ = _occupancy(king, weak, pieces)
+	check = _attacked(weak, king, kinds, pieces, occ)
+
+	if side == 0:
+		#strong side to move: the weak king may not be in check
+		if check:
+			return ILLEGAL, 0
+		if kinds == (PAWN,):
+			return _crowning(king, weak, pieces[0], occ), 0
+		return UNKNOWN, 0
+
+	moves, capture = _weak_moves(king, weak, kinds, pieces, occ)
+	if capture:
+		return DRAWN, 0
+	if not moves:
+		if check:
+			return WON, 0
+		return DRAWN, 0
+	return UNKNOWN, moves
+
+def _crowning(king, weak, pawn, occ):
+	'''Classify a KPK position with the strong side to move by its pawn
+	crownings: won if crowning to a queen or a rook wins.'''
+	if pawn >= 16:
+		return UNKNOWN
+	to = pawn - 8
+	if occ >> to & 1:
+		return UNKNOWN
+	for name in 'KQK', 'KRK':
+		if _crownings[name].bit(index(1, king, weak, (to,))):
+			return WON
+	return UNKNOWN
+
+def _unmoves_strong(kinds, king, weak, pieces, occ):
+	'''Generate the positions, strong side to move, from which one strong
+	move leads to the given one. The weak king may not be in check in
+	them.'''
+	for to in iter_bits(KING_ATTACKS[king] & ~occ & ~KING_ATTACKS[weak]):
+		new_occ = occ ^ (1 << king) ^ (1 << to)
+		if not _attacked(weak, to, kinds, pieces, new_occ):
+			yield to, pieces
+	for n, kind in enumerate(kinds):
+		sq = pieces[n]
+		if kind == KNIGHT:
+			froms = KNIGHT_ATTACKS[sq] & ~occ
+		elif kind == BISHOP:
+			froms = bishop_attacks(sq, occ) & ~occ
+		elif kind == ROOK:
+			froms = rook_attacks(sq, occ) & ~occ
+		elif kind == QUEEN:
+			froms = (rook_attacks(sq, occ) | bishop_attacks(sq, occ)) & ~occ
+		else:
+			#white pawns move up the board, towards row 0
+			froms = 0
+			if sq < 48 and not occ >> (sq + 8) & 1:
+				froms = 1 << (sq + 8)
+				if 32 <= sq < 40 and not occ >> (sq + 16) & 1:
+					froms |= 1 << (sq + 16)
+		for fro in iter_bits(froms):
+			new_pieces = pieces[:n] + (fro,) + pieces[n + 1:]
+			new_occ = occ ^ (1 << sq) ^ (1 << fro)
+			if not _attacked(weak, king, kinds, new_pieces, new_occ):
+				yield king, new_pieces
+
+def generate(name, directory, pool=None):
+	'''Build the bitbase of the named ending into directory.'''
+	kinds = ENDINGS[name]
+	start = time.time()
+	tasks = [(name, side, king, directory)
+			for side in (0, 1) for king in range(64)]
+	if pool:
+		chunks = pool.map(_classify, tasks, 1)
+	else:
+		chunks = [_classify(task) for task in tasks]
+	states = bytearray(''.join([x[0] for x in chunks]))
+	counts = bytearray(''.join([x[1] for x in chunks]))
+	del chunks
+	log.info("%s: classified in %.1fs", name, time.time() - start)
+
+	half = len(states) // 2
+	queue = [i for i in xrange(len(states)) if states[i] == WON]
+	shift = 6 * len(kinds)
+	while queue:
+		i = queue.pop()
+		side = i >= half
+		rest = i - side * half
+		pieces = tuple([(rest >> (6 * (len(kinds) - 1 - n))) & 63
+				for n in range(len(kinds))])
+		weak = (rest >> shift) & 63
+		king = rest >> (shift + 6)
+		occ = _occupancy(king, weak, pieces)
+		if side:
+			#weak side to move and lost: the strong side wins by moving here
+			for king_from, pieces_from in _unmoves_strong(kinds, king, weak,
+					pieces, occ):
+				j = index(0, king_from, weak, pieces_from)
+				if states[j] == UNKNOWN:
+					states[j] = WON
+					queue.append(j)
+		else:
+			#strong side to move and won: every weak move leading here
+			#is one losing move less for the weak side
+			for weak_from in iter_bits(KING_ATTACKS[weak] & ~occ &
+					~KING_ATTACKS[king]):
+				j = index(1, king, weak_from, pieces)
+				if states[j] == UNKNOWN:
+					counts[j] -= 1
+					if not counts[j]:
+						states[j] = WON
+						queue.append(j)
+
+	bits = bytearray(len(states) // 8)
+	for i in xrange(len(states)):
+		if states[i] == WON:
+			bits[i >> 3] |= 1 << (i & 7)
+	path = os.path.join(directory, name + '.bin')
+	out = open(path, 'wb')
+	try:
+		out.write(bits)
+	finally:
+		out.close()
+	log.info("%s: %d positions won, written to %s in %.1fs", name,
+			states.count(chr(WON)), path, time.time() - start)
+	return path
+
+class Bitbase(object):
+	'''One ending's bitbase file, read through mmap.'''
+
+	def __init__(self, path, name):
+		self.name = name
+		self.kinds = ENDINGS[name]
+		self.file = open(path, 'rb')
+		self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+		if len(self.map) * 8 != size(name):
+			self.close()
+			raise IOError("%s has the wrong size for %s" % (path, name))
+
+	def bit(self, i):
+		return ord(self.map[i >> 3]) >> (i & 7) & 1
+
+	def close(self):
+		if self.map:
+			self.map.close()
+			self.map = None
+		if self.file:
+			self.file.close()
+			self.file = None
+
+class Bitbases(object):
+	'''The bitbases found in a directory, probed with Board positions.'''
+
+	def __init__(self, directory):
+		'''Open every bitbase file in directory.'''
+		self.bitbases = {}
+		for name in ENDINGS:
+			path = os.path.join(directory, name + '.bin')
+			if os.path.exists(path):
+				try:
+					self.bitbases[name] = Bitbase(path, name)
+				except (IOError, EnvironmentError), ex:
+					log.error("Cannot open bitbase %s: %s", path, ex)
+
+	@staticmethod
+	def open_default():
+		'''Open the bitbases shipped with the activity, in bitbases/, or
+		return None if there are none.'''
+		try:
+			path = os.path.join(os.environ["SUGAR_BUNDLE_PATH"], "bitbases")
+		except KeyError:
+			path = "bitbases"
+		bitbases = Bitbases(path)
+		if not bitbases.bitbases:
+			return None
+		return bitbases
+
+	def close(self):
+		for bitbase in self.bitbases.values():
+			bitbase.close()
+		self.bitbases = {}
+
+	def probe(self, board):
+		'''Return WIN, DRAW or LOSS for the side to move on board, or None
+		if there is no bitbase for its material.'''
+		white, black = board.white, board.black
+		if len(white.piece_squares) + len(black.piece_squares) > 4:
+			return None
+		if len(black.piece_squares) == 1:
+			strong = white
+		elif len(white.piece_squares) == 1:
+			strong = black
+		else:
+			return None
+
+		squares = board.squares
+		pieces = []
+		for sq in strong.piece_squares:
+			kind = squares[sq] & KIND_MASK
+			if kind != KING:
+				pieces.append((kind, SQUARE_BIT[sq]))
+		pieces.sort()
+		name = ENDINGS_BY_KINDS.get(tuple([x[0] for x in pieces]))
+		bitbase = self.bitbases.get(name)
+		if bitbase is None:
+			return None
+
+		#the strong side is stored as white, moving up the board
+		flip = strong is black and 56 or 0
+		king = SQUARE_BIT[strong.king_square] ^ flip
+		weak = SQUARE_BIT[strong.enemy.king_square] ^ flip
+		cells = tuple([x[1] ^ flip for x in pieces])
+		side = board.current_turn is not strong and 1 or 0
+		if not bitbase.bit(index(side, king, weak, cells)):
+			return DRAW
+		if side:
+			return LOSS
+		return WIN
+
+def main(argv):
+	parser = OptionParser(usage='python -m bitbase [options] [ENDING ...]')
+	parser.add_option('--jobs', type='int', default=cpu_count(),
+			help='number of processes (default: one per core)')
+	parser.add_option('--dir', default='bitbases',
+			help='directory to write the bitbases to (default bitbases)')
+	options, args = parser.parse_args(argv)
+	names = args or BUILD_ORDER
+	for name in names:
+		if name not in ENDINGS:
+			parser.error('unknown ending %s, choose from %s' %
+					(name, ', '.join(BUILD_ORDER)))
+
+	logging.basicConfig(level=logging.INFO)
+	if not os.path.isdir(options.dir):
+		os.makedirs(options.dir)
+	pool = None
+	if options.jobs > 1:
+		pool = Pool(options.jobs)
+	for name in [x for x in BUILD_ORDER if x in names]:
+		generate(name, options.dir, pool)
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
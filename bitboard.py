@@ -0,0 +1,350 @@
+#
+#    Ceibal Chess - A chess activity for Sugar.
+#    Copyright (C) 2008, 2009 Alejandro Segovia <asegovi@gmail.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+'''Bitboard move generation backend.
+
+A bitboard is a 64 bit integer with one bit per cell, bit number
+row * 8 + column (so bit 0 is column 0, row 0, like board[0, 0]). Knight,
+king and pawn attacks come from precomputed tables. Sliding attacks are
+looked up per line (rank, file, diagonal and anti-diagonal): for every
+square and line, a table maps the occupancy of the inner cells of that line
+to the cells attacked along it. Python dicts act as a perfect hash here, so
+there is no need to search for magic multipliers.
+
+Boards created with Board(..., movegen=BITBOARD) keep a BitBoards instance
+up to date from Board.set_piece and use it for Board.legal_move_codes.
+Cell numbers are the ones packed moves use (see board.encode_move), so moves
+are generated without converting squares.
+
+This does not make move generation an order of magnitude faster than the
+mailbox generator, which already packs its moves too. Over the perft
+suite positions it generates moves about 1.5 to 1.8 times as fast, and
+perft to depth 3 runs 1.2 to 1.6 times as fast, since performing moves
+costs the same with both. Most of the time goes to interpreting the
+bit loops: lists in place of the line dicts would need an index computed
+from the occupancy, which costs more in Python than the dict lookup.
+'''
+from board import PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, \
+		WHITE_COLOR, BLACK_COLOR, COLOR_MASK, SQUARES, LEFT, RIGHT, \
+		MOVE_EN_PASSANT, MOVE_CASTLING, MOVE_CROWNINGS, KINGSIDE_RIGHTS, \
+		QUEENSIDE_RIGHTS
+
+#(column, row) of each bit number
+BIT_POS = [(i & 7, i >> 3) for i in range(64)]
+
+def bit_index(sq):
+	'''Return the bit number of the 0x88 square index sq.'''
+	return (sq + (sq & 7)) >> 1
+
+def iter_bits(bb):
+	'''Iterate over the bit numbers set in bb, lowest first.'''
+	while bb:
+		low = bb & -bb
+		yield low.bit_length() - 1
+		bb ^= low
+
+def _on_board(c, r):
+	return 0 <= c < 8 and 0 <= r < 8
+
+def _jumps(deltas):
+	table = []
+	for i in range(64):
+		c, r = BIT_POS[i]
+		bb = 0
+		for dc, dr in deltas:
+			if _on_board(c + dc, r + dr):
+				bb |= 1 << ((r + dr) * 8 + c + dc)
+		table.append(bb)
+	return table
+
+KNIGHT_ATTACKS = _jumps([(1, 2), (2, 1), (2, -1), (1, -2),
+		(-1, -2), (-2, -1), (-2, 1), (-1, 2)])
+KING_ATTACKS = _jumps([(1, 0), (1, 1), (0, 1), (-1, 1),
+		(-1, 0), (-1, -1), (0, -1), (1, -1)])
+#Cells attacked by a pawn of the given colour standing on each cell. White
+#pawns move up the board (towards row 0), black ones down.
+PAWN_ATTACKS = {
+	WHITE_COLOR: _jumps([(-1, -1), (1, -1)]),
+	BLACK_COLOR: _jumps([(-1, 1), (1, 1)]),
+}
+
+def _ray(i, dc, dr, occ):
+	'''Cells attacked from bit i towards (dc, dr), stopping at the first
+	occupied cell of occ.'''
+	c, r = BIT_POS[i]
+	bb = 0
+	c, r = c + dc, r + dr
+	while _on_board(c, r):
+		bit = 1 << (r * 8 + c)
+		bb |= bit
+		if occ & bit:
+			break
+		c, r = c + dc, r + dr
+	return bb
+
+def _line_tables(dirs):
+	'''Build the mask and attack tables for the line through each cell
+	made by the two opposite directions in dirs.
+
+	The mask holds the cells of the line that may block a slider, which
+	excludes the cell itself and the last cell in each direction. The
+	attack table maps every subset of the mask to the attacked cells.
+
+	'''
+	masks, attacks = [], []
+	for i in range(64):
+		mask = 0
+		for dc, dr in dirs:
+			mask |= _ray(i, dc, dr, 0) & ~_edge(i, dc, dr)
+		table = {}
+		sub = 0
+		while True:
+			bb = 0
+			for dc, dr in dirs:
+				bb |= _ray(i, dc, dr, sub)
+			table[sub] = bb
+			sub = (sub - mask) & mask
+			if not sub:
+				break
+		masks.append(mask)
+		attacks.append(table)
+	return masks, attacks
+
+def _edge(i, dc, dr):
+	'''Last cell of the ray from i towards (dc, dr), or 0 if none.'''
+	ray = _ray(i, dc, dr, 0)
+	if not ray:
+		return 0
+	c, r = BIT_POS[i]
+	while _on_board(c + dc, r + dr):
+		c, r = c + dc, r + dr
+	return 1 << (r * 8 + c)
+
+RANK_MASK, RANK_ATTACKS = _line_tables([(1, 0), (-1, 0)])
+FILE_MASK, FILE_ATTACKS = _line_tables([(0, 1), (0, -1)])
+DIAG_MASK, DIAG_ATTACKS = _line_tables([(1, 1), (-1, -1)])
+ANTI_MASK, ANTI_ATTACKS = _line_tables([(1, -1), (-1, 1)])
+
+def rook_attacks(i, occ):
+	'''Cells attacked by a rook on bit i given the occupancy occ.'''
+	return RANK_ATTACKS[i][occ & RANK_MASK[i]] | \
+			FILE_ATTACKS[i][occ & FILE_MASK[i]]
+
+def bishop_attacks(i, occ):
+	'''Cells attacked by a bishop on bit i given the occupancy occ.'''
+	return DIAG_ATTACKS[i][occ & DIAG_MASK[i]] | \
+			ANTI_ATTACKS[i][occ & ANTI_MASK[i]]
+
+def _between_and_lines():
+	between = [[0] * 64 for i in range(64)]
+	lines = [[0] * 64 for i in range(64)]
+	for i in range(64):
+		for dc, dr in [(1, 0), (0, 1), (1, 1), (1, -1)]:
+			full = _ray(i, dc, dr, 0) | _ray(i, -dc, -dr, 0) | 1 << i
+			for sign in (1, -1):
+				c, r = BIT_POS[i]
+				bb = 0
+				c, r = c + sign * dc, r + sign * dr
+				while _on_board(c, r):
+					j = r * 8 + c
+					between[i][j] = bb
+					lines[i][j] = full
+					bb |= 1 << j
+					c, r = c + sign * dc, r + sign * dr
+	return between, lines
+
+#BETWEEN[i][j]: cells strictly between i and j if they share a line.
+#LINE[i][j]: the whole line through i and j, if they share one.
+BETWEEN, LINE = _between_and_lines()
+
+class BitBoards(object):
+	'''Bitboard view of a Board, kept in sync by Board.set_piece.
+
+	pieces holds one bitboard per piece code (see board.KIND_MASK), colors
+	one per player colour, and occupied the union of them all.
+
+	'''
+	def __init__(self, board):
+		self.board = board
+		self.pieces = [0] * (COLOR_MASK + 1)
+		self.colors = {WHITE_COLOR: 0, BLACK_COLOR: 0}
+		self.occupied = 0
+		for sq in SQUARES:
+			if board.squares[sq]:
+				self.update(sq, 0, board.squares[sq])
+
+	def update(self, sq, old, new):
+		'''Replace the piece code old by new at the 0x88 square sq.'''
+		bit = 1 << ((sq + (sq & 7)) >> 1)
+		if old:
+			self.pieces[old] ^= bit
+			self.colors[old & COLOR_MASK] ^= bit
+			self.occupied ^= bit
+		if new:
+			self.pieces[new] ^= bit
+			self.colors[new & COLOR_MASK] ^= bit
+			self.occupied ^= bit
+
+	def attackers(self, i, occ, color):
+		'''Return the bitboard of color's pieces attacking bit i when the
+		board occupancy is occ.'''
+		pieces = self.pieces
+		queens = pieces[QUEEN | color]
+		return (KNIGHT_ATTACKS[i] & pieces[KNIGHT | color]) | \
+			(KING_ATTACKS[i] & pieces[KING | color]) | \
+			(PAWN_ATTACKS[color ^ COLOR_MASK][i] & pieces[PAWN | color]) | \
+			(rook_attacks(i, occ) & (pieces[ROOK | color] | queens)) | \
+			(bishop_attacks(i, occ) & (pieces[BISHOP | color] | queens))
+
+	def legal_codes(self, owner, moves):
+		'''Append all of owner's legal moves, packed as integers, to the
+		array moves and return it. These are the same moves the mailbox
+		generator of Board.legal_move_codes finds.'''
+		pieces = self.pieces
+		color = owner.color
+		enemy = owner.enemy.color
+		us = self.colors[color]
+		occ = self.occupied
+
+		king_bb = pieces[KING | color]
+		k = king_bb.bit_length() - 1
+		checkers = self.attackers(k, occ, enemy)
+
+		#King moves: the destination must not be attacked once the king has
+		#left its cell, so that it cannot retreat along a checking ray.
+		for t in iter_bits(KING_ATTACKS[k] & ~us):
+			if not self.attackers(t, occ ^ king_bb, enemy):
+				moves.append(k | t << 6)
+
+		if checkers & (checkers - 1):
+			#Double check, only the king may move
+			return moves
+
+		if checkers:
+			c = checkers.bit_length() - 1
+			targets = (checkers | BETWEEN[k][c]) & ~us
+		else:
+			targets = ~us
+			self._castlings(owner, k, occ, moves)
+
+		#Pinned pieces may only move along the line joining them to their king
+		pins = {}
+		snipers = (rook_attacks(k, 0) &
+				(pieces[ROOK | enemy] | pieces[QUEEN | enemy])) | \
+			(bishop_attacks(k, 0) &
+				(pieces[BISHOP | enemy] | pieces[QUEEN | enemy]))
+		for s in iter_bits(snipers):
+			blockers = BETWEEN[k][s] & occ
+			if blockers and not blockers & (blockers - 1) and blockers & us:
+				pins[blockers.bit_length() - 1] = LINE[k][s]
+
+		for i in iter_bits(pieces[KNIGHT | color]):
+			if i in pins:
+				continue
+			for t in iter_bits(KNIGHT_ATTACKS[i] & targets):
+				moves.append(i | t << 6)
+
+		for kind, attacks in ((BISHOP, bishop_attacks), (ROOK, rook_attacks),
+				(QUEEN, None)):
+			for i in iter_bits(pieces[kind | color]):
+				if kind == QUEEN:
+					dests = rook_attacks(i, occ) | bishop_attacks(i, occ)
+				else:
+					dests = attacks(i, occ)
+				dests &= targets
+				if i in pins:
+					dests &= pins[i]
+				for t in iter_bits(dests):
+					moves.append(i | t << 6)
+
+		self._pawn_moves(owner, k, targets, pins, moves)
+		return moves
+
+	def _pawn_moves(self, owner, k, targets, pins, moves):
+		board = self.board
+		pieces = self.pieces
+		color = owner.color
+		enemy = owner.enemy.color
+		them = self.colors[enemy]
+		occ = self.occupied
+		step = owner.pawn_dir * 8
+		start_row = owner.rank + owner.pawn_dir
+		last_row = owner.enemy.rank
+		ep_row = owner.enemy.rank + owner.enemy.pawn_dir * 3
+		ep = board.ep_square
+		if ep is not None:
+			ep = bit_index(ep)
+
+		for i in iter_bits(pieces[PAWN | color]):
+			fro = BIT_POS[i]
+			allowed = targets
+			if i in pins:
+				allowed &= pins[i]
+			dests = PAWN_ATTACKS[color][i] & them & allowed
+			ahead = 1 << (i + step)
+			if not ahead & occ:
+				dests |= ahead & allowed
+				if fro[1] == start_row:
+					double = 1 << (i + 2 * step)
+					if not double & occ:
+						dests |= double & allowed
+			for t in iter_bits(dests):
+				if t >> 3 == last_row:
+					for flags in MOVE_CROWNINGS:
+						moves.append(i | t << 6 | flags)
+				else:
+					moves.append(i | t << 6)
+
+			if fro[1] != ep_row or ep is None:
+				continue
+			for dir in LEFT, RIGHT:
+				c = fro[0] + dir
+				if 0 <= c < 8 and i + dir + step == ep and \
+					pieces[PAWN | enemy] >> (i + dir) & 1:
+					self._en_passant(owner, k, i, i + dir, dir, moves)
+
+	def _en_passant(self, owner, k, i, j, dir, moves):
+		'''Add the en passant capture of the pawn on bit j by the one on bit
+		i, if it does not leave the king in check. Two pawns leave their
+		row at once, so this is tested on the resulting occupancy rather
+		than with the pin tables.'''
+		t = j + owner.pawn_dir * 8
+		occ = (self.occupied ^ (1 << i) ^ (1 << j)) | (1 << t)
+		if self.attackers(k, occ, owner.enemy.color) & ~(1 << j):
+			return
+		moves.append(i | t << 6 | MOVE_EN_PASSANT)
+
+	def _castlings(self, owner, k, occ, moves):
+		board = self.board
+		enemy = owner.enemy.color
+		sq = owner.rank << 4 | 4
+		rights = board.castling_rights
+		if BIT_POS[k] != (4, owner.rank) or not rights:
+			return
+		rook = ROOK | owner.color
+		for side, right, rook_sq, empty, safe in (
+				(RIGHT, KINGSIDE_RIGHTS, sq + 3, (1, 2), (1, 2)),
+				(LEFT, QUEENSIDE_RIGHTS, sq - 4, (-1, -2, -3), (-1, -2))):
+			if not rights & right[owner.color] or \
+				board.squares[rook_sq] != rook:
+				continue
+			if any(occ & (1 << (k + d)) for d in empty):
+				continue
+			if any(self.attackers(k + d, occ, enemy) for d in safe):
+				continue
+			moves.append(k | (k + 2 * side) << 6 | MOVE_CASTLING)
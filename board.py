@@ -16,10 +16,13 @@
 #    along with this program; if not, write to the Free Software
 #    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 #
-import os
-import time
+from array import array
 from cell import Cell
-from errors import MoveError
+from errors import MoveError, FenError
+from positioncache import PositionCache, PositionInfo
+from zobrist import RANDOM64, RANDOM_CASTLE, RANDOM_EN_PASSANT, RANDOM_TURN, \
+		piece_key
+from psqt import square_value
 import logging
 log = logging.getLogger()
 
@@ -36,14 +39,175 @@ WHITE_PAWN_DIR = UP
 BLACK_RANK = 0
 BLACK_PAWN_DIR = DOWN
 
+#Piece codes stored in Board.squares. The low three bits hold the kind of
+#piece and the next two bits the colour of its owner, so that
+#code & player.color tells whether a square holds one of player's pieces.
+EMPTY = 0
+PAWN = 1
+KNIGHT = 2
+BISHOP = 3
+ROOK = 4
+QUEEN = 5
+KING = 6
+KIND_MASK = 7
+
+WHITE_COLOR = 8
+BLACK_COLOR = 16
+COLOR_MASK = WHITE_COLOR | BLACK_COLOR
+
+#Piece values in centipawns, by kind. Exchanges (see Board.see) give the
+#king a value above all the others put together, since it can only
+#capture onto an undefended square.
+PIECE_VALUES = [0] * (KIND_MASK + 1)
+PIECE_VALUES[PAWN] = 100
+PIECE_VALUES[KNIGHT] = 320
+PIECE_VALUES[BISHOP] = 330
+PIECE_VALUES[ROOK] = 500
+PIECE_VALUES[QUEEN] = 900
+PIECE_VALUES[KING] = 0
+SEE_VALUES = list(PIECE_VALUES)
+SEE_VALUES[KING] = 20000
+
+#Move generation backends, see Board.__init__
+MAILBOX = 'mailbox'
+BITBOARD = 'bitboard'
+
+def square(pos):
+	'''Return the 0x88 square index of the (column, row) position pos.'''
+	return pos[1] << 4 | pos[0]
+
+#(column, row) position of every 0x88 square index. Entries for the squares
+#that fall off the board (sq & 0x88) are never used.
+SQUARE_POS = [(sq & 7, sq >> 4) for sq in range(128)]
+
+#All 0x88 square indices that lie on the board, in row-major order.
+SQUARES = [sq for sq in range(128) if not sq & 0x88]
+
+#Cell number, row * 8 + column, of every 0x88 square index and back. Only
+#meaningful for the squares on the board.
+SQUARE_BIT = [(sq + (sq & 7)) >> 1 for sq in range(128)]
+BIT_SQUARE = [i + (i & 56) for i in range(64)]
+
+#Moves are generated as 16 bit integers rather than Move instances (see
+#encode_move): bits 0-5 hold the cell number the piece moves from, bits 6-11
+#the one it moves to and bits 12-15 the flags below. A crowning keeps the
+#index of the new piece in CROWNING_KINDS in bits 12-13.
+MOVE_FLAGS = 0xf000
+MOVE_EN_PASSANT = 1 << 12
+MOVE_CASTLING = 2 << 12
+MOVE_CROWNING = 8 << 12
+MOVE_CROWNINGS = [MOVE_CROWNING | i << 12 for i in range(4)]
+CROWNING_KINDS = (QUEEN, ROOK, BISHOP, KNIGHT)
+
+def encode_move(fro_sq, to_sq, flags=0):
+	'''Pack a move from and to the 0x88 squares fro_sq and to_sq.'''
+	return SQUARE_BIT[fro_sq] | SQUARE_BIT[to_sq] << 6 | flags
+
+def move_squares(code):
+	'''Return the 0x88 squares a packed move goes from and to.'''
+	return BIT_SQUARE[code & 63], BIT_SQUARE[code >> 6 & 63]
+
+#Square deltas in the 0x88 board: one row is 16 squares apart.
+DIR_N = -16
+DIR_S =  16
+DIR_W =  -1
+DIR_E =   1
+
+DIR_NE = DIR_N + DIR_E
+DIR_NW = DIR_N + DIR_W
+DIR_SE = DIR_S + DIR_E
+DIR_SW = DIR_S + DIR_W
+
+DIRS_DIAGONALS = [DIR_NE, DIR_NW, DIR_SE, DIR_SW]
+DIRS_HORIZONTALS = [DIR_E, DIR_W, DIR_S, DIR_N]
+DIRS_ALL = DIRS_HORIZONTALS + DIRS_DIAGONALS
+
+KNIGHT_JUMPS = [2*DIR_N + DIR_E, 2*DIR_N + DIR_W, 2*DIR_S + DIR_E,
+		2*DIR_S + DIR_W, 2*DIR_E + DIR_N, 2*DIR_E + DIR_S,
+		2*DIR_W + DIR_N, 2*DIR_W + DIR_S]
+
+#Castling rights, as bits of Board.castling_rights
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+#FEN letters of the castling rights, in the order FEN lists them
+FEN_CASTLINGS = [(WHITE_KINGSIDE, 'K'), (WHITE_QUEENSIDE, 'Q'),
+		(BLACK_KINGSIDE, 'k'), (BLACK_QUEENSIDE, 'q')]
+
+#Castling rights of each colour, by the side the king castles to
+KINGSIDE_RIGHTS = {WHITE_COLOR: WHITE_KINGSIDE, BLACK_COLOR: BLACK_KINGSIDE}
+QUEENSIDE_RIGHTS = {WHITE_COLOR: WHITE_QUEENSIDE,
+		BLACK_COLOR: BLACK_QUEENSIDE}
+
+#(right, king square, rook square, colour) for each castling right
+CASTLINGS = [
+	(WHITE_KINGSIDE, WHITE_RANK << 4 | 4, WHITE_RANK << 4 | 7, WHITE_COLOR),
+	(WHITE_QUEENSIDE, WHITE_RANK << 4 | 4, WHITE_RANK << 4, WHITE_COLOR),
+	(BLACK_KINGSIDE, BLACK_RANK << 4 | 4, BLACK_RANK << 4 | 7, BLACK_COLOR),
+	(BLACK_QUEENSIDE, BLACK_RANK << 4 | 4, BLACK_RANK << 4, BLACK_COLOR),
+]
+
+#Castling rights kept by a move from or to each square: moving a king or
+#rook away from its home square, or capturing a rook there, loses them.
+CASTLING_KEPT = [15] * 128
+for right, king_sq, rook_sq, color in CASTLINGS:
+	CASTLING_KEPT[king_sq] &= ~right
+	CASTLING_KEPT[rook_sq] &= ~right
+
+#Zobrist keys (see module zobrist) by piece code and square, by castling
+#rights and by en passant column.
+PIECE_KEYS = [[0] * 128 for code in range(COLOR_MASK + 1)]
+for kind in PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING:
+	for color in WHITE_COLOR, BLACK_COLOR:
+		for sq in SQUARES:
+			PIECE_KEYS[kind | color][sq] = piece_key(kind,
+					color == WHITE_COLOR, sq & 7, sq >> 4)
+CASTLING_KEYS = [0] * 16
+for rights in range(16):
+	for i in range(4):
+		if rights & (1 << i):
+			CASTLING_KEYS[rights] ^= RANDOM64[RANDOM_CASTLE + i]
+EN_PASSANT_KEYS = RANDOM64[RANDOM_EN_PASSANT:RANDOM_EN_PASSANT + 8]
+TURN_KEY = RANDOM64[RANDOM_TURN]
+
+#FEN letter of each piece code, and the code of each letter
+FEN_CHARS = [''] * (COLOR_MASK + 1)
+for kind, char in zip((PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING), 'pnbrqk'):
+	FEN_CHARS[kind | WHITE_COLOR] = char.upper()
+	FEN_CHARS[kind | BLACK_COLOR] = char
+FEN_CODES = dict([(char, code) for code, char in enumerate(FEN_CHARS)
+		if char])
+
+#Slots per move on Board.state_stack: castling rights, en passant square
+#and key, halfmove clock and captured piece
+STATE_SIZE = 5
+EMPTY_STATE = (None,) * STATE_SIZE
+
+#Piece-square bonus (see module psqt) by piece code and square, positive
+#for white pieces and negative for black ones.
+PIECE_SQUARE_VALUES = [[0] * 128 for code in range(COLOR_MASK + 1)]
+for kind in PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING:
+	for sq in SQUARES:
+		PIECE_SQUARE_VALUES[kind | WHITE_COLOR][sq] = square_value(kind,
+				True, sq & 7, sq >> 4)
+		PIECE_SQUARE_VALUES[kind | BLACK_COLOR][sq] = -square_value(kind,
+				False, sq & 7, sq >> 4)
+
 class Player(object):
-	def __init__(self, name, rank, pawn_dir):
+	def __init__(self, name, rank, pawn_dir, color):
 		self.name = name
-		self.en_passant = None
 		self.enemy = None
 		self.rank = rank
-		self.castling_performed = False
 		self.pawn_dir = pawn_dir
+		self.color = color
+		#0x88 squares of this player's pieces and of its king, kept up to
+		#date by Board.set_piece
+		self.piece_squares = set()
+		self.king_square = None
 
 	def __str__(self):
 		return self.name
@@ -55,14 +219,24 @@ class Board(object):
 	themselves.
 
 	A board's individual cells can be accessed using the array subscript
-	operator twice. Eg. board[0][0] contains the cell (instance of class
-	Cell) at the row 0, column 0. Boards are column-major like a 2D
-	coordinate system, meaning board[i][j] will access column i, row j.
+	operator with a position tuple. Eg. board[0, 0] contains the cell
+	(instance of class Cell) at column 0, row 0. Boards are column-major like
+	a 2D coordinate system, meaning board[i, j] will access column i, row j.
 
 	Individual pieces may be accessed through their cells, like so:
-	board[i][j].piece will reference the piece stored at the cell at
+	board[i, j].piece will reference the piece stored at the cell at
 	column i, row j.
 
+	Internally, the contents of the board are kept in a 0x88 mailbox: two
+	flat arrays of 128 entries indexed by square = row * 16 + column.
+	squares is a bytearray holding the piece code of every square (see
+	KIND_MASK and Player.color) and pieces holds the matching piece
+	instances. A square index is off the board whenever square & 0x88 is not
+	zero, which lets move generation step in any direction with a single
+	addition and a single bounds test. Cells are only a view on these arrays
+	kept for the renderer and for picking; pieces should use squares and
+	set_piece instead.
+
 	Boards by default are not hypothetical unless they are created by a call
 	to clone() on an exisiting board. Hypothetical boards are used by the
 	pieces to determine their moves and stop recursion.
@@ -76,29 +250,61 @@ class Board(object):
 	successfully performed.
 
 	'''
-	def __init__(self, width=1, height=1):
+	def __init__(self, width=1, height=1, movegen=MAILBOX):
 		'''Create a new instance of Board.
 
 		Parameters width and height specify
 		the board's visual width and height for rendering purposes.
 
+		Parameter movegen selects how get_all_moves computes legal moves
+		(filter_check=True): MAILBOX asks every piece for its moves and
+		drops the ones that leave the king in check, BITBOARD uses the
+		bitboard generator from module bitboard.
+
 		'''
 		self.w, self.h = width, height
 		self.board = []
+		self.squares = bytearray(128)
+		self.pieces = [None] * 128
+		self.bitboards = None
+
+		#Irreversible state, see push_state. ep_key is the part of the
+		#zobrist key that comes from ep_square, and halfmove_clock counts
+		#the moves since the last capture or pawn move.
+		self.castling_rights = 0
+		self.ep_square = None
+		self.ep_key = 0
+		self.halfmove_clock = 0
+		#STATE_SIZE slots per performed move, of which state_top are in
+		#use: the state above and the piece captured by the move
+		self.state_stack = []
+		self.state_top = 0
+		#Zobrist key of everything but the side to move, see position_key
+		self.zobrist = 0
+		#Evaluation terms kept up to date by set_piece: the material of
+		#each colour and the piece-square bonus of white minus black's.
+		self.material = {WHITE_COLOR: 0, BLACK_COLOR: 0}
+		self.positional = 0
+		self.position_cache = PositionCache()
+		#PositionInfo of the side to move, see legal_move_index
+		self.move_index = None
 		self.move_stack = []
-		self.dirty_cells = []
 
 		self.cells = []
 
-		self.white = Player(WHITE, WHITE_RANK, WHITE_PAWN_DIR)
-		self.black = Player(BLACK, BLACK_RANK, BLACK_PAWN_DIR)
+		self.white = Player(WHITE, WHITE_RANK, WHITE_PAWN_DIR, WHITE_COLOR)
+		self.black = Player(BLACK, BLACK_RANK, BLACK_PAWN_DIR, BLACK_COLOR)
 		self.white.enemy = self.black
 		self.black.enemy = self.white
 		self.players = [self.white, self.black]
+		self.players_by_color = {WHITE_COLOR: self.white,
+				BLACK_COLOR: self.black}
 
 		#Current turn
 		self.current_turn = self.white
 		self.turns = 1
+		#FEN move number: starts at 1 and grows after each black move
+		self.fullmove_number = 1
 
 		#Populate the board with Cells:
 		for i in range(0, 8):
@@ -108,10 +314,17 @@ class Board(object):
 					color = (0, 0, 0)
 				else:
 					color = (255, 255, 255)
-				cell = Cell((i, j), width/8, color)
+				cell = Cell((i, j), width/8, color, self)
 				self.board[i].append(cell)
 				self.cells.append(cell)
 
+		if movegen == BITBOARD:
+			#imported here since bitboard needs piece, which needs board
+			from bitboard import BitBoards
+			self.bitboards = BitBoards(self)
+		elif movegen != MAILBOX:
+			raise Exception("Unknown move generator: %s" % movegen)
+
 	def __getitem__(self, col):
 		'''Overload operator[] so Board cells can be accessed using the
 		boad[column][row] convention.
@@ -119,23 +332,6 @@ class Board(object):
 		'''
 		return self.board[col[0]][col[1]]
 
-	#def on_cell_selected(self, selected_cell):
-	#	'''Handle cell selected events sent by the Board Controller.
-	#
-	#	This will involve determining the movements for the piece in the
-	#	selected cell and updating every destination cell's move list.
-	#
-	#	'''
-	#
-	#	if not selected_cell.piece:
-	#		return
-	#
-	#	moves = selected_cell.piece.get_moves(selected_cell.i, selected_cell.j, self)
-	#	for move in moves:
-	#		col, row = move.to_c, move.to_r
-	#		self.board[col][row].add_move(move)
-	#		self.dirty_cells.append((col,row))
-
 	def can_move_piece_in_cell_to(self, cell, to):
 		'''Determine whether the piece in the cell can move
 		to the (to[0], to[1]) cell in the board.
@@ -146,11 +342,9 @@ class Board(object):
 
 		'''
 		if cell.piece:
-			move = cell.piece.get_move(cell.pos, to, self)
-			return move is not None and \
-					not move.causes_check(self, cell.piece.owner)
-		else:
-			return False
+			return self.legal_move_index(cell.piece.owner).can_move(
+					cell.square, square(to))
+		return False
 
 
 	def move_piece_in_cell_to(self, player, fro, to, **options):
@@ -171,17 +365,16 @@ class Board(object):
 			raise MoveError("Piece at (%d,%d) is not from player %s" %
 													(fro[0], fro[1], player))
 
-		move = self[fro].piece.get_move(fro, to, self, **options)
+		move = self.legal_move_index(player).move(square(fro), square(to),
+				options.get('type'))
 		if not move:
 			raise MoveError(
 			"No moves take from (%d,%d) to (%d,%d) that this piece knows of" %
 				(fro + to))
 
+		self.move_index = None
 		self.move_stack.append(move)
 		move.perform(self)
-
-		#for col,row in self.dirty_cells:
-		#	self.board[col][row].clear_moves()
 		self.next_turn()
 		return move
 
@@ -202,6 +395,7 @@ class Board(object):
 			raise MoveError("Cannot move from (%d,%d) to (%d,%d). No piece there." %
 								(move.fro + move.to))
 
+		self.move_index = None
 		self.move_stack.append(move)
 		move.perform(self)
 		self.next_turn()
@@ -209,29 +403,216 @@ class Board(object):
 
 	def undo_move(self):
 		if self.move_stack:
+			self.move_index = None
 			self.previous_turn()
 			self.move_stack.pop().undo(self)
 
 	def get_all_moves(self, owner, attack_only = False, filter_check=False):
 		'''Get all owner's moves'''
-		#rebuild move cache:
-		all_moves = []
-		for cell in self.cells:
-			if cell.piece and cell.piece.owner == owner:
-				all_moves.extend(cell.piece.get_moves(
-					cell.pos, self, attack_only,
-					filter_check=filter_check))
+		if filter_check and not attack_only:
+			return self.get_legal_moves(owner)
 
-		return all_moves
+		codes = array('H')
+		pieces = self.pieces
+		for sq in owner.piece_squares:
+			pieces[sq].gen_moves(sq, self, codes, attack_only)
+		return self.decode_moves(codes, owner)
+
+	def get_legal_moves(self, owner, fro=None, **options):
+		'''Get owner's legal moves, or only those of owner's piece at
+		position fro if given, as Move instances.
+
+		options may hold the 'type' of piece pawns crown to.
+
+		'''
+		return self.decode_moves(self.legal_move_codes(owner, fro=fro),
+				owner, options.get('type'))
+
+	def legal_move_codes(self, owner, out=None, fro=None):
+		'''Append owner's legal moves, packed as integers (see
+		encode_move), to the array out and return it. A new array is
+		created if out is None. If fro is given, only the moves of the
+		piece at that position are generated.
+
+		The checkers and pinned pieces are found once (see
+		_checks_and_pins), after which every pseudo-legal move from the
+		pieces is accepted or rejected without performing it. Callers that
+		search the move tree should keep one array per ply and empty it
+		between positions, so that no move allocates anything.
+
+		'''
+		if out is None:
+			out = array('H')
+		if self.bitboards and fro is None:
+			return self.bitboards.legal_codes(owner, out)
+
+		if fro is None:
+			froms = owner.piece_squares
+		else:
+			froms = [square(fro)]
+		pieces = self.pieces
+		pseudo = array('H')
+		for sq in froms:
+			pieces[sq].gen_moves(sq, self, pseudo)
+
+		legality = self._checks_and_pins(owner)
+		is_legal = self._is_legal
+		for code in pseudo:
+			if is_legal(code, owner, legality):
+				out.append(code)
+		return out
+
+	def decode_move(self, code, owner=None):
+		'''Return the Move instance for the packed move code of owner, by
+		default the player to move.'''
+		#imported here since piece needs board
+		from piece import decode_move
+		return decode_move(code, owner or self.current_turn)
+
+	def decode_moves(self, codes, owner, type=None):
+		'''Return Move instances for the packed moves in codes. If type
+		is given, crownings to other pieces are left out.'''
+		from piece import decode_moves
+		return decode_moves(codes, owner, type)
+
+	def iter_legal_move_codes(self, owner, fro=None):
+		'''Generate owner's legal moves packed as integers, one at a time,
+		or only those of owner's piece at position fro if given.
+
+		Moves are generated one piece at a time, the king first, and
+		tested for legality as they are asked for, so that callers only
+		wanting the first legal move pay for one or two tests. The board
+		must not change until the generator is exhausted or dropped.
+
+		'''
+		if fro is None:
+			king_sq = owner.king_square
+			froms = [king_sq] + [x for x in owner.piece_squares
+					if x != king_sq]
+		else:
+			froms = [square(fro)]
+		legality = self._checks_and_pins(owner)
+		is_legal = self._is_legal
+		pieces = self.pieces
+		codes = array('H')
+		for sq in froms:
+			del codes[:]
+			pieces[sq].gen_moves(sq, self, codes)
+			for code in codes:
+				if is_legal(code, owner, legality):
+					yield code
+
+	def iter_legal_moves(self, owner, fro=None):
+		'''Same as iter_legal_move_codes, generating Move instances.'''
+		for code in self.iter_legal_move_codes(owner, fro):
+			yield self.decode_move(code, owner)
 
 	def has_moves(self, owner, filter_check=True):
-		for cell in self.cells:
-			piece = cell.piece
-			if piece and piece.owner == owner and \
-			   piece.has_moves(cell.pos, self, filter_check=filter_check):
+		'''Tell whether owner has any move, stopping at the first one
+		found. If filter_check is False, moves leaving the king in check
+		count too.'''
+		if filter_check:
+			for code in self.iter_legal_move_codes(owner):
+				return True
+			return False
+		pieces = self.pieces
+		codes = array('H')
+		for sq in owner.piece_squares:
+			pieces[sq].gen_moves(sq, self, codes)
+			if codes:
 				return True
 		return False
 
+	def _checks_and_pins(self, owner):
+		'''Find what restricts the moves of owner's pieces.
+
+		Returns a (king_sq, evasions, pins) tuple. king_sq is the square of
+		owner's king. evasions is None if the king is not in check,
+		otherwise the set of squares a piece other than the king may move
+		to in order to capture the checker or block its ray (empty on a
+		double check). pins maps the square of every pinned piece to the
+		set of squares it may move to without leaving its pin ray.
+
+		'''
+		squares = self.squares
+		own = owner.color
+		enemy = owner.enemy
+		color = enemy.color
+		king_sq = owner.king_square
+		checkers = []
+		pins = {}
+
+		pawn = PAWN | color
+		fro = king_sq - enemy.pawn_dir * 16
+		for sq in fro - 1, fro + 1:
+			if not sq & 0x88 and squares[sq] == pawn:
+				checkers.append([sq])
+
+		knight = KNIGHT | color
+		for d in KNIGHT_JUMPS:
+			sq = king_sq + d
+			if not sq & 0x88 and squares[sq] == knight:
+				checkers.append([sq])
+
+		queen = QUEEN | color
+		for dirs, slider in ((DIRS_HORIZONTALS, ROOK | color),
+				(DIRS_DIAGONALS, BISHOP | color)):
+			for d in dirs:
+				ray = []
+				pinned = None
+				sq = king_sq + d
+				while not sq & 0x88:
+					ray.append(sq)
+					code = squares[sq]
+					if code & own:
+						if pinned is not None:
+							break
+						pinned = sq
+					elif code:
+						if code == slider or code == queen:
+							if pinned is None:
+								checkers.append(ray)
+							else:
+								pins[pinned] = set(ray)
+						break
+					sq += d
+
+		if not checkers:
+			evasions = None
+		elif len(checkers) == 1:
+			evasions = set(checkers[0])
+		else:
+			evasions = set()
+		return king_sq, evasions, pins
+
+	def _is_legal(self, code, owner, legality):
+		'''Tell whether the packed pseudo-legal move code leaves owner's
+		king safe, given the result of _checks_and_pins for the current
+		position.'''
+		king_sq, evasions, pins = legality
+		fro = BIT_SQUARE[code & 63]
+		to = BIT_SQUARE[code >> 6 & 63]
+		if fro == king_sq:
+			#King.gen_moves only keeps castlings and destinations that
+			#are not attacked. When in check, the destination must also be
+			#safe once the king leaves its square, so that it cannot step
+			#back along the checking ray.
+			if evasions is None:
+				return True
+			squares = self.squares
+			king = squares[king_sq]
+			squares[king_sq] = EMPTY
+			attacked = self.square_attacked(to, owner.enemy)
+			squares[king_sq] = king
+			return not attacked
+		if code & MOVE_FLAGS == MOVE_EN_PASSANT:
+			#two pawns leave the same row, slow path
+			return not self.decode_move(code, owner).causes_check(self, owner)
+		if evasions is not None and to not in evasions:
+			return False
+		allowed = pins.get(fro)
+		return allowed is None or to in allowed
+
 	def get_all_attack_moves(self, owner, piece=None):
 		'''Get all owner's enemy's moves.'''
 		attack_moves = self.get_all_moves(owner, attack_only=True, filter_check=False)
@@ -242,42 +623,540 @@ class Board(object):
 
 	def king_is_checked(self, owner):
 		'''Check whether the king of the given owner is under attack'''
-		#Find the king and all attacks
-		king_pos = self.get_king_position(owner)
-		for move in self.get_all_attack_moves(owner.enemy):
-			if move.to == king_pos:
+		if owner.king_square is None:
+			raise Exception("Error: %s king not found" % owner)
+		return self.square_attacked(owner.king_square, owner.enemy)
+
+	def is_square_attacked(self, pos, by_player):
+		'''Return True if any of by_player's pieces attacks the cell at
+		position pos, whether it is empty or not.'''
+		return self.square_attacked(square(pos), by_player)
+
+	def square_attacked(self, sq, by_player):
+		'''Same as is_square_attacked, for the 0x88 square index sq.
+
+		Rather than generating every enemy move, this looks outwards from
+		sq for the pieces that could reach it: knight jumps, pawn diagonals,
+		adjacent kings and the first piece on each sliding ray. It stops at
+		the first attacker found.
+
+		'''
+		squares = self.squares
+		color = by_player.color
+
+		pawn = PAWN | color
+		fro = sq - by_player.pawn_dir * 16
+		if not (fro - 1) & 0x88 and squares[fro - 1] == pawn or \
+			not (fro + 1) & 0x88 and squares[fro + 1] == pawn:
+			return True
+
+		knight = KNIGHT | color
+		for d in KNIGHT_JUMPS:
+			fro = sq + d
+			if not fro & 0x88 and squares[fro] == knight:
+				return True
+
+		king = KING | color
+		for d in DIRS_ALL:
+			fro = sq + d
+			if not fro & 0x88 and squares[fro] == king:
 				return True
+
+		queen = QUEEN | color
+		for dirs, slider in ((DIRS_HORIZONTALS, ROOK | color),
+				(DIRS_DIAGONALS, BISHOP | color)):
+			for d in dirs:
+				fro = sq + d
+				while not fro & 0x88:
+					code = squares[fro]
+					if code:
+						if code == slider or code == queen:
+							return True
+						break
+					fro += d
 		return False
 
+	def see(self, move):
+		'''Static exchange evaluation: return the material won, in
+		centipawns, by the side playing move (a Move or a packed move) if
+		both sides then keep capturing on its destination with their least
+		valuable piece while it pays off. A negative result means that the
+		move loses material.
+
+		Attackers are looked up outwards from the destination, and the
+		pieces that took part in the exchange are skipped so that sliders
+		behind them (x-rays) join in. Nothing is performed on the board.
+		Pins are not taken into account.
+
+		'''
+		if not isinstance(move, int):
+			move = move.code
+		fro = BIT_SQUARE[move & 63]
+		to = BIT_SQUARE[move >> 6 & 63]
+		flags = move & MOVE_FLAGS
+		if flags == MOVE_CASTLING:
+			return 0
+		squares = self.squares
+		code = squares[fro]
+		removed = set([fro])
+		value = SEE_VALUES[code & KIND_MASK]
+		if flags == MOVE_EN_PASSANT:
+			captured = PIECE_VALUES[PAWN]
+			removed.add(fro & 0x70 | to & 7)
+		else:
+			captured = PIECE_VALUES[squares[to] & KIND_MASK]
+		gain = [captured]
+		if flags & MOVE_CROWNING:
+			value = PIECE_VALUES[CROWNING_KINDS[flags >> 12 & 3]]
+			gain[0] += value - PIECE_VALUES[PAWN]
+
+		color = code & COLOR_MASK ^ COLOR_MASK
+		while True:
+			#value the side to capture gets if it recaptures
+			gain.append(value - gain[-1])
+			if max(-gain[-2], gain[-1]) < 0:
+				break
+			sq = self._least_attacker(to, color, removed)
+			if sq is None:
+				break
+			value = SEE_VALUES[squares[sq] & KIND_MASK]
+			removed.add(sq)
+			color ^= COLOR_MASK
+
+		#each side may stop capturing when it no longer pays off
+		for d in range(len(gain) - 2, 0, -1):
+			gain[d - 1] = -max(-gain[d - 1], gain[d])
+		return gain[0]
+
+	def _least_attacker(self, sq, color, removed):
+		'''Return the square of the least valuable piece of the given
+		colour attacking the 0x88 square sq, ignoring the pieces on the
+		squares in removed, or None.'''
+		squares = self.squares
+		pawn = PAWN | color
+		fro = sq - self.players_by_color[color].pawn_dir * 16
+		for s in fro - 1, fro + 1:
+			if not s & 0x88 and squares[s] == pawn and s not in removed:
+				return s
+
+		knight = KNIGHT | color
+		for d in KNIGHT_JUMPS:
+			s = sq + d
+			if not s & 0x88 and squares[s] == knight and s not in removed:
+				return s
+
+		best, best_value = None, None
+		for dirs, slider in ((DIRS_DIAGONALS, BISHOP), (DIRS_HORIZONTALS, ROOK)):
+			for d in dirs:
+				s = sq + d
+				while not s & 0x88:
+					code = squares[s]
+					if code and s not in removed:
+						kind = code & KIND_MASK
+						if code & color and (kind == slider or kind == QUEEN
+								or kind == KING and s == sq + d):
+							value = SEE_VALUES[kind]
+							if best is None or value < best_value:
+								best, best_value = s, value
+						break
+					s += d
+		return best
+
 	def king_is_checkmated(self, owner):
-		return not self.has_moves(owner, filter_check=True) and \
-				self.king_is_checked(owner)
+		return self.king_is_checked(owner) and \
+				not self.has_moves(owner, filter_check=True)
+
+	def king_is_stalemated(self, owner):
+		return not self.king_is_checked(owner) and \
+				not self.has_moves(owner, filter_check=True)
 
 	def get_king_position(self,owner):
 		'''Find the owner's (white or black) king's position'''
-		for cell in self.cells:
-			if cell.piece and cell.piece.type == "king" and \
-				cell.piece.owner == owner:
-				return cell.pos
-		raise Exception("Error: %s king not found" % owner)
+		if owner.king_square is None:
+			raise Exception("Error: %s king not found" % owner)
+		return SQUARE_POS[owner.king_square]
 
 	def next_turn(self):
 		'''Make the change of turn.'''
 		self.turns += 1
+		if self.current_turn is self.black:
+			self.fullmove_number += 1
 		self.current_turn = self.current_turn.enemy
 		return self.current_turn
 
 	def previous_turn(self):
 		self.turns -= 1
 		self.current_turn = self.current_turn.enemy
+		if self.current_turn is self.black:
+			self.fullmove_number -= 1
 		return self.current_turn
 
 	def put_piece_at(self, piece, pos):
 		if pos[0] < 0 or pos[0] > 7 or pos[1] < 0 or pos[1] > 7:
 			raise Exception("Indices out of board: (%d, %d)" % pos)
 
-		self[pos].piece = piece
-		self.moves_cache_dirty = True
+		self.set_piece(square(pos), piece)
+		self.move_index = None
+
+		#Setting up a position: the kings and rooks standing on their
+		#home squares may castle, until set_state says otherwise.
+		rights = 0
+		for right, king_sq, rook_sq, color in CASTLINGS:
+			if self.squares[king_sq] == KING | color and \
+				self.squares[rook_sq] == ROOK | color:
+				rights |= right
+		self.set_state(rights, self.ep_square, self.halfmove_clock)
+
+	def set_state(self, rights, ep_square=None, halfmove_clock=0):
+		'''Set the castling rights, the en passant square and the halfmove
+		clock of the position being set up, keeping the zobrist key in
+		step.'''
+		key = self.zobrist ^ self.ep_key ^ CASTLING_KEYS[self.castling_rights]
+		self.castling_rights = rights
+		self.ep_square = ep_square
+		self.ep_key = 0
+		if ep_square is not None:
+			#the pawn that just made a double step stands beyond ep_square
+			self.ep_key = self._ep_key(ep_square +
+					self.current_turn.enemy.pawn_dir * 16,
+					self.current_turn.enemy.color)
+		self.halfmove_clock = halfmove_clock
+		self.zobrist = key ^ self.ep_key ^ CASTLING_KEYS[rights]
+
+	def set_piece(self, sq, piece):
+		'''Store piece (or None to empty it) at the 0x88 square index sq.
+
+		This is the only place where the mailbox arrays are written. Moves
+		call it from perform and undo to update the board. It also keeps
+		the players' piece_squares and king_square, the zobrist key and the
+		evaluation terms (material and positional) up to date.
+
+		'''
+		old = self.squares[sq]
+		if old:
+			self.zobrist ^= PIECE_KEYS[old][sq]
+			self.material[old & COLOR_MASK] -= PIECE_VALUES[old & KIND_MASK]
+			self.positional -= PIECE_SQUARE_VALUES[old][sq]
+			player = self.players_by_color[old & COLOR_MASK]
+			player.piece_squares.discard(sq)
+			if player.king_square == sq:
+				player.king_square = None
+		self.pieces[sq] = piece
+		if piece:
+			code = self.squares[sq] = piece.code
+			self.zobrist ^= PIECE_KEYS[code][sq]
+			self.material[code & COLOR_MASK] += PIECE_VALUES[code & KIND_MASK]
+			self.positional += PIECE_SQUARE_VALUES[code][sq]
+			player = self.players_by_color[code & COLOR_MASK]
+			player.piece_squares.add(sq)
+			if code & KIND_MASK == KING:
+				player.king_square = sq
+		else:
+			self.squares[sq] = EMPTY
+		if self.bitboards:
+			self.bitboards.update(sq, old, self.squares[sq])
+
+	def push_state(self, move):
+		'''Save the irreversible state on the state stack and update it
+		for move, which is about to be performed: the castling rights,
+		the en passant square, the halfmove clock and the zobrist key.
+
+		Returns the piece move captures, if any, which pop_state gives
+		back when the move is undone.
+
+		'''
+		top = self.state_top
+		stack = self.state_stack
+		if top == len(stack):
+			stack.extend(EMPTY_STATE)
+		captured = self.pieces[move.captured_sq]
+		stack[top] = self.castling_rights
+		stack[top + 1] = self.ep_square
+		stack[top + 2] = self.ep_key
+		stack[top + 3] = self.halfmove_clock
+		stack[top + 4] = captured
+		self.state_top = top + STATE_SIZE
+
+		key = self.zobrist ^ self.ep_key
+		fro, to = move.fro_sq, move.to_sq
+
+		rights = self.castling_rights & CASTLING_KEPT[fro] & CASTLING_KEPT[to]
+		if rights != self.castling_rights:
+			key ^= CASTLING_KEYS[self.castling_rights] ^ CASTLING_KEYS[rights]
+			self.castling_rights = rights
+
+		self.ep_square = None
+		self.ep_key = 0
+		code = self.squares[fro]
+		if code & KIND_MASK == PAWN:
+			self.halfmove_clock = 0
+			if to - fro == 32 or fro - to == 32:
+				self.ep_square = (fro + to) >> 1
+				#the pawn is still on fro, to is empty
+				self.ep_key = self._ep_key(to, code & COLOR_MASK)
+		elif captured:
+			self.halfmove_clock = 0
+		else:
+			self.halfmove_clock += 1
+
+		self.zobrist = key ^ self.ep_key
+		return captured
+
+	def pop_state(self):
+		'''Restore the state saved by the last push_state, and return the
+		piece captured by the move being undone.'''
+		top = self.state_top = self.state_top - STATE_SIZE
+		stack = self.state_stack
+		rights = stack[top]
+		ep_key = stack[top + 2]
+		key = self.zobrist ^ self.ep_key ^ ep_key
+		if rights != self.castling_rights:
+			key ^= CASTLING_KEYS[self.castling_rights] ^ CASTLING_KEYS[rights]
+			self.castling_rights = rights
+		self.ep_square = stack[top + 1]
+		self.ep_key = ep_key
+		self.halfmove_clock = stack[top + 3]
+		self.zobrist = key
+		captured = stack[top + 4]
+		stack[top + 4] = None
+		return captured
+
+	def _ep_key(self, to, color):
+		'''Return the en passant part of the zobrist key after a double
+		step to to by a pawn of color: the en passant column only counts if
+		an enemy pawn stands by to capture, like in Polyglot books.'''
+		pawn = PAWN | (color ^ COLOR_MASK)
+		squares = self.squares
+		if not (to - 1) & 0x88 and squares[to - 1] == pawn or \
+			not (to + 1) & 0x88 and squares[to + 1] == pawn:
+			return EN_PASSANT_KEYS[to & 7]
+		return 0
+
+	def material_balance(self):
+		'''Return white's material minus black's, in centipawns.'''
+		return self.material[WHITE_COLOR] - self.material[BLACK_COLOR]
+
+	def evaluate(self):
+		'''Return the static score of the position for the side to move, in
+		centipawns: the material and piece-square terms kept by set_piece,
+		so this costs the same whatever the position.'''
+		score = self.material[WHITE_COLOR] - self.material[BLACK_COLOR] + \
+				self.positional
+		if self.current_turn is self.white:
+			return score
+		return -score
+
+	def position_key(self):
+		'''Return the 64 bit zobrist key of the position: the pieces,
+		the side to move, castling rights and en passant column.
+
+		Equal positions have equal keys, and keys are those used by
+		Polyglot opening books. Everything but the side to move is updated
+		incrementally as moves are performed and undone.
+
+		'''
+		if self.current_turn is self.white:
+			return self.zobrist ^ TURN_KEY
+		return self.zobrist
+
+	def legal_move_index(self, owner=None):
+		'''Return the PositionInfo of owner, by default the player to move,
+		whose legal moves are indexed by squares moved from and to.
+
+		The one of the player to move is kept until a move is performed or
+		undone, so highlighting, click validation and moving all resolve
+		against the same moves, generated once per ply.
+
+		'''
+		if owner is None or owner is self.current_turn:
+			if self.move_index is None or \
+				self.move_index.owner is not self.current_turn:
+				self.move_index = self.position_info()
+			return self.move_index
+		return self.position_info(owner)
+
+	def position_info(self, owner=None):
+		'''Return the PositionInfo (legal moves, check, checkmate and
+		stalemate) of owner, by default the player to move.
+
+		Results are kept in a bounded cache keyed by position, so asking
+		again about the same position, be it on every frame, after an undo
+		or when a position repeats, costs no move generation.
+
+		'''
+		if owner is None:
+			owner = self.current_turn
+		key = self.position_key(), owner.color
+		info = self.position_cache.get(key)
+		if info is None:
+			info = PositionInfo(self, owner, self.legal_move_codes(owner),
+					self.king_is_checked(owner))
+			self.position_cache.put(key, info)
+		return info
+
+	def snapshot(self):
+		'''Return a compact, picklable description of the position, to
+		hand it to other processes: the piece codes of the 64 cells as a
+		string, the colour to move, the castling rights and the en passant
+		square.'''
+		squares = self.squares
+		return (str(bytearray([squares[sq] for sq in SQUARES])),
+				self.current_turn.color, self.castling_rights, self.ep_square)
+
+	def load_snapshot(self, snapshot):
+		'''Set up this board, which must be empty, from the result of
+		snapshot().'''
+		#imported here since piece needs board
+		from piece import PIECES
+		kinds = dict([(x.KIND, x) for x in PIECES])
+		placement, color, rights, ep_square = snapshot
+
+		for i, code in enumerate(bytearray(placement)):
+			if code:
+				self.set_piece(SQUARES[i], kinds[code & KIND_MASK](
+						self.players_by_color[code & COLOR_MASK]))
+		self.current_turn = self.players_by_color[color]
+		self.set_state(rights, ep_square)
+
+	@classmethod
+	def from_fen(cls, fen, **options):
+		'''Return a new Board set up from the FEN string fen. options are
+		those of the constructor.'''
+		board = cls(**options)
+		board.load_fen(fen)
+		return board
+
+	def load_fen(self, fen):
+		'''Set this board up from the FEN string fen: the pieces, the side
+		to move, castling rights, en passant square and both move
+		counters. Whatever was on the board is cleared first, so a board
+		may be reused to go through many positions. If fen is rejected
+		the board is left untouched.
+
+		Raises FenError if fen cannot be read, if a rank does not have 8
+		squares, if there is not a king of each colour or if the en passant
+		square does not follow a double step of the side that just moved.
+		Castling rights whose king or rook has left its home square are
+		dropped.
+
+		'''
+		#imported here since piece needs board
+		from piece import PIECES_BY_CODE
+		fields = fen.split()
+		if len(fields) < 4 or len(fields) > 6 or fields[1] not in ('w', 'b'):
+			raise FenError("Bad FEN: %r" % fen)
+		placement, side, castling, ep = fields[:4]
+		try:
+			halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+			fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+		except ValueError:
+			raise FenError("Bad move counters in FEN: %r" % fen)
+
+		#read everything into locals first, so that a bad fen leaves the
+		#board as it was
+		white, black = self.white, self.black
+		squares = bytearray(128)
+		ranks = placement.split('/')
+		if len(ranks) != 8:
+			raise FenError("Bad placement in FEN: %r" % fen)
+		for row, rank in enumerate(ranks):
+			#0x88 rows are 16 squares apart
+			sq = row << 4
+			for char in rank:
+				if char in '12345678':
+					sq += int(char)
+					continue
+				if char not in FEN_CODES or sq & 0x88:
+					raise FenError("Bad placement in FEN: %r" % fen)
+				squares[sq] = FEN_CODES[char]
+				sq += 1
+			if sq != row << 4 | 8:
+				raise FenError("Rank %d does not have 8 squares in FEN: %r" %
+						(8 - row, fen))
+		if KING | WHITE_COLOR not in squares or \
+			KING | BLACK_COLOR not in squares:
+			raise FenError("Missing king in FEN: %r" % fen)
+
+		rights = 0
+		if castling != '-':
+			if castling.strip('KQkq'):
+				raise FenError("Bad castling rights in FEN: %r" % fen)
+			for right, char in FEN_CASTLINGS:
+				if char in castling:
+					rights |= right
+		for right, king_sq, rook_sq, color in CASTLINGS:
+			if squares[king_sq] != KING | color or \
+				squares[rook_sq] != ROOK | color:
+				rights &= ~right
+
+		mover = side == 'w' and white or black
+		ep_square = None
+		if ep != '-':
+			#on rank 6 with white to move, 3 with black to move, empty and
+			#with the enemy pawn that just stepped over it beyond
+			if len(ep) != 2 or ep[0] not in 'abcdefgh' or \
+				ep[1] != (mover is white and '6' or '3'):
+				raise FenError("Bad en passant square in FEN: %r" % fen)
+			ep_square = square(('abcdefgh'.index(ep[0]), 8 - int(ep[1])))
+			beyond = ep_square + mover.enemy.pawn_dir * 16
+			if squares[ep_square] or \
+				squares[ep_square - mover.enemy.pawn_dir * 16] or \
+				squares[beyond] != PAWN | mover.enemy.color:
+				raise FenError("Bad en passant square in FEN: %r" % fen)
+
+		self.clear()
+		for sq in SQUARES:
+			code = squares[sq]
+			if code:
+				player = self.players_by_color[code & COLOR_MASK]
+				kind = PIECES_BY_CODE[FEN_CHARS[code].upper()]
+				self.set_piece(sq, kind(player))
+		self.current_turn = mover
+		self.fullmove_number = fullmove_number
+		self.set_state(rights, ep_square, halfmove_clock)
+
+	def to_fen(self):
+		'''Return the FEN string of the position.'''
+		squares = self.squares
+		rows = []
+		for row in range(0, 128, 16):
+			text = ''
+			empty = 0
+			for sq in range(row, row + 8):
+				code = squares[sq]
+				if code:
+					if empty:
+						text += str(empty)
+						empty = 0
+					text += FEN_CHARS[code]
+				else:
+					empty += 1
+			if empty:
+				text += str(empty)
+			rows.append(text)
+
+		castling = ''.join([char for right, char in FEN_CASTLINGS
+				if self.castling_rights & right]) or '-'
+		ep = '-'
+		if self.ep_square is not None:
+			col, row = SQUARE_POS[self.ep_square]
+			ep = 'abcdefgh'[col] + str(8 - row)
+		return '%s %s %s %s %d %d' % ('/'.join(rows),
+				self.current_turn is self.white and 'w' or 'b', castling, ep,
+				self.halfmove_clock, self.fullmove_number)
+
+	def clear(self):
+		'''Take every piece off the board and forget the moves played.'''
+		for player in self.players:
+			for sq in list(player.piece_squares):
+				self.set_piece(sq, None)
+		del self.move_stack[:]
+		del self.state_stack[:]
+		self.state_top = 0
+		self.turns = 1
+		self.move_index = None
+		self.position_cache.clear()
+		self.set_state(0)
 
 	def pick(self, x, y):
 		'''Try to pick piece in the cell below the x,y screen position.
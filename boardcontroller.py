@@ -17,21 +17,48 @@
 #    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 #
 
-from piece import *
-from messenger import *
-from chessengine import *
+import time
+import pygame
+from piece import Pawn, Knight, Bishop, Rook, Queen, King
+from chessengine import GnuChessEngine
+from multiprocessing import cpu_count
+from board import START_FEN
+from searchengine import SearchEngine, ParallelSearchEngine, \
+		AnalysisSearchEngine
+from openingbook import OpeningBook
+from bitbase import Bitbases, WIN, DRAW
+from errors import IAError
+from analysis import Analysis
 
 MODE_P_VS_CPU = 0
 MODE_P_VS_P = 1
 
+#Posted to the pygame event queue with the engine's answers, see
+#BoardController.on_engine_event
+ENGINE_EVENT = pygame.USEREVENT + 1
+#Seconds the engine may think before it is told to move now, and then to
+#answer before it is given up on
+ENGINE_TIMEOUT = 30.0
+ENGINE_GRACE = 10.0
+#Seconds a CPU game waits for its engine pool to start an engine before
+#playing with the built in engine
+POOL_WAIT = 10.0
+#Posted with new analysis lines, see BoardController.on_analysis_event,
+#and the principal variations analysed
+ANALYSIS_EVENT = pygame.USEREVENT + 2
+ANALYSIS_LINES = 3
+
 import logging
 log = logging.getLogger()
 
 class BoardController:
 	PLAYING = 'playing'
 	CHECKMATE = 'checkmate'
-	def __init__(self, board, mode = MODE_P_VS_P, debug=False):
-		'''Create a new board controller.'''
+	def __init__(self, board, mode = MODE_P_VS_P, debug=False, engines=None,
+			engine=None):
+		'''Create a new board controller. The engine of a CPU game is
+		engine, a chessengine.Engine, or else one taken from engines, an
+		EnginePool, or else a new GnuChessEngine.'''
 		self.board = board
 		self.selected_cell = None
 		self.board.current_turn = self.board.black #will be flipped
@@ -41,42 +68,157 @@ class BoardController:
 		self.mode = mode
 		self.debug = debug
 		self.checkmate = False
+		#set once the game ends in an ending of known result, see on_result
+		self.finished = False
 
 		self.ai = None
+		self.book = None
+		#whether the engine knows the game: it is set up again with
+		#setboard when it does not, see update. engine_base is the length
+		#of the move stack when it was last set up.
+		self.engine_synced = True
+		self.engine_base = 0
+		#endgame bitbases for the built in engine and adjudication, only
+		#opened for CPU games
+		self.bitbases = None
+		#'1-0', '1/2-1/2' or '0-1' once the bitbases know the result
+		self.result = None
+		self.engines = engines
+		#the number of the move asked to the engine and not answered yet,
+		#if any, and when it is told to hurry, see check_engine
+		self.request = None
+		self.requests = 0
+		self.request_deadline = 0
+		self.request_hurried = False
+		#whether the engine thinks on the player's time, see on_engine_event
+		self.pondering = True
+		#whether self.ai goes back to engines, and until when
+		#check_engine waits for engines to have one ready, see _take_engine
+		self.pooled = False
+		#whether self.ai is the built in engine engines keeps for all
+		#games, see _builtin_engine
+		self.shared = False
+		self.engine_wait = 0
+		#the engine analysing every position while analysis is on, the
+		#Analysis of the current position and its latest lines, see
+		#start_analysis
+		self.analyst = None
+		self.analysis = None
+		self.analysis_info = []
+		self.analysis_lines = ANALYSIS_LINES
 		if mode == MODE_P_VS_CPU:
+			self.bitbases = Bitbases.open_default()
 			try:
-				self.ai = GnuChessEngine()
+				if engine:
+					self.ai = engine
+				elif engines:
+					self.ai = engines.acquire()
+					self.pooled = self.ai is not None
+					if not self.ai and not engines.failing:
+						self.engine_wait = time.time() + POOL_WAIT
+				else:
+					self.ai = GnuChessEngine()
 			except Exception,ex:
-				log.error("Cannot start gnuchess. Defaulting to PvP.")
 				log.exception(ex)
-				self.mode = MODE_P_VS_P
+			if not self.ai and not self.engine_wait:
+				log.error("Cannot start engine. Using the built in engine.")
+				self.ai = self._builtin_engine()
+			self.book = OpeningBook.open_default()
 		#no last known player move
 		self.last_p_move = None
 
-	def close(self, message = None):
+	def _take_engine(self):
+		'''Take the engine the pool was still starting when the game
+		began, if it is ready now. Fall back to the built in engine if
+		starting engines fails or takes more than POOL_WAIT seconds.'''
+		self.ai = self.engines.acquire()
 		if self.ai:
+			self.pooled = True
+		elif self.engines.failing or time.time() > self.engine_wait:
+			log.error("No engine from the pool. Using the built in engine.")
+			self.ai = self._builtin_engine()
+		else:
+			return
+		self.engine_wait = 0
+		self.engine_synced = False
+
+	def _builtin_engine(self):
+		'''Return the built in engine. The parallel one starts a process
+		per core, so games with engines share the one it keeps.'''
+		if cpu_count() < 2:
+			return SearchEngine(bitbases=self.bitbases)
+		if not self.engines:
+			return ParallelSearchEngine(bitbases=self.bitbases)
+		engine = self.engines.fallback_engine(ParallelSearchEngine)
+		engine.bitbases = self.bitbases
+		self.shared = True
+		return engine
+
+	def _close_engine(self, hung=False):
+		if self.pooled:
+			#reset and reused by the next game, or replaced
+			self.engines.release(self.ai)
+		elif self.shared:
+			#kept by engines for the next game, unless it hung
+			if hung:
+				self.engines.fallback = None
+				self.ai.kill()
+		elif hung:
+			self.ai.kill()
+		else:
 			self.ai.close()
-			self.ai = None
+		self.ai = None
+		self.pooled = self.shared = False
+
+	def close(self, message = None):
+		self.stop_analysis()
+		if self.ai:
+			self.cancel_engine()
+			self._close_engine()
+		if self.book:
+			self.book.close()
+			self.book = None
+		if self.bitbases:
+			self.bitbases.close()
+			self.bitbases = None
 		if message:
 			log.info(message + "\n")
 
 	def undo_move(self):
 		#FIXME: check if its possible to remove game_state variable.
 		#self.game_state = BoardController.PLAYING
-		if self.checkmate:
+		if self.checkmate or self.finished:
 			return
 		
 		self.selected_cell = None #unselect piece (if any)
+		self.result = None
+
+		if self.request:
+			#the engine has not answered yet: take back the player's move
+			self.cancel_engine()
+			self.board.undo_move()
+			self._analyze()
+			return
+		if self.ai:
+			#stop pondering
+			self.cancel_engine()
 
 		self.board.undo_move()
 		if self.ai:
-			self.ai.undo()
+			if self.engine_synced and \
+				len(self.board.move_stack) - 1 >= self.engine_base:
+				self.ai.undo()
+			else:
+				#the engine cannot undo past where it was set up
+				self.engine_synced = False
 			# first undo was ai move, now undo players
 			self.board.undo_move()
+		self._analyze()
 
-	#TODO: Add castling and en-passant pawns indications.
 	def init_board_text(self, text):
-		'''Initialize board to a serialized position'''
+		'''Initialize board to a serialized position: 64 piece letters,
+		with white to move and castling allowed to kings and rooks on
+		their home squares. See init_board_fen for full positions.'''
 		column, row = 0, 0
 		kind_by_char = {'P': Pawn, 'N': Knight, 'B': Bishop,
 						  'R': Rook, 'Q': Queen, 'K': King}
@@ -91,32 +233,185 @@ class BoardController:
 			column = column + 1
 		
 		self.board.current_turn = self.board.white
-		self.checkmate = self.board.king_is_checkmated(self.board.current_turn)
+		self.checkmate = self.board.legal_move_index().checkmated
+
+	def init_board_fen(self, fen):
+		'''Initialize board to the position in the FEN string fen,
+		including side to move, castling rights, en passant square and
+		move counters. The engine is set up with it before it next
+		moves.'''
+		if self.ai:
+			self.cancel_engine()
+		self.board.load_fen(fen)
+		self.selected_cell = None
+		self.result = None
+		self.engine_synced = False
+		self.checkmate = self.board.legal_move_index().checkmated
+		self._analyze()
 
 	def init_board(self):
 		'''Initialize board to starting chess configuration'''
-		self.init_board_text("rnbqkbnr" + "p" * 8 + "." * 32 + "P" * 8 + "RNBQKBNR")
+		self.init_board_fen(START_FEN)
 
 	def update(self):
 		'''
 		Perform updates on the board such as animations (not implemented yet) 
 		and calling the IA.
+
+		The IA is only asked for a move here, it answers with an
+		ENGINE_EVENT, see on_engine_event.
 		'''
 		#TODO: Animate piece movements
-		
+
+		if self.request:
+			self.check_engine()
+			return
+
 		#Call IA:
 		if self.ai and self.board.current_turn == self.board.black and \
 			self.game_state != BoardController.CHECKMATE:
 			if self.last_p_move:
-				self.ai.move(self.last_p_move, self)
-				if self.debug:
-					self.ai.assert_sync(self.board)
+				if self.play_book_move():
+					return
+				self.request_engine_move()
+
+	def request_engine_move(self):
+		'''Ask the engine to answer the player's last move.'''
+		move = self.last_p_move
+		if not self.engine_synced:
+			#catch the engine up, e.g. on book moves, with one
+			#command: it then only has to answer
+			self.ai.setboard(self.board)
+			self.engine_synced = True
+			self.engine_base = len(self.board.move_stack)
+			move = None
+		self.requests += 1
+		request = self.request = self.requests
+		self.request_deadline = time.time() + ENGINE_TIMEOUT
+		self.request_hurried = False
+		try:
+			self.ai.request_move(move, self.board,
+					lambda reply: self._post(request, reply))
+		except IAError, ex:
+			self._engine_failed(ex)
+
+	def _post(self, request, reply):
+		#called on the engine's thread
+		pygame.event.post(pygame.event.Event(ENGINE_EVENT,
+				request=request, reply=reply))
+
+	def on_engine_event(self, event):
+		'''Play the engine's answer carried by an ENGINE_EVENT: a
+		(fro, to, type) tuple, None if it has no legal moves, or the
+		exception it failed with.'''
+		if event.request != self.request:
+			#answer to a cancelled request
+			return
+		self.request = None
+		if isinstance(event.reply, Exception):
+			self._engine_failed(event.reply)
+			return
+		if event.reply is None:
+			return
+		fro, to, type = event.reply
+		self.move(self.board.current_turn, fro, to, type=type)
+		if self.debug:
+			self.ai.assert_sync(self.board)
+		#think on the player's time
+		if self.pondering:
+			self.ai.ponder(self.board)
+
+	def check_engine(self):
+		'''Take the engine once the pool has it ready, and ask it for the
+		move the player is waiting for, if any. Tell the engine to move
+		now once it took ENGINE_TIMEOUT seconds, and give up on it
+		ENGINE_GRACE seconds later.
+
+		Called every frame.
+		'''
+		if self.engine_wait:
+			self._take_engine()
+			if self.ai:
+				self.update()
+			return
+		if not self.request:
+			return
+		now = time.time()
+		if now > self.request_deadline + ENGINE_GRACE:
+			self._engine_failed(IAError("Engine did not answer in %.0fs" %
+					(ENGINE_TIMEOUT + ENGINE_GRACE)))
+		elif now > self.request_deadline and not self.request_hurried:
+			log.warn("Engine is taking long, telling it to move now")
+			self.request_hurried = True
+			self.ai.move_now()
+
+	def cancel_engine(self):
+		'''Drop the move asked to the engine, if any, and stop it
+		pondering. The engine is set up again before it next moves if it
+		was thinking.'''
+		self.ai.cancel()
+		if self.request:
+			self.request = None
+			self.engine_synced = False
+
+	def _engine_failed(self, error):
+		log.error("Engine failed: %s. Using the built in engine.", error)
+		self.cancel_engine()
+		self._close_engine(hung=True)
+		self.ai = self._builtin_engine()
+		self.engine_synced = False
+
+	def play_book_move(self):
+		'''Answer the player's last move from the opening book, if the
+		position is in it. Return True if a book move was played.
+
+		Book moves are not sent to the engine: it is set up with the
+		position when the game leaves the book.
+
+		'''
+		if not self.book:
+			return False
+		move = self.book.choose(self.board)
+		if move is None:
+			#out of book for the rest of the game
+			self.book.close()
+			self.book = None
+			return False
+		fro, to, type = move
+		log.debug("Book move: %s", move)
+		self.move(self.board.current_turn, fro, to, type=type)
+		self.engine_synced = False
+		self.last_p_move = None
+		return True
+
+	def adjudicate(self):
+		'''Look the position up in the endgame bitbases and return its
+		result with best play, '1-0', '1/2-1/2' or '0-1', or None if it
+		is not known.'''
+		if not self.bitbases:
+			return None
+		result = self.bitbases.probe(self.board)
+		if result is None:
+			return None
+		if result == DRAW:
+			return '1/2-1/2'
+		if (result == WIN) == (self.board.current_turn is self.board.white):
+			return '1-0'
+		return '0-1'
 
 	def on_checkmate(self):
 		'''Handle checkmate events.'''
 		self.close("Checkmated")
 		self.checkmate = True
 
+	def on_result(self):
+		'''End the game once adjudicate knows its result, as on
+		checkmate.'''
+		if not self.finished:
+			self.close("Known ending, result with best play: %s" %
+					self.result)
+			self.finished = True
+
 	def on_cell_clicked(self, clicked_cell):
 		'''Handle mouse events from the user. This method gets called
 		by the event control code when the user clicks on a cell.'''
@@ -139,18 +434,24 @@ class BoardController:
 		'''Move the currently selected piece to a new cell.
 		The currently selected piece is at self.selected_cell.'''
 		
-		if self.checkmate:
+		if self.checkmate or self.finished:
 			return
-		
+
+		if (self.ai or self.engine_wait) and \
+			self.board.current_turn is self.board.black:
+			#the engine's turn, it may be thinking
+			return
+
 		# Try to move the piece on the board:
 		if self.board.can_move_piece_in_cell_to(self.selected_cell, cell.pos):
 			move = self.board.move_piece_in_cell_to(
 				self.board.current_turn,
 				self.selected_cell.pos,
 				cell.pos)
-			if self.ai:
+			if self.ai or self.engine_wait:
 				self.last_p_move = move
 			self.selected_cell = None
+			self.on_move()
 		else:
 			if cell.piece:
 				self.selected_cell = cell
@@ -166,9 +467,69 @@ class BoardController:
 		as the piece a pawn is crowned to.
 		'''
 		
-		if self.checkmate:
+		if self.checkmate or self.finished:
 			return
 		
 		log.debug("%s: %d, %d to %d, %d", player, fro[0], fro[1], to[0], to[1])
 		
 		self.board.move_piece_in_cell_to(player, fro, to, **options)
+		self.on_move()
+
+	def on_move(self):
+		'''Adjudicate the game once it reaches an ending of known
+		result, and analyse the new position. The game ends with the
+		next on_result.'''
+		self._analyze()
+		if self.result is None:
+			self.result = self.adjudicate()
+
+	def start_analysis(self, engine=None, lines=ANALYSIS_LINES):
+		'''Analyse the position on the board, and every one reached after
+		it, with engine, a chessengine.Engine of its own, by default the
+		built in one running in a process of its own. The lines best moves
+		are analysed. New lines come with ANALYSIS_EVENTs, see
+		on_analysis_event, no more than once per analysis.INTERVAL.'''
+		self.stop_analysis()
+		self.analyst = engine or AnalysisSearchEngine()
+		self.analysis_lines = lines
+		self._analyze()
+
+	def stop_analysis(self):
+		if self.analyst:
+			self.analysis.close()
+			self.analyst.close()
+			self.analyst = None
+			self.analysis = None
+			self.analysis_info = []
+
+	def _analyze(self):
+		'''Start analysing the position on the board, if analysis is on.'''
+		if not self.analyst:
+			return
+		if self.analysis:
+			self.analysis.close()
+		sign = self.board.current_turn is self.board.white and 1 or -1
+		self.analysis = Analysis(self._post_analysis, sign)
+		self.analysis_info = []
+		if self.board.legal_move_index().codes:
+			self.analyst.analyze(self.board, self.analysis.update,
+					self.analysis_lines)
+		else:
+			self.analyst.cancel()
+
+	def _post_analysis(self, analysis):
+		#called on the engine's thread
+		pygame.event.post(pygame.event.Event(ANALYSIS_EVENT,
+				analysis=analysis))
+
+	def on_analysis_event(self, event):
+		'''Take the new lines of the analysis of the current position
+		into analysis_info, AnalysisLine tuples with scores for white.'''
+		if event.analysis is self.analysis:
+			self.analysis_info = event.analysis.take()
+
+	def check_analysis(self):
+		'''Post the analysis lines held back so far, see Analysis.flush.
+		To be called every frame.'''
+		if self.analysis:
+			self.analysis.flush()
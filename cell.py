@@ -21,38 +21,38 @@ class Cell(object):
 	'''A Cell instance represents a cell in a Board which may or may not store
 	a piece.
 
-	Cells are the objects that know where pieces are in the board.
+	Cells are a view on the board they belong to: the piece attribute reads
+	and writes the board's 0x88 mailbox (see Board.set_piece), which is what
+	move generation works on.
 	Positions in the board are representd by the i and j
 	attributes, where i is the column the cell is at within the board and j is
 	the row the cell is at in the board.
 
-	In order to simplify the implementation of the board, cells are aware of the
-	valid moves that take to them. This is stored in the special list "moves" and
-	works as follows:
-
-	1) When a cell is selected on the board and its moves are calculated, cells
-	where that piece may move to are notified by having their add_move method
-	called.
-
-	2) When the user requests a move to be performed, the board will match the
-	valid moves at the given destination's cell with the cell selected at the
-	moment (the cell that contains the piece that's about to be moved).
-
-	3) The move is performed and all the cells move lists are cleared.
+	Cells do not keep moves: the legal moves that take to them are looked
+	up in Board.legal_move_index.
 	'''
-	def __init__(self, pos, size, color, piece = None):
+	def __init__(self, pos, size, color, board):
 		'''Create a new instance of Cell.
 		Expected parameters are:
 			color: the color of the cell.
 			pos: the cell position.
 			size: attribute determining the size of the cell when rendered.
-			piece: the piece this cell contains (None by default).
+			board: the board whose contents this cell shows.
 		'''
 		self.color = color
-		self.piece = piece
 		self.size = size
 		self.pos = pos
-		self.moves = []
+		self.board = board
+		self.square = pos[1] << 4 | pos[0]
+
+	def _get_piece(self):
+		return self.board.pieces[self.square]
+
+	def _set_piece(self, piece):
+		self.board.set_piece(self.square, piece)
+
+	piece = property(_get_piece, _set_piece,
+			doc='''The piece this cell contains (None if empty).''')
 
 	def __getitem__(self, idx):
 		return self.pos[idx]
@@ -70,11 +70,3 @@ class Cell(object):
 		if x > tx and x < tx + self.size and \
 			y > ty and y < ty + self.size:
 				return True
-
-	def add_move(self, move):
-		'''Add a move to the list of possible moves that take pieces to this cell.'''
-		self.moves.append(move)
-
-	def clear_moves(self):
-		'''Erase the list of possible moves that take pieces into this cell. '''
-		self.moves = []
@@ -1,10 +1,8 @@
-import sys
 import os
 from sugargame.canvas import PygameCanvas
 import gobject
 
 import gettext
-from gettext import gettext as _
 
 from sugar.activity import activity
 from main import CeibalChess, log
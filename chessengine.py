@@ -16,124 +16,337 @@
 #    along with this program; if not, write to the Free Software
 #    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 #
+'''Chess engines BoardController can play against.
 
+Engine is the interface the controller uses: it asks for a move with
+request_move and gets the answer back through a callback, from another
+thread, so that it never waits for an engine, and lets it ponder while
+the player thinks. Engines can also analyse a position, reporting what
+they think as they search it. Engines running as a child
+process speak either the xboard or the UCI protocol, see XboardEngine and
+UciEngine. GnuChessEngine is the xboard engine shipped with the activity,
+and ScriptedEngine a stand-in answering from a list of moves, to test and
+benchmark the controller without any process.
+'''
 import os
 import sys
+import shlex
+import time
+import Queue
+import signal
+import threading
 from subprocess import Popen, PIPE
-from piece import Move
+from board import START_FEN, square
+from analysis import AnalysisLine, parse_uci_info, parse_xboard_thinking
 from errors import IAError
 
 import logging
 log = logging.getLogger()
 
-class GnuChessEngine:
-        '''GNU Chess wrapper class.'''
-        def __init__(self):
-                '''Create a new instance of the GNU Chess wrapper, locate the
-                gnuchess executable, open a pipe to it and setup the comm.'''
-                try:
-                        path = os.path.join(os.environ["SUGAR_BUNDLE_PATH"],"engines")
-                        if not "Ajedrez.activity" in path:
-                                print "Runningn ceibal-chess from Terminal or some other place"
-                                path = os.path.join("", "engines")
-                except:
-                        path = os.path.join(".", "engines")
+class Engine(object):
+        '''What BoardController needs from a chess engine.
 
-                self.plat = sys.platform
-                if  self.plat == "linux2":
-                        engine_exec = "gnuchess-linux"
-                elif self.plat == "darwin":
-                        engine_exec = "gnuchess-osx"
-                elif self.plat == "win32":
-                        engine_exec = "gnuchess-win32.exe"
-                else:
-                        log.warn("No gnuchess for %s, using system default", plat)
-                        engine_exec = ""
+        Moves sent to engines are piece.Move objects, whose str() is the
+        move in coordinate notation such as e2e4 or e7e8q. Answers are
+        (fro, to, type) tuples of cell positions and crowning piece code,
+        None when the engine has no legal moves, or the exception the
+        engine failed with.
+        '''
+        #requests answered from a ponder search, for engines that can tell
+        hits = None
 
-                if engine_exec != "":
-                        engine_path = os.path.join(path, engine_exec)
-                else:
-                        log.info("Trying to find gnuchess in PATH")
-                        engine_path = "gnuchess"
+        def request_move(self, move, board, callback):
+                '''Tell the engine about the player's move, or nothing if
+                move is None, and return at once. callback is called, from
+                any thread, with the engine's answer for the side to move on
+                board.'''
+                raise NotImplementedError()
 
-                #Check whether the engine is executable:
-                if not os.access(engine_path.split()[0], os.X_OK):
-                        log.error("Engine is not executable, try: chmod +x %s",
-                                          engine_path.split()[0])
-                        raise IOError("Chess engine is not executable.")
+        def move_now(self):
+                '''Make the engine stop thinking and answer with its best
+                move so far.'''
+                pass
+
+        def cancel(self):
+                '''Drop the answers to the moves requested so far, and stop
+                pondering and analysing.'''
+                pass
+
+        def analyze(self, board, callback, lines=1):
+                '''Search the position on board until cancelled, calling
+                callback, from any thread, with an analysis.AnalysisLine for
+                each of the lines best moves as the search progresses. An
+                engine analysing is not asked for moves.'''
+                pass
+
+        def ponder(self, board):
+                '''Think on the player's time, once the engine's answer was
+                played on board, so that the next answer comes sooner if the
+                player plays the expected move.'''
+                pass
+
+        def setboard(self, board):
+                '''Set the engine up with the position on board, for
+                instance after moves played without asking it such as opening
+                book moves. It does not move until the next request_move.'''
+                pass
+
+        def undo(self):
+                '''Take back the engine's last move and the player's move
+                before it.'''
+                pass
+
+        def reset(self):
+                '''Start a new game. Return False if the engine is no longer
+                usable.'''
+                return True
+
+        def assert_sync(self, board):
+                '''Raise IAError if the engine's position differs from
+                board. Only used in debug mode.'''
+                pass
+
+        def kill(self):
+                '''Close an engine that may be hung.'''
+                self.close()
+
+        def close(self):
+                pass
+
+def parse_coords(coords):
+        '''Return the cell position of a square name such as e2.'''
+        letters = ["a", "b", "c", "d", "e", "f", "g", "h"]
+        c = letters.index(coords[0])
+        r = int(8 - int(coords[1]))
+        return (c,r)
+
+def parse_move(ans):
+        '''Return the (fro, to, type) tuple of the move ans, in
+        coordinate notation such as e7e8q.'''
+        if len(ans) == 4:
+                return (parse_coords(ans[:2]), parse_coords(ans[2:]), None)
+        elif len(ans) == 5:
+                return (parse_coords(ans[:2]), parse_coords(ans[2:4]),
+                        ans[4].upper())
+        raise ValueError("Bad move: %s" % ans)
 
-                args = [engine_exec, '-e', '-x']
+class ProcessEngine(Engine):
+        '''An engine running as a child process, talked to through pipes.
 
+        Its output is read on a background thread: answers to moves, as
+        recognized by answer(), go to the callbacks waiting for them,
+        thinking output goes to thinking(), and every other line is queued
+        for _readline. Lines nobody read, such as the discarded answers of
+        stopped searches, are dropped before each request and on cancel so
+        that the queue does not grow over a game. Subclasses implement the
+        protocol.
+        '''
+        #what the engine is called in messages
+        NAME = "engine"
+        #command that makes the engine exit
+        QUIT = "quit"
+
+        def __init__(self, args, executable=None):
+                '''Start the engine with the command line args and open the
+                pipes to it. executable, if given, is the file run instead of
+                args[0].'''
+                self.plat = sys.platform
+                self.proc = self.fin = self.fout = self.reader = None
+                #callbacks waiting for an answer to a move, oldest first
+                #(None once cancelled)
+                self.pending = []
+                self.lock = threading.Lock()
+                self.lines = Queue.Queue()
                 try:
                         if self.plat == "win32":
-                                self.proc = Popen(args, executable=os.path.abspath(engine_path), stdin=PIPE, stdout=PIPE)
+                                self.proc = Popen(args, executable=executable, stdin=PIPE, stdout=PIPE)
                         else:
-                                self.proc = Popen(args, executable=os.path.abspath(engine_path), stdin=PIPE, stdout=PIPE, close_fds=True)
+                                self.proc = Popen(args, executable=executable, stdin=PIPE, stdout=PIPE, close_fds=True)
                         self.fin = self.proc.stdout
                         self.fout = self.proc.stdin
-                        
-			#Check pipe:
-                        self.fout.write("\n")
-                        self.fout.flush()
-                        self.fin.readline()
-                        self.fin.readline()
-                        self.fin.readline()
-                        self.fout.write("depth 1\n")
+                        self.reader = threading.Thread(target=self._read)
+                        self.reader.setDaemon(True)
+                        self.reader.start()
+                        self.handshake()
                 except Exception, ex:
-			print ex
-                        self.close()
+                        log.error("Cannot start %s: %s", self.NAME, ex)
+                        self.kill()
                         raise
 
-        def undo(self):
-                # undo ai move
-                self.fout.write('undo\n')
-                # undo player move
-                self.fout.write('undo\n')
+        def handshake(self):
+                '''Set up the engine once it is started. Raise IOError if it
+                does not answer.'''
+                if not self.ping():
+                        raise IOError("%s does not answer" % self.NAME)
+
+        def write(self, *commands):
+                '''Send commands to the engine, one per line.'''
+                for command in commands:
+                        self.fout.write(command + "\n")
                 self.fout.flush()
 
-        def move(self, move, controller):
-                '''Write a player's move to GNU Chess. Return the engine's move.'''
-                move_str = self.move_to_gnuchess(move)
+        def ping_command(self):
+                '''Return a command the engine answers at once and the
+                answer.'''
+                raise NotImplementedError()
 
-                log.debug("Calling GNU Chess with move: %s", move_str)
+        def thinking(self, line):
+                '''Handle line if it is thinking output, and tell whether it
+                was.'''
+                return False
 
-                self.fout.write(move_str + "\n")
-                self.fout.flush()
-                l = self.fin.readline()
-                while l.find("My move is") == -1:
-                        if l.find("Illegal move") != -1:
-                                raise IAError( \
-                                        "Player performed an illegal move: (%s), move was: %s" %
-                                                (l, move_str))
-                        l = self.fin.readline()
-                ans = l.split()[3]
-                log.debug("got answer from gnuchess '%s'", l)
-
-                chess_ans = None
-                type = None
-
-                if len(ans) == 4:
-                        chess_ans = (self.gnuchess_to_coords(ans[:2]), \
-                                                self.gnuchess_to_coords(ans[2:]))
-                elif len(ans) == 5:
-                        chess_ans = (self.gnuchess_to_coords(ans[:2]), \
-                                                self.gnuchess_to_coords(ans[2:4]))
-                        type = ans[4].upper()
-                else:
-                        raise IAError("Unknown answer from gnuchess: %s" % (ans))
+        def answer(self, line):
+                '''Return the reply to the move requested if line answers
+                it, see Engine, and False otherwise.'''
+                if line.find("Illegal move") != -1 and self.pending:
+                        return IAError(
+                                "Player performed an illegal move: (%s)" % line)
+                return False
+
+        def send_move(self, move):
+                '''Send the player's move, or nothing if move is None, and
+                have the engine answer.'''
+                raise NotImplementedError()
+
+        def ping(self, timeout=5.0):
+                '''Tell whether the engine answers a ping within timeout
+                seconds. Output left over from the previous game is
+                skipped.'''
+                command, expected = self.ping_command()
+                self.write(command)
+                deadline = time.time() + timeout
+                while True:
+                        line = self._readline(deadline - time.time())
+                        if line is None:
+                                log.warn("%s did not answer in %.1fs", self.NAME, timeout)
+                                return False
+                        if line.strip() == expected:
+                                return True
+
+        def new_game(self):
+                '''Send the commands starting a new game.'''
+                raise NotImplementedError()
+
+        def reset(self):
+                '''Start a new game on this process. Return False if the
+                engine is dead or does not answer.'''
+                if self.proc is None or self.proc.poll() is not None:
+                        return False
+                self.cancel()
+                self._drain()
+                try:
+                        self.new_game()
+                        if not self.ping():
+                                return False
+                        #answers to cancelled moves come before the pong
+                        self.pending = []
+                        return True
+                except (IOError, OSError), ex:
+                        log.warn("%s is gone: %s", self.NAME, ex)
+                        return False
+
+        def _read(self):
+                '''Reader thread, see the class documentation.'''
+                while True:
+                        try:
+                                line = self.fin.readline()
+                        except (IOError, ValueError):
+                                line = ""
+                        if not line:
+                                #the process is gone: fail whoever waits
+                                while self.pending:
+                                        self._answer(IAError("%s quit" % self.NAME))
+                                self.lines.put(None)
+                                return
+                        if self.thinking(line):
+                                continue
+                        try:
+                                reply = self.answer(line)
+                        except (IndexError, ValueError):
+                                reply = IAError("Unknown answer from %s: %s" %
+                                                (self.NAME, line))
+                        if reply is False:
+                                self.lines.put(line)
+                        else:
+                                log.debug("got answer from %s '%s'", self.NAME, line)
+                                self._answer(reply)
+
+        def _answer(self, reply):
+                '''Pass reply to the oldest callback waiting for one.'''
+                self.lock.acquire()
+                try:
+                        callback = self.pending and self.pending.pop(0)
+                finally:
+                        self.lock.release()
+                if callback:
+                        callback(reply)
+
+        def _readline(self, timeout):
+                '''Return the next line the engine wrote that is not an
+                answer to a move, or None if there is none within timeout
+                seconds.'''
+                try:
+                        return self.lines.get(timeout=max(timeout, 0))
+                except Queue.Empty:
+                        return None
+
+        def _drain(self):
+                '''Drop the lines nobody read.'''
+                while self._readline(0) is not None:
+                        pass
+
+        def request_move(self, move, board, callback):
+                '''See Engine. callback is called from the reader thread, and
+                with an IAError if the engine quits or rejects the move.'''
+                self._drain()
+                self.lock.acquire()
+                try:
+                        self.pending.append(callback)
+                finally:
+                        self.lock.release()
+                try:
+                        self.send_move(move)
+                except IOError, ex:
+                        self.cancel()
+                        raise IAError("Could not talk to engine: %s" % ex)
+
+        def cancel(self):
+                '''Drop the answers to the moves requested so far. The engine
+                is told to move now, and still plays that move in its own
+                game.'''
+                self._drain()
+                self.lock.acquire()
+                try:
+                        self.pending = [None for x in self.pending]
+                        thinking = bool(self.pending)
+                finally:
+                        self.lock.release()
+                if thinking:
+                        self.move_now()
 
-                controller.move(controller.board.black, chess_ans[0], chess_ans[1], type=type)
+        def kill(self):
+                '''Close an engine that may be hung, and so may not heed the
+                quit command or SIGTERM.'''
+                if self.proc and self.plat != "win32":
+                        try:
+                                os.kill(self.proc.pid, signal.SIGKILL)
+                        except OSError:
+                                pass
+                try:
+                        self.close()
+                except Exception, ex:
+                        log.warn("Error closing %s: %s", self.NAME, ex)
 
         def close(self):
                 try:
                         if self.fout:
-                                self.fout.write("quit\n")
-                                self.fout.flush()
+                                try:
+                                        self.write(self.QUIT)
+                                except IOError:
+                                        #the process is gone already
+                                        pass
                                 self.fout.close()
                                 self.fout = None
-                        if self.fin:
-                                self.fin.close()
-                                self.fin = None
                 finally:
                         if self.proc:
                                 try:
@@ -148,16 +361,334 @@ class GnuChessEngine:
                                         pass
                                 self.proc.wait()
                                 self.proc = None
-       
-        def move_to_gnuchess(self, move):
-                return str(move)
-
-        def gnuchess_to_coords(self, move):
-                letters = ["a", "b", "c", "d", "e", "f", "g", "h"]
-                c = letters.index(move[0])
-                r = int(8 - int(move[1]))
-                return (c,r)
-               
+                        #the reader sees the end of the output and stops
+                        if self.reader:
+                                self.reader.join(1)
+                                self.reader = None
+                        if self.fin:
+                                self.fin.close()
+                                self.fin = None
+
+class XboardEngine(ProcessEngine):
+        '''An engine speaking the xboard (CECP) protocol, version 2.'''
+        NAME = "xboard engine"
+        #units per second of the time in thinking output
+        TICKS = 100
+
+        def __init__(self, args, options=(), movetime=1.0, ponder=True,
+                        executable=None):
+                '''Start the engine with the command line args. movetime is
+                the seconds the engine thinks on each move, and options
+                other commands, such as "sd 4", sent at the start of every
+                game to set its strength. ponder lets the engine think on
+                the player's time, which xboard engines do on their own.'''
+                self.options = ["st %d" % max(movetime, 1),
+                        ponder and "hard" or "easy"] + list(options)
+                #a position sent with setboard() is waiting for a "go"
+                self.forced = False
+                #callback of the running analysis
+                self.analyst = None
+                self.pings = 0
+                ProcessEngine.__init__(self, args, executable)
+
+        def handshake(self):
+                self.write("xboard", "protover 2")
+                self.new_game()
+                ProcessEngine.handshake(self)
+
+        def new_game(self):
+                self.write(*["new"] + self.options)
+                self.forced = False
+
+        def ping_command(self):
+                self.pings += 1
+                return "ping %d" % self.pings, "pong %d" % self.pings
+
+        def answer(self, line):
+                if line.startswith("move "):
+                        return parse_move(line.split()[1])
+                return ProcessEngine.answer(self, line)
+
+        def send_move(self, move):
+                commands = []
+                if move is not None:
+                        log.debug("Calling %s with move: %s", self.NAME, move)
+                        commands.append(str(move))
+                if self.forced:
+                        #leave force mode and play the side to move
+                        commands.append("go")
+                        self.forced = False
+                self.write(*commands)
+
+        def move_now(self):
+                try:
+                        self.write("?")
+                except IOError, ex:
+                        log.warn("Could not talk to engine: %s", ex)
+
+        def undo(self):
+                #takes back the ai move and the player move
+                self.write("remove")
+
+        def analyze(self, board, callback, lines=1):
+                '''See Engine. The xboard protocol has a single principal
+                variation: lines is ignored.'''
+                self.cancel()
+                self.analyst = callback
+                self.write("force", "setboard %s" % board.to_fen(), "post",
+                        "analyze")
+                self.forced = True
+
+        def thinking(self, line):
+                analyst = self.analyst
+                if analyst is None:
+                        return False
+                info = parse_xboard_thinking(line, self.TICKS)
+                if info is None:
+                        return False
+                analyst(info)
+                return True
+
+        def cancel(self):
+                ProcessEngine.cancel(self)
+                if self.analyst:
+                        self.analyst = None
+                        try:
+                                self.write("exit", "nopost")
+                        except IOError, ex:
+                                log.warn("Could not talk to engine: %s", ex)
+
+        def setboard(self, board):
+                self.write("force", "setboard %s" % board.to_fen())
+                self.forced = True
+
+class UciEngine(ProcessEngine):
+        '''An engine speaking the UCI protocol.
+
+        UCI engines keep no game: every request sends the position, as the
+        FEN of the last setboard and the moves played since.
+
+        Engines ponder on the reply given with their best move: on a hit the
+        ponder search goes on as the answer, on a miss it is stopped and
+        its answer dropped.
+        '''
+        NAME = "UCI engine"
+
+        def __init__(self, args, options=None, movetime=1.0, ponder=True,
+                        executable=None):
+                '''Start the engine with the command line args. options is a
+                dict of UCI options to set, such as {"Threads": 2},
+                movetime the seconds the engine thinks on each move and
+                ponder whether it thinks on the player's time.'''
+                self.options = dict(options or {})
+                if ponder:
+                        self.options.setdefault("Ponder", "true")
+                self.movetime = movetime
+                self.fen = START_FEN
+                self.moves = []
+                #the reply expected by the last answer, the one pondered and
+                #since when, and the answers of stopped ponder searches to
+                #drop
+                self.expected = None
+                self.pondering = None
+                self.ponder_started = 0
+                self.hits = 0
+                self.discard = 0
+                #callback of the running analysis, and the principal
+                #variations the engine was told to search
+                self.analyst = None
+                self.multipv = 1
+                ProcessEngine.__init__(self, args, executable)
+
+        def handshake(self):
+                self.write("uci")
+                deadline = time.time() + 10.0
+                while True:
+                        line = self._readline(deadline - time.time())
+                        if line is None:
+                                raise IOError("%s does not speak UCI" % self.NAME)
+                        if line.strip() == "uciok":
+                                break
+                for name, value in sorted(self.options.items()):
+                        self.write("setoption name %s value %s" % (name, value))
+                self.new_game()
+                ProcessEngine.handshake(self)
+
+        def new_game(self):
+                self._stop_pondering()
+                self.write("ucinewgame")
+                self.fen = START_FEN
+                self.moves = []
+                self.expected = None
+
+        def ping_command(self):
+                return "isready", "readyok"
+
+        def thinking(self, line):
+                if not line.startswith("info"):
+                        return False
+                analyst = self.analyst
+                if analyst:
+                        info = parse_uci_info(line)
+                        if info:
+                                analyst(info)
+                return True
+
+        def answer(self, line):
+                if line.startswith("bestmove"):
+                        if self.discard:
+                                #a ponder search stopped on a miss
+                                self.discard -= 1
+                                return False
+                        words = line.split()
+                        ans = words[1]
+                        if ans == "(none)":
+                                return None
+                        #the engine plays it in the game kept here
+                        self.moves.append(ans)
+                        self.expected = None
+                        if len(words) > 3 and words[2] == "ponder":
+                                self.expected = words[3]
+                        return parse_move(ans)
+                return ProcessEngine.answer(self, line)
+
+        def position(self, moves):
+                '''Return the command setting up the game followed by
+                moves.'''
+                position = "position fen %s" % self.fen
+                if moves:
+                        position += " moves " + " ".join(moves)
+                return position
+
+        def send_move(self, move):
+                if self.pondering:
+                        pondered = self.pondering
+                        if move is not None and str(move) == pondered:
+                                log.debug("Ponder hit")
+                                self.hits += 1
+                                self.pondering = None
+                                self.moves.append(pondered)
+                                self.write("ponderhit")
+                                if time.time() - self.ponder_started >= self.movetime:
+                                        #thought long enough already
+                                        self.write("stop")
+                                return
+                        self._stop_pondering()
+                if move is not None:
+                        self.moves.append(str(move))
+                self.write(self.position(self.moves),
+                        "go movetime %d" % (self.movetime * 1000))
+
+        def ponder(self, board):
+                if not self.expected or self.pondering:
+                        return
+                self.pondering, self.expected = self.expected, None
+                self.ponder_started = time.time()
+                try:
+                        self.write(self.position(self.moves + [self.pondering]),
+                                "go ponder movetime %d" % (self.movetime * 1000))
+                except IOError, ex:
+                        log.warn("Could not talk to engine: %s", ex)
+
+        def _stop_pondering(self):
+                if self.pondering:
+                        self.pondering = None
+                        self.discard += 1
+                        self.write("stop")
+
+        def analyze(self, board, callback, lines=1):
+                self.cancel()
+                if lines != self.multipv:
+                        self.write("setoption name MultiPV value %d" % lines)
+                        self.multipv = lines
+                self.analyst = callback
+                self.write("position fen %s" % board.to_fen(), "go infinite")
+
+        def _stop_analysis(self):
+                if self.analyst:
+                        self.analyst = None
+                        self.discard += 1
+                        self.write("stop")
+
+        def move_now(self):
+                try:
+                        self.write("stop")
+                except IOError, ex:
+                        log.warn("Could not talk to engine: %s", ex)
+
+        def cancel(self):
+                ProcessEngine.cancel(self)
+                try:
+                        self._stop_pondering()
+                        self._stop_analysis()
+                except IOError, ex:
+                        log.warn("Could not talk to engine: %s", ex)
+
+        def undo(self):
+                self._stop_pondering()
+                self.expected = None
+                del self.moves[-2:]
+
+        def setboard(self, board):
+                self._stop_pondering()
+                self.expected = None
+                self.fen = board.to_fen()
+                self.moves = []
+
+class GnuChessEngine(XboardEngine):
+        '''GNU Chess wrapper class.'''
+        NAME = "GNU Chess"
+        #GNU Chess 5 prints seconds
+        TICKS = 1
+
+        def __init__(self):
+                '''Create a new instance of the GNU Chess wrapper, locate the
+                gnuchess executable, open a pipe to it and setup the comm.'''
+                try:
+                        path = os.path.join(os.environ["SUGAR_BUNDLE_PATH"],"engines")
+                        if not "Ajedrez.activity" in path:
+                                print "Runningn ceibal-chess from Terminal or some other place"
+                                path = os.path.join("", "engines")
+                except:
+                        path = os.path.join(".", "engines")
+
+                plat = sys.platform
+                if  plat == "linux2":
+                        engine_exec = "gnuchess-linux"
+                elif plat == "darwin":
+                        engine_exec = "gnuchess-osx"
+                elif plat == "win32":
+                        engine_exec = "gnuchess-win32.exe"
+                else:
+                        log.warn("No gnuchess for %s, using system default", plat)
+                        engine_exec = ""
+
+                if engine_exec != "":
+                        engine_path = os.path.join(path, engine_exec)
+                else:
+                        log.info("Trying to find gnuchess in PATH")
+                        engine_path = "gnuchess"
+
+                #Check whether the engine is executable:
+                if not os.access(engine_path.split()[0], os.X_OK):
+                        log.error("Engine is not executable, try: chmod +x %s",
+                                          engine_path.split()[0])
+                        raise IOError("Chess engine is not executable.")
+
+                XboardEngine.__init__(self, [engine_exec, '-e', '-x'],
+                        ["depth 1"], executable=os.path.abspath(engine_path))
+
+        def handshake(self):
+                #started in xboard mode already
+                self.new_game()
+                ProcessEngine.handshake(self)
+
+        def answer(self, line):
+                #GNU Chess 5 does not answer "move e7e5" as in the protocol
+                if line.find("My move is") != -1:
+                        return parse_move(line.split()[3])
+                return XboardEngine.answer(self, line)
+
         def assert_sync(self, board):
                 '''
                 Validate whether the AI's internal representation of the board
@@ -170,15 +701,19 @@ class GnuChessEngine:
                 '''
                 log.debug("Called IA.assert_sync...")
                 try:
+                        #the board comes after whatever nobody read
+                        self._drain()
                         self.fout.write("show board\n")
                         self.fout.write("\n")
                         self.fout.flush()
+                        #lines come from the reader thread, see _read
+                        readline = lambda: self._readline(5.0) or ""
                        
                         log.debug("read 1...")
-                        self.fin.readline()
+                        readline()
                        
                         log.debug("read 2...")
-                        ai_turn = self.fin.readline().split(" ")[0]
+                        readline()
                        
                         #if ai_turn != board.current_turn.name:
                         #       raise IAError("Turns out of sync!")
@@ -186,7 +721,7 @@ class GnuChessEngine:
                         line = ""
                         ai_row = []
                         while len(ai_row) < 8:
-                                line = self.fin.readline().replace("\n", "").strip()
+                                line = readline().replace("\n", "").strip()
                                 ai_row = line.split(" ")
 
                         for row in range(8):
@@ -197,33 +732,262 @@ class GnuChessEngine:
                                         if ai_cell == ".":
                                                 if not board[col, row].piece:
                                                         continue
-                                                raise AIError( \
+                                                raise IAError( \
                                                         "Out of sync: AI thinks (%d, %d) should be empty" %
                                                                 (col, row))                                            
                                        
                                         if ai_cell.upper() != board[col, row].piece.CODE:
-                                                raise AIError("Out of sync: piece at (%d, %d) differs" %
+                                                raise IAError("Out of sync: piece at (%d, %d) differs" %
                                                         (col, row))
                                        
                                         if ai_cell.islower() and board[col, row].piece.owner.name != "black":
-                                                raise AIError("Out of sync: owner at (%d, %d) differs" %
+                                                raise IAError("Out of sync: owner at (%d, %d) differs" %
                                                         (col, row))
                                        
                                         if ai_cell.isupper() and board[col, row].piece.owner.name != "white":
-                                                raise AIError("Out of sync: owner at (%d, %d) differs" %
+                                                raise IAError("Out of sync: owner at (%d, %d) differs" %
                                                         (col, row))
                                
                                 if row < 7:
-                                        line = self.fin.readline().replace("\n", "").strip()
+                                        line = readline().replace("\n", "").strip()
                                         ai_row = line.split(" ")
                        
                         log.debug("read 10...")
-                        self.fin.readline()
+                        readline()
 
 
                         log.debug("read 11...")
-                        self.fin.readline()
+                        readline()
                        
                 except IOError, err:
                         raise IAError("Could not talk to engine: %s" % err.message )
 
+class ScriptedEngine(Engine):
+        '''A stand-in engine with no process, to test and benchmark the
+        controller.
+
+        It answers with the moves of a script in turn, in coordinate
+        notation, and with the first legal move once the script is over or
+        when its move is not legal. Answers come latency seconds after the
+        request, from another thread, like those of a real engine; the
+        same requests always get the same answers. When pondering it expects
+        the player's first legal move, and answers it at once.
+        '''
+        def __init__(self, script=(), latency=0.0):
+                self.script = list(script)
+                self.latency = latency
+                #index in script of the next answer
+                self.played = 0
+                #the player's move pondered on, and the hits
+                self.expected = None
+                self.hits = 0
+                self.requests = 0
+                self.thread = None
+                self.wake = None
+                self.cancelled = False
+
+        def choose(self, board):
+                '''Return the answer for the side to move on board.'''
+                info = board.legal_move_index()
+                if self.played < len(self.script):
+                        fro, to, type = parse_move(self.script[self.played])
+                        if info.can_move(square(fro), square(to)):
+                                return fro, to, type
+                        log.warn("Scripted move %s is not legal",
+                                self.script[self.played])
+                if not info.moves:
+                        return None
+                return parse_move(str(info.moves[0]))
+
+        def request_move(self, move, board, callback):
+                hit = self.expected is not None and str(move) == self.expected
+                self.cancel()
+                reply = self.choose(board)
+                self.played += 1
+                self.requests += 1
+                self.cancelled = False
+                self.wake = threading.Event()
+                if hit:
+                        self.hits += 1
+                        self.wake.set()
+                self.thread = threading.Thread(target=self._answer,
+                        args=(reply, callback))
+                self.thread.setDaemon(True)
+                self.thread.start()
+
+        def _answer(self, reply, callback):
+                self.wake.wait(self.latency)
+                if not self.cancelled:
+                        callback(reply)
+
+        def ponder(self, board):
+                info = board.legal_move_index()
+                if info.moves:
+                        self.expected = str(info.moves[0])
+
+        def analyze(self, board, callback, lines=1):
+                '''See Engine: reports the first lines legal moves, at
+                depth 1 and even.'''
+                self.cancel()
+                for i, move in enumerate(board.legal_move_index().moves[:lines]):
+                        callback(AnalysisLine(i + 1, 1, 0, None, 1, 0, [str(move)]))
+
+        def move_now(self):
+                if self.wake:
+                        self.wake.set()
+
+        def cancel(self):
+                self.expected = None
+                if self.thread:
+                        self.cancelled = True
+                        self.wake.set()
+                        self.thread.join()
+                        self.thread = None
+
+        def undo(self):
+                self.played = max(self.played - 1, 0)
+
+        def reset(self):
+                self.cancel()
+                self.played = 0
+                return True
+
+        def close(self):
+                self.cancel()
+
+def make_engine(spec):
+        '''Return a new engine described by spec:
+
+                gnuchess                the GNU Chess shipped with the activity
+                xboard:COMMAND          an xboard engine run with COMMAND
+                uci:COMMAND             a UCI engine run with COMMAND
+                scripted[:LATENCY]      a ScriptedEngine answering in LATENCY
+                                        seconds
+
+        Raise ValueError if spec is none of those.'''
+        kind, sep, arg = spec.partition(":")
+        if kind == "gnuchess":
+                return GnuChessEngine()
+        elif kind == "xboard" and arg:
+                return XboardEngine(shlex.split(arg))
+        elif kind == "uci" and arg:
+                return UciEngine(shlex.split(arg))
+        elif kind == "scripted":
+                return ScriptedEngine(latency=float(arg or 0))
+        raise ValueError("Unknown engine: %s" % spec)
+
+class EnginePool:
+        '''A few engine processes started ahead of time, to be handed to
+        new games without waiting for an exec and the pipe handshake.
+
+        The pool keeps size engines ready. Engines handed out are replaced
+        at once, and engines given back are reset for the next game, or
+        replaced if they died or hung. All of this happens on a background
+        thread. Engines that fail to start are tried again every
+        RETRY_DELAY seconds.
+
+        The pool also keeps the built in engine games fall back to, see
+        fallback_engine.
+        '''
+        RETRY_DELAY = 5.0
+        #seconds the background thread sleeps when there is nothing to do
+        POLL = 0.25
+
+        def __init__(self, size=2, factory=GnuChessEngine):
+                '''Create a new pool of size processes made by factory, and
+                start them in the background.'''
+                self.size = size
+                self.factory = factory
+                #engines ready for a new game, and engines given back
+                self.ready = Queue.Queue()
+                self.returned = Queue.Queue()
+                #whether the last engine started failed to, and when to try
+                #again
+                self.failing = False
+                self.retry_at = 0
+                #the engine shared by games that fall back to the built in
+                #one, made on first use
+                self.fallback = None
+                self.thread = threading.Thread(target=self._run)
+                self.thread.setDaemon(True)
+                self.thread.start()
+
+        def _run(self):
+                while True:
+                        while self.ready.qsize() < self.size and \
+                                time.time() >= self.retry_at:
+                                self._start()
+                        try:
+                                engine = self.returned.get(timeout=self.POLL)
+                        except Queue.Empty:
+                                continue
+                        if engine is None:
+                                break
+                        if self.ready.qsize() >= self.size:
+                                self._kill(engine)
+                        elif engine.reset():
+                                self.ready.put(engine)
+                        else:
+                                log.info("Replacing a dead or hung engine")
+                                engine.kill()
+
+        def _start(self):
+                try:
+                        self.ready.put(self.factory())
+                        self.failing = False
+                except Exception, ex:
+                        log.error("Cannot start engine: %s", ex)
+                        self.failing = True
+                        self.retry_at = time.time() + self.RETRY_DELAY
+
+        def _kill(self, engine):
+                try:
+                        engine.close()
+                except Exception, ex:
+                        log.warn("Error closing engine: %s", ex)
+
+        def acquire(self):
+                '''Return an engine ready for a new game, or None if there is
+                none yet. Never waits: while the pool starts up, or if engines
+                are failing to start (see failing), ask again later.'''
+                while True:
+                        try:
+                                engine = self.ready.get_nowait()
+                        except Queue.Empty:
+                                return None
+                        if not isinstance(engine, ProcessEngine) or \
+                                engine.proc and engine.proc.poll() is None:
+                                return engine
+                        #died while waiting: have it replaced
+                        self.returned.put(engine)
+
+        def release(self, engine):
+                '''Give back an engine acquired from this pool once its game
+                is over.'''
+                self.returned.put(engine)
+
+        def fallback_engine(self, factory):
+                '''Return the built in engine for games the pool has no
+                engine for, made by factory the first time. It is costly to
+                start, so there is one for all games. They must cancel it
+                when they are over rather than close it.'''
+                if not self.fallback:
+                        self.fallback = factory()
+                return self.fallback
+
+        def close(self):
+                '''Stop the background thread, every idle engine and the
+                built in engine.'''
+                if self.fallback:
+                        self.fallback.close()
+                        self.fallback = None
+                self.returned.put(None)
+                self.thread.join(10)
+                for queue in self.ready, self.returned:
+                        while True:
+                                try:
+                                        engine = queue.get_nowait()
+                                except Queue.Empty:
+                                        break
+                                if engine:
+                                        self._kill(engine)
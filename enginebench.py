@@ -0,0 +1,168 @@
+#
+#    Ceibal Chess - A chess activity for Sugar.
+#    Copyright (C) 2008, 2009 Alejandro Segovia <asegovi@gmail.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+'''Engine round trip benchmark: how long BoardController takes to get a
+move from an engine.
+
+Usage:
+	python -m enginebench [--engine SPEC ...] [--moves N] [--seed N]
+			[--no-ponder] [--json FILE]
+
+A game is played against every engine given (see chessengine.make_engine,
+by default a scripted engine answering at once), the player choosing
+random legal moves from seed. Each round trip is timed from the
+controller's update, which asks the engine for a move, until the answer
+came back as an ENGINE_EVENT and was played on the board. With the
+scripted engine, this is the overhead of the controller, the engine
+thread and the event queue alone.
+
+Engines ponder on the player's time unless --no-ponder is given. Answers
+to an expected player move can then come at once, so for engines that
+count their ponder hits (see chessengine.Engine.hits) the round trips of
+hits and misses are reported apart.
+'''
+import os
+import sys
+import time
+import json
+import random
+from optparse import OptionParser
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import pygame
+
+from board import Board
+from boardcontroller import BoardController, MODE_P_VS_CPU, ENGINE_EVENT, \
+		ENGINE_TIMEOUT, ENGINE_GRACE
+from chessengine import make_engine
+
+def wait(controller):
+	'''Play the engine's answer once it comes. Return False if it did
+	not.'''
+	deadline = time.time() + ENGINE_TIMEOUT + ENGINE_GRACE
+	while controller.request and time.time() < deadline:
+		for event in pygame.event.get(ENGINE_EVENT):
+			controller.on_engine_event(event)
+		controller.check_engine()
+		time.sleep(0.0005)
+	return not controller.request
+
+def bench(controller, moves, rand):
+	'''Play up to moves random player moves, drawn from rand, against the
+	controller's engine. Return the round trip times, in seconds, of ponder
+	hits and of the other answers, or None and all the times if the engine
+	does not count its hits.'''
+	board = controller.board
+	engine = controller.ai
+	hits, misses = [], []
+	for i in range(moves):
+		info = board.legal_move_index()
+		if not info.moves:
+			break
+		move = rand.choice(info.moves)
+		controller.move(board.current_turn, move.fro, move.to)
+		controller.last_p_move = board.move_stack[-1]
+		hit_count = engine.hits
+		start = time.time()
+		controller.update()
+		if not wait(controller):
+			break
+		if engine.hits is not None and engine.hits > hit_count:
+			hits.append(time.time() - start)
+		else:
+			misses.append(time.time() - start)
+	if engine.hits is None:
+		return None, misses
+	return hits, misses
+
+def summary(times):
+	'''Return the count, mean, median and maximum of times, in ms.'''
+	if not times:
+		return {'moves': 0}
+	times = sorted(times)
+	return {'moves': len(times),
+			'mean_ms': round(1000 * sum(times) / len(times), 3),
+			'median_ms': round(1000 * times[len(times) // 2], 3),
+			'max_ms': round(1000 * times[-1], 3)}
+
+def report(label, result):
+	if not result['moves']:
+		print '%-30s %4d moves' % (label, 0)
+		return
+	print '%-30s %4d moves %9.3fms mean %9.3fms median %9.3fms max' % (
+			label, result['moves'], result['mean_ms'], result['median_ms'],
+			result['max_ms'])
+
+def main(argv):
+	parser = OptionParser(usage='python -m enginebench [options]')
+	parser.add_option('--engine', action='append', metavar='SPEC',
+			help='engine to play against, may be repeated (default scripted)')
+	parser.add_option('--moves', type='int', default=40,
+			help='player moves per game (default 40)')
+	parser.add_option('--seed', type='int', default=0,
+			help='seed of the player\'s random moves (default 0)')
+	parser.add_option('--no-ponder', action='store_false', dest='ponder',
+			default=True, help='do not let the engine ponder')
+	parser.add_option('--json', metavar='FILE',
+			help='write the results to FILE as JSON')
+	options, args = parser.parse_args(argv)
+
+	pygame.display.init()
+	results = []
+	for spec in options.engine or ['scripted']:
+		try:
+			engine = make_engine(spec)
+		except (ValueError, EnvironmentError), ex:
+			print '%-30s cannot start: %s' % (spec, ex)
+			continue
+		controller = BoardController(Board(), MODE_P_VS_CPU, engine=engine)
+		controller.pondering = options.ponder
+		#every answer should come from the engine
+		if controller.book:
+			controller.book.close()
+			controller.book = None
+		controller.init_board()
+		try:
+			hits, misses = bench(controller, options.moves,
+					random.Random(options.seed))
+		finally:
+			controller.close()
+		if not hits and not misses:
+			print '%-30s no answer' % spec
+			continue
+		result = summary((hits or []) + misses)
+		result['engine'] = spec
+		result['ponder'] = options.ponder
+		report(spec, result)
+		if hits is not None and options.ponder:
+			result['hits'] = summary(hits)
+			result['misses'] = summary(misses)
+			report('  ponder hits', result['hits'])
+			report('  ponder misses', result['misses'])
+		results.append(result)
+
+	if options.json:
+		out = open(options.json, 'w')
+		try:
+			json.dump(results, out, indent=1, sort_keys=True)
+		finally:
+			out.close()
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
@@ -31,3 +31,8 @@ class IAError(Exception):
 	'''Exception class for IA errors.'''
 	def __init__(self, message):
 		Exception.__init__(self, message)
+
+class FenError(Exception):
+	'''Exception class for FEN strings that cannot be read.'''
+	def __init__(self, message):
+		Exception.__init__(self, message)
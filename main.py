@@ -53,12 +53,13 @@ except Exception, ex:
 	sys.exit(1)
 
 try:
-	from board import *
-	from piece import *
-	from boardcontroller import *
-	#from messenger import *
-	from menu import *
-	from ui import StatePanel, BoardRenderer
+	from board import Board
+	from boardcontroller import BoardController, MODE_P_VS_P, \
+			MODE_P_VS_CPU, ENGINE_EVENT, ANALYSIS_EVENT
+	from chessengine import EnginePool, make_engine
+	from messenger import Message, messenger
+	from menu import Menu
+	from ui import StatePanel, AnalysisPanel, BoardRenderer, RESULT_STATES
 	from resourcemanager import image_manager
 
 except Exception, ex:
@@ -182,6 +183,11 @@ class CeibalChess(object):
 		#LOG related:
 		#Unique identifier for this game (used for logs)
 
+		#engine processes for CPU games, started in the background. The
+		#engine can be changed per machine, see chessengine.make_engine
+		spec = os.environ.get("CEIBAL_CHESS_ENGINE", "gnuchess")
+		self.engines = EnginePool(factory=lambda: make_engine(spec))
+
 		#Controller
 		self.controller = BoardController(board, MODE_P_VS_P)
 		self.controller.init_board()
@@ -193,6 +199,8 @@ class CeibalChess(object):
 
 		#Create UI Elements:
 		turn_display = StatePanel(scr_w - scr_w/6.5, scr_h/40, 120, 120)
+		analysis_display = AnalysisPanel(scr_w - scr_w/6.5, scr_h/40 + 130,
+				scr_w/6.5 - 10, 150)
 		board_renderer = BoardRenderer(width, height)
 
 		clock = pygame.time.Clock()
@@ -228,11 +236,23 @@ class CeibalChess(object):
 					self.done = True
 					break
 
+				if event.type == ENGINE_EVENT:
+					self.controller.on_engine_event(event)
+
+				if event.type == ANALYSIS_EVENT:
+					self.controller.on_analysis_event(event)
+
 				if event.type == pygame.KEYDOWN:
 					if event.key == pygame.K_ESCAPE:
 						menu.toggle_visible()
 					if event.key == pygame.K_u and not menu.visible:
 						self.controller.undo_move()
+					if event.key == pygame.K_a and not menu.visible:
+						if self.controller.analyst:
+							self.controller.stop_analysis()
+						else:
+							self.controller.start_analysis(
+									self._analysis_engine())
 					#else:
 					#	controller.close()
 					#	sys.exit(0)
@@ -256,9 +276,14 @@ class CeibalChess(object):
 								if option == menu_opts[1]:
 									game_mode = MODE_P_VS_P
 								board = Board(width, height)
+								analysing = self.controller.analyst is not None
 								self.controller.close("Started new game")
-								self.controller = BoardController(board, game_mode, self.debug)
+								self.controller = BoardController(board, game_mode,
+										self.debug, self.engines)
 								self.controller.init_board()
+								if analysing:
+									self.controller.start_analysis(
+											self._analysis_engine())
 								menu.visible = False
 								turn_display.set_state("move_white")
 				
@@ -270,13 +295,20 @@ class CeibalChess(object):
 				#   (turn_display.loaded == False):
 
 
-				self._update(board_renderer, board, surface, accum_surface, menu, sface_rect, delta_x, delta_y, bg_img, turn_display)
+				self._update(board_renderer, board, surface, accum_surface, menu, sface_rect, delta_x, delta_y, bg_img, turn_display, analysis_display)
 
 				# Update IA if on "player vs cpu" mode and menu is not visible:
 				if not menu.visible:
 					self.controller.update()
 
+			#the engine answers with an event, but may also time out
+			#without any
+			if not self.done:
+				self.controller.check_engine()
+				self.controller.check_analysis()
+
 		log.debug("Exiting...")
+		self.engines.close()
 		if not self.gtk_embedded:
 			pygame.quit()
 
@@ -284,30 +316,46 @@ class CeibalChess(object):
 			self.close_callback()
 		
 
-	def _update(self, board_renderer, board, surface, accum_surface, menu, sface_rect, delta_x, delta_y, bg_img, turn_display):
+	def _analysis_engine(self):
+		'''Return the engine analysing positions: the one given by the
+		CEIBAL_CHESS_ANALYSIS environment variable (see
+		chessengine.make_engine), or None for the built in one.'''
+		spec = os.environ.get("CEIBAL_CHESS_ANALYSIS")
+		if spec:
+			try:
+				return make_engine(spec)
+			except Exception, ex:
+				log.error("Cannot start analysis engine %s: %s", spec, ex)
+		return None
+
+	def _update(self, board_renderer, board, surface, accum_surface, menu, sface_rect, delta_x, delta_y, bg_img, turn_display, analysis_display):
 		if not menu.visible:
 			#print "Checking if king is checkmated:"
-			t_ini = time.time()
-			checkmated = board.king_is_checkmated(board.current_turn)
+			info = board.legal_move_index()
 			#print "Check if checkmate for %s took %.5f secs" % \
 			#(board.current_turn, time.time() - t_ini)
 
-			if checkmated:
+			if info.checkmated:
 				#print "Checkmate for", board.current_turn
 				#messenger.messages["check"] = game_messages["checkmate"]
 				#self.controller.game_state = "checkmate"
 				turn_display.set_state("checkmate_" + board.current_turn.name)
 				self.controller.on_checkmate()
 
-			elif board.king_is_checked(board.current_turn):
+			elif self.controller.result:
+				#an ending the bitbases know the result of
+				turn_display.set_state(RESULT_STATES[self.controller.result])
+				self.controller.on_result()
+
+			elif info.checked:
 				#messenger.messages["check"] = game_messages["check"]
 				turn_display.set_state("check_" + board.current_turn.name)
 			else:
 				#messenger.messages["check"] = game_messages["none"]
 				turn_display.set_state("move_" + board.current_turn.name)
+			turn_display.set_material(board.material_balance())
+			analysis_display.set_lines(self.controller.analysis_info)
 
-		#time visual update:
-		t_ini = time.time()
 
 		#No need to clear the buffers if we are redrawing them from scratch
 		#self._clear(self.screen)
@@ -328,13 +376,15 @@ class CeibalChess(object):
 
 		global alpha_blending
 
+		analysing = not menu.visible and self.controller.analyst is not None
 		if not menu.visible:
 			if alpha_blending:
 				turn_display.render(accum_surface)
+				if analysing:
+					analysis_display.render(accum_surface)
 
 		# Frame alpha blending
 		if alpha_blending:
-			debug_t = pygame.time.get_ticks()
 			fade_time = 350.0 #Time in ms the animation lasts
 			blit_accum_t = 0
 
@@ -361,6 +411,8 @@ class CeibalChess(object):
 
 		if not menu.visible and not alpha_blending:
 			turn_display.render(self.screen)
+			if analysing:
+				analysis_display.render(self.screen)
 		
 		pygame.display.flip()
 
@@ -17,7 +17,6 @@
 #    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 #
 import pygame
-import os
 import logging
 from resourcemanager import image_manager
 
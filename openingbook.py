@@ -0,0 +1,142 @@
+#
+#    Ceibal Chess - A chess activity for Sugar.
+#    Copyright (C) 2008, 2009 Alejandro Segovia <asegovi@gmail.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+'''Polyglot opening books.
+
+A Polyglot .bin book is a sorted array of 16 byte big-endian entries: the
+zobrist key of a position (see Board.position_key), a move, its weight and
+four bytes of learning data that are not used here. Moves are packed as:
+
+	bits 0-2	column moved to
+	bits 3-5	rank moved to (0 is white's back rank)
+	bits 6-8	column moved from
+	bits 9-11	rank moved from
+	bits 12-14	crowning piece: none, knight, bishop, rook, queen
+
+Castling is written as the king taking its own rook.
+'''
+import os
+import mmap
+import random
+import struct
+
+from board import square, KING, KIND_MASK
+
+import logging
+log = logging.getLogger()
+
+ENTRY = struct.Struct('>QHHI')
+
+#Crowning piece codes by Polyglot number
+CROWNINGS = [None, 'N', 'B', 'R', 'Q']
+
+class OpeningBook(object):
+	'''A Polyglot book, read through mmap so that opening it costs nothing
+	whatever its size.'''
+
+	def __init__(self, path):
+		'''Open the Polyglot book file at path.'''
+		self.path = path
+		self.file = open(path, 'rb')
+		size = os.fstat(self.file.fileno()).st_size
+		self.count = size // ENTRY.size
+		self.map = None
+		if self.count:
+			self.map = mmap.mmap(self.file.fileno(), 0,
+					access=mmap.ACCESS_READ)
+
+	@staticmethod
+	def open_default():
+		'''Open the book shipped with the activity, books/book.bin, or
+		return None if there is none.'''
+		try:
+			path = os.path.join(os.environ["SUGAR_BUNDLE_PATH"], "books")
+		except KeyError:
+			path = "books"
+		path = os.path.join(path, "book.bin")
+		if not os.path.exists(path):
+			log.info("No opening book at %s", path)
+			return None
+		try:
+			return OpeningBook(path)
+		except (IOError, EnvironmentError), ex:
+			log.error("Cannot open opening book %s: %s", path, ex)
+			return None
+
+	def close(self):
+		if self.map:
+			self.map.close()
+			self.map = None
+		if self.file:
+			self.file.close()
+			self.file = None
+
+	def entries(self, key):
+		'''Return the (move, weight) pairs stored for the position with
+		the zobrist key key.'''
+		#binary search for the first entry with the key
+		lo, hi = 0, self.count
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if ENTRY.unpack_from(self.map, mid * ENTRY.size)[0] < key:
+				lo = mid + 1
+			else:
+				hi = mid
+		found = []
+		while lo < self.count:
+			entry_key, move, weight, learn = ENTRY.unpack_from(self.map,
+					lo * ENTRY.size)
+			if entry_key != key:
+				break
+			found.append((move, weight))
+			lo += 1
+		return found
+
+	def moves(self, board):
+		'''Return the book moves of the side to move on board, as
+		((fro, to, type), weight) tuples for BoardController.move. Book
+		moves that are not legal on board are left out.'''
+		info = board.position_info()
+		moves = []
+		for move, weight in self.entries(board.position_key()):
+			fro = ((move >> 6) & 7, 7 - ((move >> 9) & 7))
+			to = (move & 7, 7 - ((move >> 3) & 7))
+			type = CROWNINGS[(move >> 12) & 7]
+			if board.squares[square(fro)] & KIND_MASK == KING and \
+				fro[0] == 4 and to[0] in (0, 7):
+				#king takes own rook: castling
+				to = (to[0] == 7 and 6 or 2, to[1])
+			for legal in info.moves_from(square(fro)):
+				crowned = getattr(legal, 'piece', None)
+				if legal.to == to and (crowned and crowned.CODE) == type:
+					moves.append(((fro, to, type), weight))
+					break
+		return moves
+
+	def choose(self, board, rand=random):
+		'''Pick one of the book moves of the side to move on board, with a
+		probability proportional to its weight. Return a (fro, to, type)
+		tuple, or None if the position is not in the book.'''
+		moves = [x for x in self.moves(board) if x[1]]
+		if not moves:
+			return None
+		pick = rand.randint(1, sum([weight for move, weight in moves]))
+		for move, weight in moves:
+			pick -= weight
+			if pick <= 0:
+				return move
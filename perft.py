@@ -0,0 +1,170 @@
+#
+#    Ceibal Chess - A chess activity for Sugar.
+#    Copyright (C) 2008, 2009 Alejandro Segovia <asegovi@gmail.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+'''Perft: count the leaf nodes of the move tree to a given depth.
+
+Comparing the counts with published ones catches move generation bugs in
+piece.py and bitboard.py, and timing them catches speed regressions.
+
+Usage:
+	python -m perft FEN DEPTH [--divide] [--jobs N] [--json FILE]
+	python -m perft --suite [--depth N] [--jobs N] [--json FILE]
+
+--divide prints the count below every root move, --jobs splits the root
+moves across N processes, --suite runs the reference positions in SUITE
+and --json writes the results to FILE. --movegen bitboard selects the
+bitboard generator (see Board). The exit status is 1 if a suite count
+differs from the expected one.
+'''
+import sys
+import time
+import json
+from array import array
+from optparse import OptionParser
+from multiprocessing import Pool
+
+from board import Board, MAILBOX, BITBOARD, START_FEN
+
+#Reference positions: (name, FEN, node counts for depth 1, 2, ...)
+SUITE = [
+	('start', START_FEN,
+		[20, 400, 8902, 197281, 4865609]),
+	('kiwipete',
+		'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+		[48, 2039, 97862, 4085603]),
+	('en-passant', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+		[14, 191, 2812, 43238, 674624]),
+	('castling',
+		'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+		[6, 264, 9467, 422333]),
+	('promotion', 'n1n5/PPPk4/8/8/8/8/4Kppp/5N1N b - - 0 1',
+		[24, 496, 9483, 182838]),
+	('talkchess', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+		[44, 1486, 62379, 2103487]),
+]
+
+def perft(board, depth, plies=None):
+	'''Count the leaf nodes of the legal move tree of the given depth.
+
+	Moves are generated packed (see Board.legal_move_codes) into one
+	array per ply, and only turned into Move instances to be performed.
+
+	'''
+	if depth < 1:
+		return 1
+	if plies is None:
+		plies = [array('H') for i in range(depth)]
+	moves = plies[depth - 1]
+	del moves[:]
+	board.legal_move_codes(board.current_turn, moves)
+	if depth == 1:
+		return len(moves)
+	nodes = 0
+	for code in moves:
+		board.perform_move(board.decode_move(code))
+		nodes += perft(board, depth - 1, plies)
+		board.undo_move()
+	return nodes
+
+def _divide_one((fen, movegen, code, depth)):
+	'''Worker: count the nodes below the packed root move code.'''
+	board = Board.from_fen(fen, movegen=movegen)
+	move = board.perform_move(board.decode_move(code))
+	return str(move), perft(board, depth - 1)
+
+def divide(fen, depth, movegen=MAILBOX, pool=None):
+	'''Return a list of (move, nodes) pairs, one per root move of the
+	position in fen. If pool is given, root moves are counted on it.'''
+	board = Board.from_fen(fen, movegen=movegen)
+	codes = board.legal_move_codes(board.current_turn)
+	if depth <= 1:
+		return [(str(board.decode_move(code)), 1) for code in codes]
+	tasks = [(fen, movegen, code, depth) for code in codes]
+	if pool:
+		return pool.map(_divide_one, tasks, 1)
+	return [_divide_one(task) for task in tasks]
+
+def run(fen, depth, movegen=MAILBOX, pool=None, show_divide=False):
+	'''Count the nodes of fen to depth, print them and return a dict with
+	the results.'''
+	start = time.time()
+	counts = divide(fen, depth, movegen, pool)
+	seconds = time.time() - start
+	nodes = sum([n for move, n in counts])
+	if show_divide:
+		for move, n in sorted(counts):
+			print '%s: %d' % (move, n)
+	nps = seconds and nodes / seconds or 0
+	print 'depth %d: %d nodes in %.2fs (%d nodes/s)' % (depth, nodes, seconds, nps)
+	return {'fen': fen, 'depth': depth, 'nodes': nodes,
+			'seconds': round(seconds, 3), 'nps': int(nps),
+			'movegen': movegen, 'divide': dict(counts)}
+
+def main(argv):
+	parser = OptionParser(usage='python -m perft [FEN DEPTH | --suite]')
+	parser.add_option('--divide', action='store_true', default=False,
+			help='print the node count below each root move')
+	parser.add_option('--jobs', type='int', default=1,
+			help='number of processes to split the root moves across')
+	parser.add_option('--json', metavar='FILE',
+			help='write the results to FILE as JSON')
+	parser.add_option('--suite', action='store_true', default=False,
+			help='run the reference positions')
+	parser.add_option('--depth', type='int', default=3,
+			help='depth for --suite (default 3)')
+	parser.add_option('--movegen', default=MAILBOX,
+			choices=[MAILBOX, BITBOARD], help='move generator to test')
+	options, args = parser.parse_args(argv)
+
+	if options.suite == bool(args):
+		parser.error('give either FEN and DEPTH or --suite')
+
+	pool = None
+	if options.jobs > 1:
+		pool = Pool(options.jobs)
+
+	failed = False
+	if options.suite:
+		results = []
+		for name, fen, counts in SUITE:
+			depth = min(options.depth, len(counts))
+			print '%s (%s)' % (name, fen)
+			result = run(fen, depth, options.movegen, pool, options.divide)
+			result['name'] = name
+			result['expected'] = counts[depth - 1]
+			result['ok'] = result['nodes'] == result['expected']
+			if not result['ok']:
+				print 'MISMATCH: expected %d nodes' % result['expected']
+				failed = True
+			results.append(result)
+	else:
+		if len(args) != 2:
+			parser.error('give FEN and DEPTH')
+		results = run(args[0], int(args[1]), options.movegen, pool,
+				options.divide)
+
+	if options.json:
+		out = open(options.json, 'w')
+		try:
+			json.dump(results, out, indent=1, sort_keys=True)
+		finally:
+			out.close()
+	return failed and 1 or 0
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
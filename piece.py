@@ -16,7 +16,12 @@
 #    along with this program; if not, write to the Free Software
 #    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 #
-from board import LEFT, RIGHT
+from array import array
+from board import LEFT, RIGHT, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, \
+		square, SQUARE_POS, SQUARE_BIT, BIT_SQUARE, DIRS_DIAGONALS, \
+		DIRS_HORIZONTALS, DIRS_ALL, KNIGHT_JUMPS, MOVE_FLAGS, \
+		MOVE_EN_PASSANT, MOVE_CASTLING, MOVE_CROWNING, MOVE_CROWNINGS, \
+		KINGSIDE_RIGHTS, QUEENSIDE_RIGHTS, encode_move
 from errors import UndoError
 
 def _coord_to_code(c):
@@ -24,9 +29,18 @@ def _coord_to_code(c):
 
 # Move classes
 class BaseMove(object):
+	#flags of the packed move, see board.encode_move
+	FLAGS = 0
+
 	def __init__(self, fro, to):
 		self.fro = fro
 		self.to = to
+		#0x88 square indices, see board.square()
+		self.fro_sq = fro[1] << 4 | fro[0]
+		self.to_sq = to[1] << 4 | to[0]
+		#square of the piece the move captures, if any
+		self.captured_sq = self.to_sq
+		self.code = encode_move(self.fro_sq, self.to_sq, self.FLAGS)
 		self.peformed = False
 		self.acting_piece = None
 
@@ -44,19 +58,23 @@ class BaseMove(object):
 		return not (self == other)
 
 	def perform(self, board):
+		'''Save the board's irreversible state (see Board.push_state)
+		and return the piece this move captures, if any.'''
 		self.performed = True
-		piece = board[self.fro].piece
-		piece.moved(self, board)
+		return board.push_state(self)
 
 	def undo(self, board):
+		'''Restore the board's irreversible state and return the piece
+		this move captured, if any.'''
 		if not self.performed:
 			raise UndoError("Move never performed: from (%d,%d) to (%d,%d)" % \
 							(self.fro + self.to))
-		piece = board[self.to].piece
-		piece.moved_back(self, board)
 		self.performed = False
+		return board.pop_state()
 
 	def causes_check(self, board, owner):
+		'''Return True if performing this move leaves owner's king under
+		attack (see Board.square_attacked).'''
 		self.perform(board)
 		checked = board.king_is_checked(owner)
 		self.undo(board)
@@ -84,51 +102,42 @@ class Move(BaseMove):
 	def perform(self, board):
 		'''Perform a move on a board.'''
 		super(Move, self).perform(board)
-		self.src_piece = board[self.fro].piece
-		self.dst_piece = board[self.to].piece
-
-		board[self.to].piece = self.src_piece
-		board[self.fro].piece = None
+		board.set_piece(self.to_sq, board.pieces[self.fro_sq])
+		board.set_piece(self.fro_sq, None)
 
 	def undo(self, board):
 		'''Undo the effects of a move on a board.'''
-		super(Move, self).undo(board)
-
-		board[self.fro].piece = self.src_piece
-		board[self.to].piece = self.dst_piece
+		captured = super(Move, self).undo(board)
+		board.set_piece(self.fro_sq, board.pieces[self.to_sq])
+		board.set_piece(self.to_sq, captured)
 
 	def __str__(self):
-		if self.acting_piece:
-			piece_code = self.acting_piece.CODE
-		else:
-			piece_code = ''
-		#return '%s%s%s' % (piece_code, self.attacking and 'x' or '',  _coord_to_code(self.to))
 		return "%s%s" % (_coord_to_code(self.fro), _coord_to_code(self.to))
 
 class EnPassant(BaseMove):
+	FLAGS = MOVE_EN_PASSANT
+
 	def __init__(self, fro, dir, owner):
 		assert dir in (LEFT, RIGHT)
 		super(EnPassant, self).__init__(
 			fro,
 			(fro[0] + dir, fro[1] + owner.pawn_dir))
 		self.attacking = True
+		#square of the captured pawn: beside the capturing one
+		self.captured_sq = self.fro_sq + dir
 
 	def perform(self, board):
 		super(EnPassant, self).perform(board)
 		# destination can not have a piece since the captured pawn has just movd
-		self.src_piece = board[self.fro].piece
-		self.captured = board[self.to[0], self.fro[1]].piece
-
-		board[self.fro].piece = None
-		board[self.to].piece = self.src_piece
-		board[self.to[0], self.fro[1]].piece = None
+		board.set_piece(self.to_sq, board.pieces[self.fro_sq])
+		board.set_piece(self.fro_sq, None)
+		board.set_piece(self.captured_sq, None)
 
 	def undo(self, board):
-		super(EnPassant, self).undo(board)
-
-		board[self.fro].piece = self.src_piece
-		board[self.to].piece = None
-		board[self.to[0], self.fro[1]].piece = self.captured
+		captured = super(EnPassant, self).undo(board)
+		board.set_piece(self.fro_sq, board.pieces[self.to_sq])
+		board.set_piece(self.to_sq, None)
+		board.set_piece(self.captured_sq, captured)
 
 	def __str__(self):
 		#return '%s(ep)' % _coord_to_code(self.to)
@@ -138,6 +147,7 @@ class EnPassant(BaseMove):
 class Castling(BaseMove):
 	QUEENSIDE = 'left'
 	KINGSIDE = 'right'
+	FLAGS = MOVE_CASTLING
 	'''Represents a Castling move in chess.'''
 	def __init__(self, castling_type, castling_owner):
 		'''Create a new instance of a Castling Move. Valid castling_types
@@ -159,42 +169,27 @@ class Castling(BaseMove):
 	def perform(self, board):
 		'''Perform a Castling move on a board.'''
 		super(Castling, self).perform(board)
-		j = self.castling_owner.rank
-		self.castling_owner.castling_allowed = False
-
-		if self.castling_type == Castling.QUEENSIDE:
-			board[2,j].piece = board[4,j].piece
-			board[4,j].piece = None
-			board[3,j].piece = board[0,j].piece
-			board[0,j].piece = None
-		elif self.castling_type == Castling.KINGSIDE:
-			board[6,j].piece = board[4,j].piece
-			board[4,j].piece = None
-			board[5,j].piece = board[7,j].piece
-			board[7,j].piece = None
-		else:
-			raise MoveError("Invalid Castling type. Valid types are '%s' and '%s'" %
-				   (Castling.QUEENSIDE, Castling.KINGSIDE))
+		rook_fro, rook_to = self._rook_squares()
+		board.set_piece(self.to_sq, board.pieces[self.fro_sq])
+		board.set_piece(self.fro_sq, None)
+		board.set_piece(rook_to, board.pieces[rook_fro])
+		board.set_piece(rook_fro, None)
 
 	def undo(self, board):
 		'''Undo a Castling move.'''
 		super(Castling, self).undo(board)
-		j = board.current_turn.rank
-		self.castling_owner.castling_allowed = True
-
+		rook_fro, rook_to = self._rook_squares()
+		board.set_piece(self.fro_sq, board.pieces[self.to_sq])
+		board.set_piece(self.to_sq, None)
+		board.set_piece(rook_fro, board.pieces[rook_to])
+		board.set_piece(rook_to, None)
+
+	def _rook_squares(self):
+		'''Return the squares the rook moves from and to.'''
 		if self.castling_type == Castling.QUEENSIDE:
-			board[4, j].piece = board[2, j].piece
-			board[2, j].piece = None
-			board[0, j].piece = board[3, j].piece
-			board[3, j].piece = None
-		elif self.castling_type == Castling.KINGSIDE:
-			board[4, j].piece = board[6, j].piece
-			board[6, j].piece = None
-			board[7, j].piece = board[5, j].piece
-			board[5, j].piece = None
+			return self.fro_sq - 4, self.fro_sq - 1
 		else:
-			raise MoveError("Invalid Castling type. Valid types are '%s' and '%s'" %
-				   (Castling.QUEENSIDE, Castling.KINGSIDE))
+			return self.fro_sq + 3, self.fro_sq + 1
 
 	def __str__(self):
 		#if self.acting_piece:
@@ -211,6 +206,7 @@ class Crowning(BaseMove):
 	def __init__(self, fro, to, piece):
 		super(Crowning, self).__init__(fro, to)
 		self.piece = piece
+		self.code |= MOVE_CROWNINGS[CROWNING_CODES.index(piece.CODE)]
 
 	def __eq__(self, other):
 		'''Compare instances. Two Crowning moves are equal if they move from
@@ -222,17 +218,14 @@ class Crowning(BaseMove):
 	def perform(self, board):
 		'''Perform this move on a board.'''
 		super(Crowning, self).perform(board)
-		self.src_piece = board[self.fro].piece
-		self.dst_piece = board[self.to].piece
-
-		board[self.to].piece = self.piece
-		board[self.fro].piece = None
+		board.set_piece(self.to_sq, self.piece)
+		board.set_piece(self.fro_sq, None)
 
 	def undo(self, board):
 		'''Undo the effects of this move on a board.'''
-		super(Crowning, self).undo(board)
-		board[self.fro].piece = self.src_piece
-		board[self.to].piece = self.dst_piece
+		captured = super(Crowning, self).undo(board)
+		board.set_piece(self.fro_sq, Pawn(self.piece.owner))
+		board.set_piece(self.to_sq, captured)
 
 	def __str__(self):
 		#if self.acting_piece:
@@ -247,6 +240,32 @@ class Crowning(BaseMove):
 		#	_coord_to_code(self.to),
 		#	self.piece.CODE)
 
+def decode_move(code, owner):
+	'''Return the Move instance for owner's packed move code (see
+	board.encode_move).'''
+	fro = SQUARE_POS[BIT_SQUARE[code & 63]]
+	to = SQUARE_POS[BIT_SQUARE[code >> 6 & 63]]
+	flags = code & MOVE_FLAGS
+	if not flags:
+		return Move(fro, to)
+	if flags == MOVE_EN_PASSANT:
+		return EnPassant(fro, to[0] - fro[0], owner)
+	if flags == MOVE_CASTLING:
+		if to[0] > fro[0]:
+			return Castling(Castling.KINGSIDE, owner)
+		return Castling(Castling.QUEENSIDE, owner)
+	type = CROWNING_CODES[flags >> 12 & 3]
+	return Crowning(fro, to, PIECES_BY_CODE[type](owner))
+
+def decode_moves(codes, owner, type=None):
+	'''Return the Move instances for owner's packed moves in codes,
+	leaving out crownings to other pieces than type if given.'''
+	if type:
+		flags = MOVE_CROWNINGS[CROWNING_CODES.index(type)]
+		codes = [x for x in codes
+				if not x & MOVE_CROWNING or x & MOVE_FLAGS == flags]
+	return [decode_move(x, owner) for x in codes]
+
 class BasePiece(object):
 	'''Base class for pieces.'''
 	def __init__(self, owner):
@@ -255,7 +274,7 @@ class BasePiece(object):
 		self.move_cache = []
 		self.attack_cache = []
 		self.type = self.__class__.__name__.lower()
-		self.move_count = 0
+		self.code = self.KIND | owner.color
 
 	def __eq__(self, other):
 		return isinstance(other, BasePiece) and self.type == other.type and self.owner == other.owner
@@ -266,16 +285,9 @@ class BasePiece(object):
 		else:
 			return False
 
-	def moved(self, move, board):
-		self.move_count += 1
-		self.r, self.c = move.to
-
-	def moved_back(self, move, board):
-		self.move_count -= 1
-		self.r, self.c = move.fro
-
 	def get_move(self, fro, to, board, **options):
-		# FIXME filter move by selected options
+		# options (such as the 'type' a pawn crowns to) are honoured by
+		# get_moves
 		for move in self.get_moves(fro, board, **options):
 			if move.to == to:
 				return move
@@ -283,203 +295,219 @@ class BasePiece(object):
 
 	def get_moves(self, fro, board, attack_only = False, filter_check=False,
 			   **options):
-		moves = self._get_moves(fro, board, attack_only = attack_only, **options)
+		if filter_check:
+			return board.get_legal_moves(self.owner, fro, **options)
+		codes = array('H')
+		self.gen_moves(square(fro), board, codes, attack_only)
+		moves = decode_moves(codes, self.owner, options.get('type'))
 		for move in moves:
 			move.acting_piece = self
-		if filter_check:
-			return [x for x in moves if not x.causes_check(board, self.owner)]
-		else:
-			return moves
+		return moves
 
-	def has_moves(self, fro, board, filter_check=True):
-		return len(self.get_moves(fro, board, attack_only=False, filter_check=filter_check)) > 0
+	def gen_moves(self, sq, board, out, attack_only=False):
+		'''Append the pseudo-legal moves of this piece, standing at the
+		0x88 square sq, to the array out as packed integers (see
+		board.encode_move).
 
-DIR_N = ( 0,-1) # delta column, delta row
-DIR_S = ( 0, 1)
-DIR_W = (-1, 0)
-DIR_E = ( 1, 0)
+		If attack_only is True, only the moves that could capture are
+		generated: no castling and no pawn steps.
 
-DIR_NE = ( 1, -1)
-DIR_NW = (-1, -1)
-DIR_SE = ( 1,  1)
-DIR_SW = (-1,  1)
+		'''
+		raise NotImplementedError
 
-DIRS_DIAGONALS = [DIR_NE, DIR_NW, DIR_SE, DIR_SW]
-DIRS_HORIZONTALS = [DIR_E, DIR_W, DIR_S, DIR_N]
-DIRS_ALL = DIRS_HORIZONTALS + DIRS_DIAGONALS
+	def iter_moves(self, fro, board):
+		'''Generate the legal moves of this piece at position fro one at a
+		time, see Board.iter_legal_moves.'''
+		return board.iter_legal_moves(self.owner, fro)
 
-def _cascades(dirs, fro, board, owner):
-	'''Cascade calculates al moves from a given coordinate in all given directions.
+	def has_moves(self, fro, board, filter_check=True):
+		if filter_check:
+			for code in board.iter_legal_move_codes(self.owner, fro):
+				return True
+			return False
+		codes = array('H')
+		self.gen_moves(square(fro), board, codes)
+		return len(codes) > 0
+
+def _cascades(dirs, sq, board, own, out):
+	'''Cascade appends all moves from the square sq in all given
+	directions to out.
 	'''
-	dests = []
-	for dc,dr in dirs:
-		to = (fro[0] + dc, fro[1] + dr)
-		p = None
-		while 0 <= to[0] < 8 and 0 <= to[1] < 8 and not p:
-			p = board[to].piece
-			if not p or p.owner != owner:
-				dests.append(Move(fro, to))
-			to = (to[0] + dc, to[1] + dr)
-	return dests
+	squares = board.squares
+	fro = SQUARE_BIT[sq]
+	for d in dirs:
+		to = sq + d
+		while not to & 0x88:
+			code = squares[to]
+			if code & own:
+				break
+			out.append(fro | SQUARE_BIT[to] << 6)
+			if code:
+				break
+			to += d
 
 class Knight(BasePiece):
 	'''Representation of the Knight piece.'''
 
 	CODE = 'N'
+	KIND = KNIGHT
 
 	def __init__(self, owner):
 		'''Create a new instance of Knight. owner may be "white" or "black".'''
 		super(Knight, self).__init__(owner)
 
-	def _get_moves(self, (col, row), board, attack_only = False, **options):
-		dests = []
-		for x in (1,-1):
-			for y in (2, -2):
-				for c, r in ((col+x,row+y),(col+y,row+x)):
-					if 0 <= c < 8 and 0 <= r < 8:
-						p = board[c,r].piece
-						if not p or p.owner != self.owner:
-							dests.append(Move((col, row), (c, r)))
-		return dests
+	def gen_moves(self, sq, board, out, attack_only=False):
+		squares = board.squares
+		own = self.owner.color
+		fro = SQUARE_BIT[sq]
+		for d in KNIGHT_JUMPS:
+			to = sq + d
+			if not to & 0x88 and not squares[to] & own:
+				out.append(fro | SQUARE_BIT[to] << 6)
 
 class Rook(BasePiece):
 	'''Representation of the Rook piece.'''
 
 	CODE = 'R'
+	KIND = ROOK
 
 	def __init__(self, owner):
 		'''Create a new instance of Rook. owner may be "white" or "black".'''
 		super(Rook, self).__init__(owner)
 
-	def _get_moves(self, fro, board, attack_only = False, **options):
-		return _cascades(DIRS_HORIZONTALS, fro, board, self.owner)
+	def gen_moves(self, sq, board, out, attack_only=False):
+		_cascades(DIRS_HORIZONTALS, sq, board, self.owner.color, out)
 
 class Bishop(BasePiece):
 	'''Representation of the Bishop piece.'''
 
 	CODE = 'B'
+	KIND = BISHOP
 
 	def __init__(self, owner):
 		'''Create a new instance of Bishop. owner may be "white" or "black".'''
 		super(Bishop, self).__init__(owner)
 
-	def _get_moves(self, fro, board, attack_only = False, **options):
-		return _cascades(DIRS_DIAGONALS, fro, board, self.owner)
+	def gen_moves(self, sq, board, out, attack_only=False):
+		_cascades(DIRS_DIAGONALS, sq, board, self.owner.color, out)
 
 class Queen(BasePiece):
 	'''Representation of the Queen piece'''
 
 	CODE = 'Q'
+	KIND = QUEEN
 
 	def __init__(self, owner):
 		'''Create a new instance of Queen. owner may be "white" or "black".'''
 		super(Queen, self).__init__(owner)
 
-	def _get_moves(self, fro, board, attack_only = False, **options):
-		return _cascades(DIRS_ALL, fro, board, self.owner)
+	def gen_moves(self, sq, board, out, attack_only=False):
+		_cascades(DIRS_ALL, sq, board, self.owner.color, out)
 
 class King(BasePiece):
 	'''Representation of the King piece'''
 
 	CODE = 'K'
+	KIND = KING
 
 	def __init__(self, owner):
 		'''Create a new instance of King. owner may be "white" or "black".'''
 		super(King, self).__init__(owner)
 
-	def _get_moves(self, (col, row), board, attack_only = False, **options):
-		dests = []
-		for dc in [-1,0,1]:
-			for dr in [-1,0,1]:
-				c = col + dc
-				r = row + dr
-				if 0 <= c < 8 and 0 <= r < 8:
-					p = board[c,r].piece
-					if not p or (p.owner != self.owner):
-						dests.append(Move((col,row),(c,r)))
-
-		if not attack_only:
-			threats = [x.to for x in board.get_all_attack_moves(self.owner.enemy)]
-			#Castling
-			if not self.move_count and \
-				not board.king_is_checked(self.owner):
-				right_rook = board[7,row].piece
-				left_rook = board[0,row].piece
-				if right_rook and not right_rook.move_count and \
-					not board[col+1,row].piece and \
-					not board[col+2,row].piece and \
-					(col+2, row) not in threats and \
-					(col+1, row) not in threats:
-						dests.append(Castling(Castling.KINGSIDE, self.owner))
-
-				if left_rook and not left_rook.move_count and \
-					not board[col-1,row].piece and \
-					not board[col-2,row].piece and \
-					not board[col-3,row].piece and \
-					(col-2, row) not in threats and \
-					(col-1, row) not in threats:
-						dests.append(Castling(Castling.QUEENSIDE, self.owner))
-			dests = filter(lambda x: x.to not in threats, dests)
-		return dests
+	def gen_moves(self, sq, board, out, attack_only=False):
+		squares = board.squares
+		own = self.owner.color
+		enemy = self.owner.enemy
+		attacked = board.square_attacked
+		fro = SQUARE_BIT[sq]
+		for d in DIRS_ALL:
+			to = sq + d
+			if not to & 0x88 and not squares[to] & own and \
+				(attack_only or not attacked(to, enemy)):
+				out.append(fro | SQUARE_BIT[to] << 6)
+
+		#Castling: the rights are lost once the king or the rook moves
+		rights = board.castling_rights
+		if not attack_only and rights and \
+			sq == square((4, self.owner.rank)) and not attacked(sq, enemy):
+			rook = ROOK | own
+			if rights & KINGSIDE_RIGHTS[own] and squares[sq + 3] == rook and \
+				not squares[sq + 1] and \
+				not squares[sq + 2] and \
+				not attacked(sq + 2, enemy) and \
+				not attacked(sq + 1, enemy):
+					out.append(encode_move(sq, sq + 2, MOVE_CASTLING))
+
+			if rights & QUEENSIDE_RIGHTS[own] and squares[sq - 4] == rook and \
+				not squares[sq - 1] and \
+				not squares[sq - 2] and \
+				not squares[sq - 3] and \
+				not attacked(sq - 2, enemy) and \
+				not attacked(sq - 1, enemy):
+					out.append(encode_move(sq, sq - 2, MOVE_CASTLING))
 
 class Pawn(BasePiece):
 	'''Representation of the Pawn piece.'''
 
 	CODE = 'P'
+	KIND = PAWN
 
 	def __init__(self, owner):
 		super(Pawn, self).__init__(owner)
 		'''Create a new instance of Pawn. owner may be "white" or "black".'''
-		self.en_passant = 0
-
-	def moved(self, move, board):
-		if move.to[1] == self.owner.rank + self.owner.pawn_dir * 3:
-			self.en_passant = board.turns
 
-	def _get_moves(self, (col, row), board, attack_only = False, **options):
-		dests = []
-		dr = self.owner.pawn_dir
-		rank = self.owner.rank
+	def gen_moves(self, sq, board, out, attack_only=False):
+		squares = board.squares
+		owner = self.owner
+		own = owner.color
+		row = sq >> 4
+		dr = owner.pawn_dir
+		step = dr * 16
+		ahead = sq + step
+		crowns = row + dr == owner.enemy.rank
+		fro = SQUARE_BIT[sq]
 
 		#Bound checking:
-		if 0 <= row + dr < 8:
-			#Normal move or Crowning?
-			if not attack_only:
-				if row + dr != 0 and row + dr != 7:
-					if not board[col, row + dr].piece:
-						dests.append(Move((col, row), (col, row + dr)))
+		if ahead & 0x88:
+			return
+
+		#Normal move or Crowning?
+		if not attack_only and not squares[ahead]:
+			to = fro | SQUARE_BIT[ahead] << 6
+			if not crowns:
+				out.append(to)
+			else:
+				for flags in MOVE_CROWNINGS:
+					out.append(to | flags)
+
+			#Double step:
+			if row == owner.rank + dr and not squares[ahead + step]:
+				out.append(fro | SQUARE_BIT[ahead + step] << 6)
+
+		#Attack moves:
+		for dir in LEFT, RIGHT:
+			to = ahead + dir
+			if to & 0x88:
+				continue
+
+			# normal attack
+			code = squares[to]
+			if code and not code & own:
+				to = fro | SQUARE_BIT[to] << 6
+				if not crowns:
+					out.append(to)
 				else:
-					if not board[col, row + dr].piece:
-						# create the piece from the given class name :ugh:
-						type = options.get('type', Queen.CODE)
-						dests.append(Crowning((col, row), (col, row + dr),
-							PIECES_BY_CODE[type](self.owner)))
-
-				#Double step:
-				if row == rank + dr and \
-					not board[col, row + 2*dr].piece and \
-					not board[col, row + 1*dr].piece:
-					dests.append(Move((col, row), (col, row + 2 * dr)))
-
-			#Attack moves:
-			for dir in LEFT, RIGHT:
-				if 0 <= col + dir < 8:
-
-					# normal attack
-					p = board[col+dir, row+dr].piece
-					if p and p.owner != self.owner:
-						if row + dr != 0 and row + dr != 7:
-							dests.append(Move((col, row), (col + dir, row + dr)))
-						else:
-							# Crowning attack
-							dests.append(Crowning((col, row), (col + dir, row + dr), Queen(self.owner)))
-
-					# en passant
-					elif row == (self.owner.enemy.rank + self.owner.enemy.pawn_dir * 3):
-						p = board[col + dir, row].piece
-						if p and p.owner != self.owner and p.type == self.type and p.en_passant == board.turns -1:
-							dests.append(EnPassant((col, row), dir, self.owner))
-		return dests
+					# Crowning attack
+					for flags in MOVE_CROWNINGS:
+						out.append(to | flags)
+
+			# en passant: the enemy pawn beside has just made a double step
+			elif to == board.ep_square and \
+				squares[to - step] == PAWN | owner.enemy.color:
+				out.append(fro | SQUARE_BIT[to] << 6 | MOVE_EN_PASSANT)
 
 PIECES = (Rook, Knight, Queen, King, Pawn, Bishop)
 PIECES_BY_CODE = dict([(x.CODE, x) for x in PIECES])
+#Pieces a pawn may crown to, in the order of board.CROWNING_KINDS. Queen
+#goes first, so that get_move picks it when no 'type' option is given.
+CROWNING_CODES = (Queen.CODE, Rook.CODE, Bishop.CODE, Knight.CODE)
@@ -0,0 +1,136 @@
+#
+#    Ceibal Chess - A chess activity for Sugar.
+#    Copyright (C) 2008, 2009 Alejandro Segovia <asegovi@gmail.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+from collections import OrderedDict
+
+class PositionInfo(object):
+	'''Legal moves and game status of one player in one position.
+
+	Instances are created by Board.position_info and shared by everybody
+	asking about the same position: the controller, the renderer and
+	click validation. They must be treated as read only.
+
+	Moves are kept packed (see board.encode_move) and only turned into
+	Move instances when somebody asks for them.
+	'''
+	def __init__(self, board, owner, codes, checked):
+		'''Create a new instance of PositionInfo.
+		codes is the array of owner's packed legal moves on board and
+		checked tells whether owner's king is under attack.'''
+		self.board = board
+		self.owner = owner
+		self.codes = codes
+		self.checked = checked
+		self.checkmated = checked and not codes
+		self.stalemated = not checked and not codes
+
+		#packed moves by 0x88 square moved from, and by squares moved
+		#from and to (crownings share them)
+		self.by_square = {}
+		self.by_squares = {}
+		for code in codes:
+			i = code & 63
+			t = code >> 6 & 63
+			fro = i + (i & 56)
+			self.by_square.setdefault(fro, []).append(code)
+			self.by_squares.setdefault((fro, t + (t & 56)), []).append(code)
+		self._moves = None
+		self._moves_from = {}
+		self._see_from = {}
+
+	@property
+	def moves(self):
+		'''All of the player's legal moves, as Move instances.'''
+		if self._moves is None:
+			self._moves = self.board.decode_moves(self.codes, self.owner)
+		return self._moves
+
+	def can_move(self, fro, to):
+		'''Tell whether a legal move takes the piece at the 0x88 square
+		fro to to.'''
+		return (fro, to) in self.by_squares
+
+	def move(self, fro, to, type=None):
+		'''Return a new Move instance for the legal move from the 0x88
+		square fro to to, crowning to type (queen by default), or None if
+		there is none. Unlike moves_from, the move is not shared, so it
+		can be performed and kept on the board's move stack.'''
+		codes = self.by_squares.get((fro, to))
+		if not codes:
+			return None
+		if not type:
+			codes = codes[:1]
+		moves = self.board.decode_moves(codes, self.owner, type)
+		return moves and moves[0] or None
+
+	def moves_from(self, sq):
+		'''Return the legal moves of the piece at the 0x88 square sq.'''
+		moves = self._moves_from.get(sq)
+		if moves is None:
+			moves = self._moves_from[sq] = self.board.decode_moves(
+					self.by_square.get(sq, []), self.owner)
+		return moves
+
+	def see_from(self, sq):
+		'''Return the static exchange evaluation (see Board.see) of each
+		of the moves_from(sq), in the same order. Like the moves, they are
+		worked out the first time they are asked for in the position.'''
+		values = self._see_from.get(sq)
+		if values is None:
+			values = self._see_from[sq] = [self.board.see(move)
+					for move in self.moves_from(sq)]
+		return values
+
+class PositionCache(object):
+	'''Bounded cache of PositionInfo instances, evicting the least
+	recently used entry when full.'''
+
+	DEFAULT_SIZE = 256
+
+	def __init__(self, size=DEFAULT_SIZE):
+		'''Create a new instance of PositionCache holding up to size
+		entries.'''
+		self.size = size
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key):
+		'''Return the entry stored for key, or None.'''
+		try:
+			value = self.entries.pop(key)
+		except KeyError:
+			self.misses += 1
+			return None
+		#reinsert it as the most recently used
+		self.entries[key] = value
+		self.hits += 1
+		return value
+
+	def put(self, key, value):
+		'''Store value for key, evicting the oldest entry if needed.'''
+		self.entries.pop(key, None)
+		self.entries[key] = value
+		if len(self.entries) > self.size:
+			self.entries.popitem(last=False)
+
+	def clear(self):
+		self.entries.clear()
+
+	def __len__(self):
+		return len(self.entries)
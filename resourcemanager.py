@@ -41,7 +41,7 @@ class ImageManager:
 		an keep a reference to it.'''
 		try:
 			return self.images[imgname]
-		except KeyError, err:
+		except KeyError:
 			log.debug("Image '%s' not found. Loading...", imgname)
 
 		try:
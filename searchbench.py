@@ -0,0 +1,115 @@
+#
+#    Ceibal Chess - A chess activity for Sugar.
+#    Copyright (C) 2008, 2009 Alejandro Segovia <asegovi@gmail.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+'''Search benchmarks: how the engines scale with the number of processes
+and how much move ordering saves.
+
+Usage:
+	python -m searchbench [--workers 1,2,4] [--depth N] [--json FILE]
+	python -m searchbench --ordering [--depth N] [--json FILE]
+
+Every position of perft.SUITE is searched to a fixed depth, first by the
+single process SearchEngine and then by ParallelSearchEngine with each
+worker count given. Totals of nodes, seconds and nodes per second are
+printed for every engine, along with the speedup over the single process
+search in both nodes per second and time to depth.
+
+With --ordering, the single process engine is run instead with and
+without the staged move picker and the quiescence search, and the number
+of nodes searched is compared with moves in generation order. Quiescence
+search without ordering is left out: it does not finish in reasonable
+time on the tactical positions.
+'''
+import sys
+import time
+import json
+from optparse import OptionParser
+
+from board import Board
+from perft import SUITE
+from searchengine import SearchEngine, ParallelSearchEngine
+
+def bench(engine, depth):
+	'''Search every SUITE position depth plies deep with engine and
+	return the total (nodes, seconds).'''
+	nodes, seconds = 0, 0.0
+	for name, fen, counts in SUITE:
+		board = Board.from_fen(fen)
+		engine.table.clear()
+		start = time.time()
+		engine.think(board, time_limit=3600)
+		seconds += time.time() - start
+		nodes += engine.nodes
+	return nodes, seconds
+
+def main(argv):
+	parser = OptionParser(usage='python -m searchbench [options]')
+	parser.add_option('--workers', default='1,2,4',
+			help='comma separated worker counts (default 1,2,4)')
+	parser.add_option('--depth', type='int', default=4,
+			help='search depth (default 4)')
+	parser.add_option('--json', metavar='FILE',
+			help='write the results to FILE as JSON')
+	parser.add_option('--ordering', action='store_true', default=False,
+			help='compare move orderings instead of worker counts')
+	options, args = parser.parse_args(argv)
+	depth = options.depth
+
+	if options.ordering:
+		engines = [
+			('generation order', lambda: SearchEngine(max_depth=depth,
+				ordering=False, quiescence=False)),
+			('staged', lambda: SearchEngine(max_depth=depth,
+				quiescence=False)),
+			('staged + quiescence', lambda: SearchEngine(max_depth=depth)),
+		]
+	else:
+		engines = [('serial', lambda: SearchEngine(max_depth=depth))]
+		for workers in [int(x) for x in options.workers.split(',')]:
+			engines.append(('%d workers' % workers, lambda workers=workers:
+					ParallelSearchEngine(workers, max_depth=depth)))
+
+	results = []
+	for name, create in engines:
+		engine = create()
+		try:
+			nodes, seconds = bench(engine, depth)
+		finally:
+			engine.close()
+		nps = seconds and nodes / seconds or 0
+		results.append({'engine': name, 'depth': depth, 'nodes': nodes,
+				'seconds': round(seconds, 3), 'nps': int(nps)})
+
+	base = results[0]
+	for result in results:
+		result['nps_speedup'] = round(float(result['nps']) / base['nps'], 2)
+		result['time_speedup'] = round(base['seconds'] / result['seconds'], 2)
+		print '%-30s %9d nodes %8.2fs %8d nodes/s  x%.2f nodes/s  x%.2f time' % (
+				result['engine'], result['nodes'], result['seconds'],
+				result['nps'], result['nps_speedup'], result['time_speedup'])
+
+	if options.json:
+		out = open(options.json, 'w')
+		try:
+			json.dump(results, out, indent=1, sort_keys=True)
+		finally:
+			out.close()
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
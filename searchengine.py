@@ -0,0 +1,827 @@
+#
+#    Ceibal Chess - A chess activity for Sugar.
+#    Copyright (C) 2008, 2009 Alejandro Segovia <asegovi@gmail.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+'''In-process chess engine searching the game Board directly.
+
+SearchEngine is a chessengine.Engine for platforms without a working
+engine binary. It runs a negamax alpha-beta search
+with iterative deepening and a transposition table, and always answers
+within its time budget. Searches run on a thread of their own, on a copy
+of the game board, so that the caller is never blocked. While the player
+thinks, the engine searches the position after the reply it expects, see
+SearchEngine.ponder. It can also analyse a position with several principal
+variations, see SearchEngine.analyze.
+
+ParallelSearchEngine splits the moves at the root of the same search
+across a pool of worker processes. AnalysisSearchEngine runs analyses in
+a process of its own, away from the GUI.
+'''
+import time
+import threading
+from array import array
+from multiprocessing import Pool, Process, Pipe, Value, cpu_count
+
+from board import Board, PAWN, QUEEN, KIND_MASK, \
+		MOVE_CROWNING, MOVE_FLAGS, MOVE_EN_PASSANT, BIT_SQUARE, SQUARE_POS
+from piece import CROWNING_CODES
+from bitbase import Bitbases, DRAW
+from chessengine import Engine
+from analysis import AnalysisLine
+
+import logging
+log = logging.getLogger()
+
+INFINITE = 1000000
+#Score of being checkmated at the root. Mates further away score closer to
+#zero, so that the quickest mate is preferred.
+MATE = 100000
+MAX_PLY = 128
+
+#Transposition table entry kinds: the score is exact, a lower bound (the
+#search failed high) or an upper bound (it failed low).
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+class _TimeUp(Exception):
+	'''Raised inside the search when the time budget is spent.'''
+
+class SearchEngine(Engine):
+	'''Alpha-beta searcher running in process.'''
+
+	DEFAULT_TIME = 1.0
+	DEFAULT_DEPTH = 8
+	TABLE_SIZE = 200000
+	#longest search on the player's time, see ponder, and of an analysis
+	PONDER_TIME = 60.0
+	ANALYSIS_TIME = 3600.0
+
+	def __init__(self, time_limit=DEFAULT_TIME, max_depth=DEFAULT_DEPTH,
+			ordering=True, quiescence=True, bitbases=None):
+		'''Create a new instance of SearchEngine.
+
+		time_limit is the hard budget, in seconds, for each move and
+		max_depth the deepest iteration searched. ordering and quiescence
+		turn the staged move picker (see _pick) and the quiescence search
+		on and off, to measure what they save. bitbases, a
+		bitbase.Bitbases, scores the drawn endings it knows without
+		searching them.
+
+		'''
+		self.time_limit = time_limit
+		self.max_depth = max_depth
+		self.ordering = ordering
+		self.quiescence = quiescence
+		self.bitbases = bitbases
+		#Two quiet moves per ply that last caused a beta cutoff, and a
+		#score per from and to cells for the quiet moves that did so
+		#anywhere in the tree.
+		self.killers = [[0, 0] for i in range(MAX_PLY)]
+		self.history = [0] * 4096
+		#position_key -> (depth, kind, score, packed best move)
+		self.table = {}
+		self.board = None
+		self.nodes = 0
+		self.depth = 0
+		self.score = 0
+		self.deadline = 0
+		self.plies = [array('H') for i in range(MAX_PLY)]
+		#the thread of the last search, its number, when it started, when
+		#it must end and who wants its answer. Only the answer of search
+		#number self.search is wanted: cancel moves on to the next number
+		#and returns at once, the thread noticing by itself. A ponder
+		#search has no callback until the player's move is the expected
+		#one: its answer is then kept in self.answer, as a 1-tuple, if it
+		#ends before.
+		self.thread = None
+		self.search = 0
+		self.started = 0
+		self.budget = 0
+		self.callback = None
+		self.answer = None
+		self.lock = threading.Lock()
+		#position_key of the position pondered
+		self.ponder_key = None
+		self.hits = 0
+
+	def undo(self):
+		#the board is the only game state, nothing to take back
+		pass
+
+	def setboard(self, board):
+		#searches get a copy of the game board, nothing to set up
+		pass
+
+	def request_move(self, move, board, callback):
+		'''Start searching a move for the side to move on board, and return
+		at once. callback is called from the search thread with the answer,
+		a (fro, to, type) tuple, or None if there are no legal moves.'''
+		if self._ponder_hit(board, callback):
+			return
+		self.cancel()
+		#the game board keeps changing under the search otherwise
+		self._start(Board.from_fen(board.to_fen()), callback, self.time_limit)
+
+	def ponder(self, board):
+		'''Search, until the player moves, the position after the reply
+		the last search expects from the player on board: the best move
+		stored for it in the transposition table.'''
+		self.cancel()
+		entry = self.table.get(board.position_key())
+		if not entry or entry[3] not in board.legal_move_codes(board.current_turn):
+			return
+		copy = Board.from_fen(board.to_fen())
+		copy.perform_move(copy.decode_move(entry[3]))
+		self.ponder_key = copy.position_key()
+		log.debug("Pondering on %s", board.decode_move(entry[3]))
+		self._start(copy, None, self.PONDER_TIME)
+
+	def _ponder_hit(self, board, callback):
+		'''Hand the ponder search over to callback if board is the
+		position pondered. Return False on a miss.'''
+		if self.ponder_key is None or board.position_key() != self.ponder_key:
+			return False
+		self.ponder_key = None
+		self.hits += 1
+		log.debug("Ponder hit")
+		self.lock.acquire()
+		try:
+			answer = self.answer
+			if answer is None:
+				self.callback = callback
+				#search no longer than a move not pondered would be
+				self.budget = min(self.budget,
+						max(self.started + self.time_limit, time.time()))
+				self.deadline = min(self.deadline, self.budget)
+		finally:
+			self.lock.release()
+		if answer is not None:
+			callback(answer[0])
+		return True
+
+	def _start(self, board, callback, time_limit):
+		self.lock.acquire()
+		try:
+			self.search += 1
+			self.callback = callback
+			self.answer = None
+			self.started = time.time()
+			self.budget = self.started + time_limit
+		finally:
+			self.lock.release()
+		self._run(self._think, board)
+
+	def _run(self, target, *args):
+		'''Run target(previous, search, *args) on a new search thread.
+		previous is the thread of the last search, which may still be
+		stopping.'''
+		previous = self.thread
+		self.thread = threading.Thread(target=target,
+				args=(previous, self.search) + args)
+		self.thread.setDaemon(True)
+		self.thread.start()
+
+	def _begin(self, previous, search):
+		'''Wait, on a search thread, for the previous search to stop, since
+		searches share the engine's tables. Then start the clock of search
+		and return True, or False if it was cancelled meanwhile.'''
+		if previous:
+			previous.join()
+		self.lock.acquire()
+		try:
+			if search != self.search:
+				return False
+			self.deadline = self.budget
+			return True
+		finally:
+			self.lock.release()
+
+	def _think(self, previous, search, board):
+		if not self._begin(previous, search):
+			return
+		code = self._deepen(board)
+		if code is None:
+			log.info("No legal moves for %s", board.current_turn)
+			reply = None
+		else:
+			fro = SQUARE_POS[BIT_SQUARE[code & 63]]
+			to = SQUARE_POS[BIT_SQUARE[code >> 6 & 63]]
+			type = None
+			if code & MOVE_CROWNING:
+				type = CROWNING_CODES[code >> 12 & 3]
+			log.debug("Search engine plays %s (depth %d, %d nodes, score %d)",
+					board.decode_move(code), self.depth, self.nodes, self.score)
+			reply = (fro, to, type)
+		self.lock.acquire()
+		try:
+			if search != self.search:
+				#cancelled
+				return
+			callback = self.callback
+			if callback is None:
+				#pondered to the end before the player moved
+				self.answer = (reply,)
+				return
+		finally:
+			self.lock.release()
+		callback(reply)
+
+	def analyze(self, board, callback, lines=1):
+		'''See Engine. The lines best moves are found one at a time, each
+		by a full width search of the root moves not found yet, at every
+		depth.'''
+		self.cancel()
+		self.lock.acquire()
+		try:
+			self.search += 1
+			self.budget = time.time() + self.ANALYSIS_TIME
+		finally:
+			self.lock.release()
+		self._run(self._analyze, Board.from_fen(board.to_fen()), callback,
+				lines)
+
+	def _analyze(self, previous, search, board, callback, lines):
+		if not self._begin(previous, search):
+			return
+		self.board = board
+		self.nodes = 0
+		self._age_ordering()
+		moves = list(board.legal_move_codes(board.current_turn))
+		root = len(board.move_stack)
+		started = time.time()
+		#the scores of the last depth, to search the best moves first
+		scores = {}
+		try:
+			for depth in range(1, MAX_PLY / 2):
+				moves.sort(key=lambda x: -scores.get(x, -INFINITE))
+				left = list(moves)
+				for multipv in range(1, min(lines, len(moves)) + 1):
+					code, score = self._analyze_root(depth, left)
+					left.remove(code)
+					scores[code] = score
+					if search != self.search:
+						return
+					mate = None
+					if abs(score) > MATE - MAX_PLY:
+						#in moves, from plies
+						mate = (MATE - abs(score) + 1) / 2
+						if score < 0:
+							mate = -mate
+					elapsed = time.time() - started
+					callback(AnalysisLine(multipv, depth, score, mate,
+							self.nodes, int(elapsed and self.nodes / elapsed),
+							self.principal_variation(board, code, depth)))
+		except _TimeUp:
+			while len(board.move_stack) > root:
+				board.undo_move()
+
+	def _analyze_root(self, depth, moves):
+		'''Return the best of the root moves and its score, searched
+		depth plies deep.'''
+		board = self.board
+		owner = board.current_turn
+		best, alpha = moves[0], -INFINITE
+		for code in moves:
+			board.perform_move(board.decode_move(code, owner))
+			score = -self._search(depth - 1, -INFINITE, -alpha, 1)
+			board.undo_move()
+			if score > alpha:
+				best, alpha = code, score
+		return best, alpha
+
+	def principal_variation(self, board, code, length):
+		'''Return the moves, as coordinate strings, of the principal
+		variation starting with the packed move code on board, followed
+		up to length moves through the transposition table.'''
+		pv = []
+		while code and len(pv) < length and \
+			code in board.legal_move_codes(board.current_turn):
+			move = board.decode_move(code)
+			pv.append(str(move))
+			board.perform_move(move)
+			entry = self.table.get(board.position_key())
+			code = entry and entry[3]
+		for move in pv:
+			board.undo_move()
+		return pv
+
+	def move_now(self):
+		'''Stop the search and answer with the best move found so far.'''
+		self.lock.acquire()
+		try:
+			self.budget = self.deadline = 0
+		finally:
+			self.lock.release()
+
+	def cancel(self):
+		'''Stop the search, if any, pondering included, without
+		answering. Does not wait: the search thread stops within 1024
+		nodes, and the next search waits for it.'''
+		self.ponder_key = None
+		self.lock.acquire()
+		try:
+			self.search += 1
+			self.deadline = 0
+		finally:
+			self.lock.release()
+
+	def close(self):
+		self.cancel()
+		if self.thread:
+			self.thread.join()
+			self.thread = None
+		self.table.clear()
+
+	def assert_sync(self, board):
+		#searches get a copy of the game board, which is always in sync
+		pass
+
+	def think(self, board, time_limit=None):
+		'''Return the best packed move found for the side to move on board
+		within time_limit seconds (by default the engine's budget), or None
+		if there are no legal moves.
+
+		The board is searched in place and left as it was found.
+
+		'''
+		if time_limit is None:
+			time_limit = self.time_limit
+		self.deadline = time.time() + time_limit
+		return self._deepen(board)
+
+	def _deepen(self, board):
+		'''Search board deeper and deeper until self.deadline, see think.'''
+		self.board = board
+		self.nodes = 0
+		if len(self.table) > self.TABLE_SIZE:
+			self.table.clear()
+		self._age_ordering()
+
+		moves = board.legal_move_codes(board.current_turn)
+		if not moves:
+			return None
+		best = moves[0]
+		root = len(board.move_stack)
+		key = board.position_key()
+		for depth in range(1, self.max_depth + 1):
+			try:
+				score = self._search(depth, -INFINITE, INFINITE, 0)
+			except _TimeUp:
+				while len(board.move_stack) > root:
+					board.undo_move()
+				break
+			best = self.table[key][3]
+			self.depth, self.score = depth, score
+			if abs(score) > MATE - MAX_PLY:
+				#found a mate, deeper searches will not change the move
+				break
+		return best
+
+	def _search_move(self, board, code, depth, alpha, beta, deadline):
+		'''Return the (code, score, nodes) of the root move code searched
+		depth plies deep in the window alpha, beta. score is None if the
+		deadline passed first.'''
+		self.board = board
+		self.nodes = 0
+		self.deadline = deadline
+		if len(self.table) > self.TABLE_SIZE:
+			self.table.clear()
+		self._age_ordering()
+		root = len(board.move_stack)
+		board.perform_move(board.decode_move(code))
+		try:
+			score = -self._search(depth - 1, -beta, -alpha, 1)
+		except _TimeUp:
+			score = None
+		while len(board.move_stack) > root:
+			board.undo_move()
+		return code, score, self.nodes
+
+	def _time_up(self):
+		'''Return True if the search must stop. Checked every 1024 nodes.'''
+		return time.time() > self.deadline
+
+	def evaluate(self):
+		'''Return the static score of the board for the side to move.'''
+		return self.board.evaluate()
+
+	def _search(self, depth, alpha, beta, ply):
+		'''Negamax alpha-beta: return the score of the board for the side
+		to move, searched depth plies deep.'''
+		self.nodes += 1
+		if not self.nodes & 1023 and self._time_up():
+			raise _TimeUp()
+		if depth <= 0:
+			if self.quiescence:
+				return self._quiesce(alpha, beta, ply)
+			return self.evaluate()
+
+		board = self.board
+		key = board.position_key()
+		best_move = 0
+		entry = self.table.get(key)
+		if entry:
+			entry_depth, kind, score, best_move = entry
+			if ply and entry_depth >= depth:
+				score = _score_from_table(score, ply)
+				if kind == EXACT or \
+					kind == LOWER and score >= beta or \
+					kind == UPPER and score <= alpha:
+					return score
+		#won endings are still searched, to find the way to mate
+		if ply and self.bitbases and self.bitbases.probe(board) == DRAW:
+			return 0
+
+		owner = board.current_turn
+		moves = self.plies[ply]
+		del moves[:]
+		board.legal_move_codes(owner, moves)
+		if not moves:
+			if board.king_is_checked(owner):
+				return ply - MATE
+			return 0
+
+		start_alpha = alpha
+		best = -INFINITE
+		if self.ordering:
+			moves = self._pick(moves, ply, best_move)
+		for code in moves:
+			board.perform_move(board.decode_move(code, owner))
+			score = -self._search(depth - 1, -beta, -alpha, ply + 1)
+			board.undo_move()
+			if score > best:
+				best, best_move = score, code
+				if score > alpha:
+					alpha = score
+					if alpha >= beta:
+						self._cutoff(code, depth, ply)
+						break
+
+		if best >= beta:
+			kind = LOWER
+		elif best <= start_alpha:
+			kind = UPPER
+		else:
+			kind = EXACT
+		self.table[key] = depth, kind, _score_to_table(best, ply), best_move
+		return best
+
+	def _quiesce(self, alpha, beta, ply):
+		'''Search captures only, until the position is quiet, so that
+		the horizon of the full width search does not stop in the middle
+		of an exchange. The side to move may also stand pat with the
+		static score.'''
+		self.nodes += 1
+		if not self.nodes & 1023 and self._time_up():
+			raise _TimeUp()
+		best = self.evaluate()
+		if best >= beta or ply >= MAX_PLY - 1:
+			return best
+		if best > alpha:
+			alpha = best
+
+		board = self.board
+		owner = board.current_turn
+		moves = self.plies[ply]
+		del moves[:]
+		board.legal_move_codes(owner, moves)
+		captures = self._captures(moves, self.ordering)
+		for value, code in captures:
+			board.perform_move(board.decode_move(code, owner))
+			score = -self._quiesce(-beta, -alpha, ply + 1)
+			board.undo_move()
+			if score > best:
+				best = score
+				if score > alpha:
+					alpha = score
+					if alpha >= beta:
+						break
+		return best
+
+	def _captures(self, moves, sort=True):
+		'''Return (value, code) pairs for the captures and crownings among
+		moves. If sort is True, they come most valuable victim first and,
+		for equal victims, least valuable attacker first (MVV-LVA).'''
+		squares = self.board.squares
+		captures = []
+		for code in moves:
+			victim = squares[BIT_SQUARE[code >> 6 & 63]] & KIND_MASK
+			if code & MOVE_FLAGS == MOVE_EN_PASSANT:
+				victim = PAWN
+			elif code & MOVE_CROWNING:
+				victim += QUEEN
+			elif not victim:
+				continue
+			attacker = squares[BIT_SQUARE[code & 63]] & KIND_MASK
+			captures.append((victim * 8 - attacker, code))
+		if sort:
+			captures.sort(reverse=True)
+		return captures
+
+	def _pick(self, moves, ply, best_move):
+		'''Generate moves in the order most likely to cause a cutoff:
+		the best move from the transposition table, captures in MVV-LVA
+		order, the killer moves of this ply and then the other quiet moves
+		by history score. Every stage is only sorted when reached.'''
+		if best_move and best_move in moves:
+			yield best_move
+		for value, code in self._captures(moves):
+			if code != best_move:
+				yield code
+
+		squares = self.board.squares
+		quiets = [x for x in moves
+				if not squares[BIT_SQUARE[x >> 6 & 63]] and
+					not x & MOVE_CROWNING and
+					x & MOVE_FLAGS != MOVE_EN_PASSANT and x != best_move]
+		killers = [x for x in self.killers[ply] if x and x in quiets]
+		for code in killers:
+			yield code
+
+		history = self.history
+		quiets.sort(key=lambda x: -history[x & 4095])
+		for code in quiets:
+			if code not in killers:
+				yield code
+
+	def _cutoff(self, code, depth, ply):
+		'''Remember the quiet move code that caused a beta cutoff.'''
+		if self.board.squares[BIT_SQUARE[code >> 6 & 63]] or \
+			code & (MOVE_CROWNING | MOVE_EN_PASSANT):
+			return
+		killers = self.killers[ply]
+		if killers[0] != code:
+			killers[1] = killers[0]
+			killers[0] = code
+		self.history[code & 4095] += depth * depth
+
+	def _age_ordering(self):
+		'''Forget the killers and halve the history scores of the last
+		search, which were for a different root.'''
+		for killers in self.killers:
+			killers[0] = killers[1] = 0
+		history = self.history
+		for i in range(4096):
+			history[i] >>= 1
+
+def _score_to_table(score, ply):
+	'''Mate scores are stored relative to the position, not the root.'''
+	if score > MATE - MAX_PLY:
+		return score + ply
+	if score < MAX_PLY - MATE:
+		return score - ply
+	return score
+
+def _score_from_table(score, ply):
+	if score > MATE - MAX_PLY:
+		return score - ply
+	if score < MAX_PLY - MATE:
+		return score + ply
+	return score
+
+class _WorkerEngine(SearchEngine):
+	'''SearchEngine of a ParallelSearchEngine worker process. Besides its
+	deadline, a search stops as soon as the shared generation counter no
+	longer holds the generation it was started for.'''
+
+	def __init__(self, max_depth, generation):
+		super(_WorkerEngine, self).__init__(max_depth=max_depth,
+				bitbases=Bitbases.open_default())
+		self.generation = generation
+		self.search_generation = 0
+
+	def _time_up(self):
+		return time.time() > self.deadline or \
+				self.generation.value != self.search_generation
+
+#Per process state of the ParallelSearchEngine workers, see _init_worker
+_worker = {}
+
+def _init_worker(max_depth, generation):
+	_worker['engine'] = _WorkerEngine(max_depth, generation)
+	_worker['snapshot'] = None
+	_worker['board'] = None
+
+def _search_root_move((snapshot, code, depth, alpha, beta, deadline,
+		generation)):
+	'''Worker: search the root move code of the position in snapshot (see
+	Board.snapshot), see SearchEngine._search_move.'''
+	engine = _worker['engine']
+	engine.search_generation = generation
+	if engine.generation.value != generation:
+		#stopped while queued
+		return code, None, 0
+	if _worker['snapshot'] != snapshot:
+		board = Board()
+		board.load_snapshot(snapshot)
+		_worker['board'], _worker['snapshot'] = board, snapshot
+	return engine._search_move(_worker['board'], code, depth,
+			alpha, beta, deadline)
+
+class ParallelSearchEngine(SearchEngine):
+	'''SearchEngine splitting the root moves across worker processes.
+
+	Positions go to the workers as Board.snapshot tuples of a few dozen
+	bytes. Every worker keeps its own board and transposition table
+	between searches. At each depth the best move of the previous
+	iteration is searched first to get a score to beat. The other moves
+	are then searched in parallel with a null window around that score,
+	and the few that beat it are searched again with a full window.
+
+	Workers get a copy of the deadline with every root move. To stop them
+	earlier, move_now and cancel bump a generation counter shared with
+	them, which they poll along with the deadline.
+
+	'''
+	def __init__(self, workers=None, time_limit=SearchEngine.DEFAULT_TIME,
+			max_depth=SearchEngine.DEFAULT_DEPTH, bitbases=None):
+		'''Create a new instance of ParallelSearchEngine running workers
+		processes, by default one per core. bitbases is for the searches
+		run in this process, such as analysis: workers open their own.'''
+		super(ParallelSearchEngine, self).__init__(time_limit, max_depth,
+				bitbases=bitbases)
+		self.workers = workers or cpu_count()
+		self.generation = Value('i', 0)
+		self.pool = Pool(self.workers, _init_worker,
+				(max_depth, self.generation))
+
+	def _stop_workers(self):
+		'''Make the workers drop the root moves they are searching.'''
+		lock = self.generation.get_lock()
+		lock.acquire()
+		try:
+			self.generation.value += 1
+		finally:
+			lock.release()
+
+	def move_now(self):
+		super(ParallelSearchEngine, self).move_now()
+		self._stop_workers()
+
+	def cancel(self):
+		self._stop_workers()
+		super(ParallelSearchEngine, self).cancel()
+
+	def close(self):
+		super(ParallelSearchEngine, self).close()
+		if self.pool:
+			self.pool.terminate()
+			self.pool.join()
+			self.pool = None
+
+	def _deepen(self, board):
+		self.nodes = 0
+		generation = self.generation.value
+
+		moves = list(board.legal_move_codes(board.current_turn))
+		if not moves:
+			return None
+		snapshot = board.snapshot()
+		for depth in range(1, self.max_depth + 1):
+			scores = self._search_root(snapshot, moves, depth, generation)
+			if scores is None:
+				break
+			#search the best moves first on the next iteration
+			moves.sort(key=lambda x: -scores[x])
+			self.depth, self.score = depth, scores[moves[0]]
+			if abs(self.score) > MATE - MAX_PLY:
+				break
+		return moves[0]
+
+	def _search_root(self, snapshot, moves, depth, generation):
+		'''Return a dict with the score of the best of moves and upper
+		bounds for the other ones, or None if time ran out or the workers
+		were stopped.'''
+		def search(tasks):
+			results = self.pool.map(_search_root_move, tasks, 1)
+			for code, score, nodes in results:
+				self.nodes += nodes
+			if None in [score for code, score, nodes in results]:
+				return None
+			return results
+
+		results = search([(snapshot, moves[0], depth, -INFINITE, INFINITE,
+				self.deadline, generation)])
+		if results is None:
+			return None
+		scores = {moves[0]: results[0][1]}
+		alpha = results[0][1]
+		results = search([(snapshot, x, depth, alpha, alpha + 1,
+				self.deadline, generation) for x in moves[1:]])
+		if results is None:
+			return None
+		better = []
+		for code, score, nodes in results:
+			scores[code] = score
+			if score > alpha:
+				better.append(code)
+		if better:
+			results = search([(snapshot, x, depth, alpha, INFINITE,
+					self.deadline, generation) for x in better])
+			if results is None:
+				return None
+			for code, score, nodes in results:
+				scores[code] = score
+		return scores
+
+def _analyze_positions(conn):
+	'''Run in the process of an AnalysisSearchEngine: analyse the
+	positions received on the connection conn, and send the lines back.'''
+	engine = SearchEngine(bitbases=Bitbases.open_default())
+	def send(number, line):
+		#called on the engine's search thread
+		conn.send((number, line))
+	while True:
+		message = conn.recv()
+		if message is None:
+			break
+		number, fen, lines = message
+		if fen is None:
+			engine.cancel()
+		else:
+			engine.analyze(Board.from_fen(fen),
+					lambda line, number=number: send(number, line), lines)
+	engine.close()
+
+class AnalysisSearchEngine(Engine):
+	'''SearchEngine analysing in a process of its own.
+
+	The search is pure Python: on a thread of the GUI process it would
+	hold the interpreter lock against the frame loop for as long as the
+	analysis runs. Positions go to the process as FEN strings and the
+	lines come back through a pipe, numbered so that those of a cancelled
+	analysis are dropped. Only analysis is supported.
+
+	'''
+	def __init__(self):
+		self.conn, child = Pipe()
+		self.process = Process(target=_analyze_positions, args=(child,))
+		self.process.daemon = True
+		self.process.start()
+		child.close()
+		#the number of the analysis running and who wants its lines
+		self.number = 0
+		self.callback = None
+		self.lock = threading.Lock()
+		self.thread = threading.Thread(target=self._read)
+		self.thread.setDaemon(True)
+		self.thread.start()
+
+	def _read(self):
+		while True:
+			try:
+				number, line = self.conn.recv()
+			except (EOFError, IOError):
+				return
+			self.lock.acquire()
+			try:
+				callback = number == self.number and self.callback
+			finally:
+				self.lock.release()
+			if callback:
+				callback(line)
+
+	def _send(self, fen, callback, lines=0):
+		self.lock.acquire()
+		try:
+			self.number += 1
+			self.callback = callback
+			number = self.number
+		finally:
+			self.lock.release()
+		self.conn.send((number, fen, lines))
+
+	def analyze(self, board, callback, lines=1):
+		self._send(board.to_fen(), callback, lines)
+
+	def cancel(self):
+		if self.process:
+			self._send(None, None)
+
+	def close(self):
+		if not self.process:
+			return
+		self.cancel()
+		self.conn.send(None)
+		self.process.join(1.0)
+		if self.process.is_alive():
+			self.process.terminate()
+			self.process.join()
+		self.process = None
+		self.thread.join()
+		self.conn.close()
@@ -0,0 +1,233 @@
+#
+#    Ceibal Chess - A chess activity for Sugar.
+#    Copyright (C) 2008, 2009 Alejandro Segovia <asegovi@gmail.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+'''Board state tests: the state stack, zobrist keys, en passant and FEN
+reading.
+
+Run with python -m pytest.
+'''
+from array import array
+
+from board import Board, START_FEN, MAILBOX, BITBOARD, MOVE_FLAGS, \
+		MOVE_EN_PASSANT, BIT_SQUARE, WHITE_KINGSIDE, WHITE_QUEENSIDE, square
+from errors import FenError
+from perft import SUITE, perft
+
+#1.e4 d5 2.e5 f5, and its key from the Polyglot book format description
+EP_FEN = 'rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3'
+EP_KEY = 0x22a48b5a8e47ff78
+
+def cell(name):
+	'''Return the (column, row) position of the algebraic square name.'''
+	return 'abcdefgh'.index(name[0]), 8 - int(name[1])
+
+def play(board, *moves):
+	for move in moves:
+		board.move_piece_in_cell_to(board.current_turn, cell(move[:2]),
+				cell(move[2:]))
+
+def pawn_moves(board, name):
+	'''Return the packed moves the pawn on the square name generates.'''
+	sq = square(cell(name))
+	out = array('H')
+	board.pieces[sq].gen_moves(sq, board, out)
+	return out
+
+def en_passants(moves):
+	return [x for x in moves if x & MOVE_FLAGS == MOVE_EN_PASSANT]
+
+def position(name):
+	'''Return a board set up with the perft suite position name.'''
+	fen = [x for x in SUITE if x[0] == name][0][1]
+	return Board.from_fen(fen)
+
+def state(board):
+	return (board.castling_rights, board.ep_square, board.ep_key,
+			board.halfmove_clock, board.zobrist, board.state_top,
+			str(board.squares))
+
+def test_undo_restores_state():
+	for name in 'kiwipete', 'en-passant', 'castling', 'promotion':
+		board = position(name)
+		before = state(board)
+		for code in board.legal_move_codes(board.current_turn):
+			board.perform_move(board.decode_move(code))
+			after = state(board)
+			for reply in board.legal_move_codes(board.current_turn):
+				board.perform_move(board.decode_move(reply))
+				board.undo_move()
+				assert state(board) == after
+			board.undo_move()
+			assert state(board) == before
+
+def test_castling_rights_follow_king():
+	board = position('kiwipete')
+	rights = board.castling_rights
+	play(board, 'e1f1')
+	assert board.castling_rights == \
+			rights & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+	board.undo_move()
+	assert board.castling_rights == rights
+
+def test_halfmove_clock():
+	board = Board.from_fen(START_FEN)
+	play(board, 'g1f3', 'g8f6')
+	assert board.halfmove_clock == 2
+	play(board, 'e2e4')
+	assert board.halfmove_clock == 0
+	board.undo_move()
+	assert board.halfmove_clock == 2
+
+def test_en_passant_key_after_double_step():
+	board = Board.from_fen(START_FEN)
+	play(board, 'e2e4', 'd7d5', 'e4e5', 'f7f5')
+	assert board.to_fen() == EP_FEN
+	assert board.position_key() == EP_KEY
+	assert Board.from_fen(EP_FEN).position_key() == EP_KEY
+
+def test_en_passant_key_without_capturer():
+	#no black pawn stands by e4, so the en passant column is not hashed
+	board = Board.from_fen(START_FEN)
+	play(board, 'e2e4')
+	assert board.position_key() == Board.from_fen(
+			'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1'
+			).position_key()
+
+def test_en_passant_capture_after_play():
+	for movegen in MAILBOX, BITBOARD:
+		board = Board.from_fen(START_FEN, movegen=movegen)
+		#the same position without en passant goes through the cache first
+		board.legal_move_index()
+		play(board, 'e2e4', 'd7d5', 'e4e5', 'f7f5')
+		info = board.legal_move_index()
+		assert info.can_move(square(cell('e5')), square(cell('f6')))
+		play(board, 'e5f6')
+		assert board[5, 3].piece is None
+
+def test_load_fen_clears_position_cache():
+	board = Board.from_fen(START_FEN)
+	board.legal_move_index()
+	board.load_fen(EP_FEN)
+	assert len(board.position_cache) == 0
+	assert board.move_index is None
+
+def test_pawn_en_passant_needs_enemy_pawn():
+	board = Board.from_fen(START_FEN)
+	play(board, 'e2e4')
+	#white pawns beside the e3 en passant square may not take on it
+	assert en_passants(pawn_moves(board, 'd2')) == []
+	assert en_passants(pawn_moves(board, 'f2')) == []
+
+def test_pawn_en_passant_capture():
+	board = Board.from_fen(
+			'rnbqkbnr/ppp1pppp/8/8/3pP3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 2')
+	moves = en_passants(pawn_moves(board, 'd4'))
+	assert [(BIT_SQUARE[x & 63], BIT_SQUARE[x >> 6 & 63]) for x in moves] == \
+			[(square(cell('d4')), square(cell('e3')))]
+	#wrong side: the en passant square is for black to capture on
+	assert en_passants(pawn_moves(board, 'd2')) == []
+
+def test_perft_en_passant():
+	name, fen, counts = [x for x in SUITE if x[0] == 'en-passant'][0]
+	for movegen in MAILBOX, BITBOARD:
+		board = Board.from_fen(fen, movegen=movegen)
+		assert perft(board, 3) == counts[2]
+
+def bad_fen(fen):
+	'''Return True if reading fen raises FenError.'''
+	try:
+		Board.from_fen(fen)
+	except FenError:
+		return True
+	return False
+
+def test_fen_round_trip():
+	for name, fen, counts in SUITE:
+		assert Board.from_fen(fen).to_fen() == fen
+	assert Board.from_fen(EP_FEN).to_fen() == EP_FEN
+	board = Board.from_fen(START_FEN)
+	play(board, 'e2e4', 'c7c5', 'g1f3')
+	assert board.to_fen() == \
+			'rnbqkbnr/pp1ppppp/8/2p5/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2'
+
+def test_fen_rank_lengths():
+	#7, 9 and 9 squares on the second rank, 7 ranks, 9 ranks, no king
+	assert bad_fen('rnbqkbnr/ppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1')
+	assert bad_fen('rnbqkbnr/pppppppp1/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1')
+	assert bad_fen('rnbqkbnr/ppp5p/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1')
+	assert bad_fen('rnbqkbnr/pppppppp/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1')
+	assert bad_fen('rnbqkbnr/pppppppp/8/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1')
+	assert bad_fen('rnbq1bnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQ - 0 1')
+
+def test_fen_en_passant_square():
+	#e3 is for black to capture on, e6 has no black pawn beyond it
+	assert bad_fen(
+			'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq e3 0 1')
+	assert bad_fen(
+			'rnbqkbnr/pppppppp/8/4P3/8/8/PPPP1PPP/RNBQKBNR w KQkq e6 0 1')
+	assert bad_fen('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR b KQkq e3 0 1')
+	assert bad_fen(
+			'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e4 0 1')
+	assert not bad_fen(
+			'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1')
+
+def test_fen_castling_rights():
+	assert bad_fen('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkx - 0 1')
+	#no rook on h1, black king on e7: only white's queenside right is kept
+	board = Board.from_fen('r3q2r/4k3/8/8/8/8/8/R3K3 w KQkq - 0 1')
+	assert board.to_fen() == 'r3q2r/4k3/8/8/8/8/8/R3K3 w Q - 0 1'
+	assert board.position_key() == Board.from_fen(
+			'r3q2r/4k3/8/8/8/8/8/R3K3 w Q - 0 1').position_key()
+
+def test_rejected_fen_leaves_board():
+	board = Board.from_fen(START_FEN)
+	play(board, 'e2e4', 'd7d5', 'e4e5', 'f7f5')
+	key, turns = board.position_key(), board.turns
+	for fen in ('rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBN w KQkq - 0 3',
+			'rnbq1bnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQ - 0 3',
+			'rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq e3 0 3'):
+		try:
+			board.load_fen(fen)
+		except FenError:
+			pass
+		else:
+			assert False, fen
+		assert board.to_fen() == EP_FEN
+		assert board.position_key() == key
+		assert board.turns == turns
+	play(board, 'e5f6')
+	assert board[5, 3].piece is None
+
+def test_load_fen_resets_turns():
+	board = Board.from_fen(START_FEN)
+	play(board, 'e2e4', 'd7d5')
+	board.load_fen(EP_FEN)
+	assert board.turns == 1
+	assert board.move_stack == []
+
+def test_see_from_once_per_position():
+	#the knight on f3 may take the defended pawn on e5
+	board = Board.from_fen(
+			'rnbqkbnr/pppp1ppp/8/4p3/8/5N2/PPPPPPPP/RNBQKB1R w KQkq - 0 2')
+	info = board.legal_move_index()
+	f3 = square(cell('f3'))
+	values = info.see_from(f3)
+	assert values == [board.see(x) for x in info.moves_from(f3)]
+	assert min(values) < 0
+	assert info.see_from(f3) is values
+	assert board.legal_move_index().see_from(f3) is values
@@ -0,0 +1,82 @@
+#
+#    Ceibal Chess - A chess activity for Sugar.
+#    Copyright (C) 2008, 2009 Alejandro Segovia <asegovi@gmail.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+'''Analysis tests for SearchEngine, ParallelSearchEngine and
+AnalysisSearchEngine.
+
+Run with python -m pytest.
+'''
+import time
+import threading
+
+from board import Board, START_FEN
+from searchengine import SearchEngine, ParallelSearchEngine, \
+		AnalysisSearchEngine
+
+#white mates with Ra8
+MATE_FEN = '6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1'
+
+def analyse(engine, fen, lines, depth, timeout=30.0):
+	'''Analyse fen on engine until every one of lines variations was
+	reported at depth, and return the lines reported last.'''
+	latest = {}
+	done = threading.Event()
+	def update(line):
+		latest[line.multipv] = line
+		if len(latest) == lines and \
+			min([x.depth for x in latest.values()]) >= depth:
+			done.set()
+	engine.analyze(Board.from_fen(fen), update, lines)
+	done.wait(timeout)
+	engine.cancel()
+	return [latest[x] for x in sorted(latest)]
+
+def check_engine(engine):
+	try:
+		result = analyse(engine, START_FEN, 3, 2)
+		assert [x.multipv for x in result] == [1, 2, 3]
+		assert min([x.depth for x in result]) >= 2
+		#three different first moves, each with its reply
+		assert len(set([x.pv[0] for x in result])) == 3
+		assert min([len(x.pv) for x in result]) >= 2
+
+		result = analyse(engine, MATE_FEN, 1, 2)
+		assert result[0].pv[0] == 'a1a8'
+		assert result[0].mate == 1
+	finally:
+		engine.close()
+
+def test_analysis():
+	check_engine(SearchEngine())
+
+def test_parallel_analysis():
+	check_engine(ParallelSearchEngine(workers=2))
+
+def test_process_analysis():
+	check_engine(AnalysisSearchEngine())
+
+def test_cancel_does_not_wait():
+	engine = ParallelSearchEngine(workers=2, time_limit=30.0, max_depth=30)
+	try:
+		engine.request_move(None, Board.from_fen(START_FEN), lambda x: None)
+		time.sleep(0.5)
+		start = time.time()
+		engine.cancel()
+		assert time.time() - start < 0.1
+	finally:
+		engine.close()
@@ -17,15 +17,17 @@
 #    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 #
 import pygame
-import os
-import gettext
 from gettext import gettext as _
 from resourcemanager import image_manager
 
+#StatePanel state of each result BoardController.adjudicate finds
+RESULT_STATES = {'1-0': 'won_white', '0-1': 'won_black', '1/2-1/2': 'draw'}
+
 class StatePanel:
 	'''Shows the current game state in a panel. The displayed game state 
 	usually implies displaying the current turn (white or black), and 
-	indicating a Checkmate.'''
+	indicating a Checkmate, or the result of an ending the endgame
+	bitbases know.'''
 	
 	def __init__(self, x, y, w, h):
 		'''Create a new instance of State Panel.
@@ -35,15 +37,26 @@ class StatePanel:
 		self.state = "move_white"
 		self.x, self.y, self.w, self.h = x, y, w, h
 		self.loaded = False
+		self.material = 0
+		self.material_text = None
 	
 	def set_state(self, state):
 		'''Set the state to the given parameter.
 		Valid states are: move_white, move_black, check_white, check_black,
-		checkmate_white and checkmate_black .'''
+		checkmate_white, checkmate_black, won_white, won_black and draw.'''
 		if not state in ["move_white", "move_black", "check_white", \
-				"check_black", "checkmate_white", "checkmate_black"]:
+				"check_black", "checkmate_white", "checkmate_black", \
+				"won_white", "won_black", "draw"]:
 			raise Exception("Invalid State: " + state)
 		self.state = state
+
+	def set_material(self, balance):
+		'''Set the material balance shown: white's material minus black's,
+		in centipawns (see Board.material_balance). The text is only
+		rendered again when the balance changes.'''
+		if balance != self.material:
+			self.material = balance
+			self.material_text = None
 	
 	def initialize(self):
 		'''Initialize Fonts, Images, etc.'''
@@ -54,18 +67,25 @@ class StatePanel:
 		pawn_black = image_manager.get_image("pawnblack.png")
 		king_white = image_manager.get_image("kingwhite.png")
 		king_black = image_manager.get_image("kingblack.png")
+		king = image_manager.get_image("king.png")
 		
 		self.turn_imgs = { "move_white" : pawn_white, \
 				"move_black" : pawn_black, \
 				"check_white" : king_white, \
 				"check_black" : king_black, \
 				"checkmate_white" : king_white, \
-				"checkmate_black" : king_black }
+				"checkmate_black" : king_black, \
+				"won_white" : king_white, \
+				"won_black" : king_black, \
+				"draw" : king }
 		
 		font = pygame.font.Font(None, 25)
 		self.turn_text = font.render(_("Current Turn:"), 1, (255, 255, 255))
 		self.check_text = font.render(_("Check:"), 1, (255, 255, 0))
 		self.mate_text = font.render(_("Checkmate:"), 1, (255, 20, 20))
+		self.won_text = font.render(_("Wins:"), 1, (255, 20, 20))
+		self.draw_text = font.render(_("Draw"), 1, (255, 20, 20))
+		self.font = font
 		
 		self.loaded = True
 	
@@ -83,6 +103,10 @@ class StatePanel:
 			surface.blit(self.turn_text, (x+(w-self.turn_text.get_width())/2.0, w/5.5))
 		elif self.state in ["check_white", "check_black"]:
 			surface.blit(self.check_text, (x+(w-self.check_text.get_width())/2.0, w/5.5))
+		elif self.state in ["won_white", "won_black"]:
+			surface.blit(self.won_text, (x+(w-self.won_text.get_width())/2.0, w/5.5))
+		elif self.state == "draw":
+			surface.blit(self.draw_text, (x+(w-self.draw_text.get_width())/2.0, w/5.5))
 		else:
 			surface.blit(self.mate_text, (x+(w-self.mate_text.get_width())/2.0, w/5.5))
 		
@@ -90,6 +114,83 @@ class StatePanel:
 		iw, ih = img.get_width(), img.get_height()
 		surface.blit(img, pygame.Rect(x + (w-iw)/2, y + (h-ih)/2, iw, ih))
 
+		if self.material_text is None:
+			#in pawns, from white's side
+			self.material_text = self.font.render(_("Material: %+.1f") %
+					(self.material / 100.0), 1, (255, 255, 255))
+		text = self.material_text
+		surface.blit(text, (x+(w-text.get_width())/2.0, y + (h+ih)/2 + 10))
+
+class AnalysisPanel:
+	'''Shows the engine's analysis of the current position: the depth
+	and speed of the search, then a line per principal variation with its
+	score, from white's side, and its first moves.'''
+
+	#moves shown per variation
+	MOVES = 6
+
+	def __init__(self, x, y, w, h):
+		'''Create a new instance of AnalysisPanel.
+		x,y are the position where the panel will be rendered.
+		w,h are the panel's desired size.'''
+		self.x, self.y, self.w, self.h = x, y, w, h
+		self.loaded = False
+		self.lines = []
+		self.texts = None
+
+	def set_lines(self, lines):
+		'''Set the analysis.AnalysisLine tuples shown, best first. The
+		text is only rendered again when they change.'''
+		if lines is not self.lines:
+			self.lines = lines
+			self.texts = None
+
+	def initialize(self):
+		'''Initialize Fonts, Images, etc.'''
+		self.bg = pygame.transform.scale( \
+			image_manager.get_image("menu_back.png"), (self.w, self.h))
+		self.font = pygame.font.Font(None, 20)
+		self.title_text = pygame.font.Font(None, 25).render(_("Analysis"),
+				1, (255, 255, 255))
+		self.loaded = True
+
+	def _render_texts(self):
+		texts = []
+		if self.lines:
+			best = self.lines[0]
+			texts.append(self.font.render(_("Depth %d, %d kN/s") %
+					(best.depth, best.nps / 1000), 1, (200, 200, 200)))
+		for line in self.lines:
+			if line.mate is not None:
+				score = "#%d" % line.mate
+			else:
+				score = "%+.2f" % (line.score / 100.0)
+			texts.append(self.font.render("%s %s" % (score,
+					" ".join(line.pv[:self.MOVES])), 1, (255, 255, 255)))
+		return texts
+
+	def render(self, surface):
+		'''Render this panel on the given surface.'''
+
+		if not self.loaded:
+			self.initialize()
+		if self.texts is None:
+			self.texts = self._render_texts()
+
+		x,y,w,h = self.x, self.y, self.w, self.h
+
+		surface.blit(self.bg, pygame.Rect(x,y,w,h))
+		text = self.title_text
+		surface.blit(text, (x+(w-text.get_width())/2.0, y + 8))
+		y += 8 + text.get_height() + 6
+		for text in self.texts:
+			if y + text.get_height() > self.y + h:
+				break
+			#lines too long for the panel are cut
+			surface.blit(text, (x + 6, y),
+					pygame.Rect(0, 0, w - 12, text.get_height()))
+			y += text.get_height() + 4
+
 class BoardRenderer(object):
 	def __init__(self, w, h):
 		self.background = None
@@ -98,22 +199,38 @@ class BoardRenderer(object):
 		self.cell_renderer = CellRenderer(PieceRenderer())
 
 	def render_moves_for_piece_in_cell(self, board, surface, cell):
-		'''Highlight possible moves for the piece in the given cell'''
+		'''Highlight possible moves for the piece in the given cell.
+
+		When it is the piece owner's turn, destinations where the piece
+		would lose material in the following exchange (see Board.see) are
+		highlighted in a warning colour. Exchanges are evaluated once per
+		position, see PositionInfo.see_from.
+
+		'''
 		if cell.piece is None:
 			raise Exception("cell does not contain a piece!")
 
 		#select hightlight colors:
-		if cell.piece.owner == board.current_turn:
+		own_turn = cell.piece.owner == board.current_turn
+		if own_turn:
 			color = (0, 255, 0)
 			color2 = (0, 180, 0)
 		else:
 			color = (255, 0, 0)
 			color2 = (180, 0, 0)
+		losing_color = (255, 160, 0)
 
-		dests = cell.piece.get_moves(cell.pos, board, filter_check=True)
+		info = board.legal_move_index(cell.piece.owner)
+		dests = info.moves_from(cell.square)
+		values = own_turn and info.see_from(cell.square)
 
-		for dest in dests:
-			self.cell_renderer.render_as_highlight(board[dest.to], surface, color)
+		for i, dest in enumerate(dests):
+			if own_turn and values[i] < 0:
+				self.cell_renderer.render_as_highlight(board[dest.to], surface,
+						losing_color)
+			else:
+				self.cell_renderer.render_as_highlight(board[dest.to], surface,
+						color)
 		self.cell_renderer.render_as_highlight(cell, surface, color2)
 
 	def render_background(self, board, surface):